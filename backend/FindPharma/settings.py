@@ -98,6 +98,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'FindPharma.wsgi.application'
+ASGI_APPLICATION = 'FindPharma.asgi.application'
 
 
 # Database
@@ -116,6 +117,11 @@ if (('test' in sys.argv and not USE_POSTGRES_FOR_TESTS) or USE_SQLITE):
     DATABASES['default'] = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Wait for write locks held by concurrent connections
+        'OPTIONS': {'timeout': 30},
+        # File-backed test DB (not in-memory) so that concurrency tests
+        # can open one connection per thread
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 else:
     DATABASES['default'] = {
@@ -335,4 +341,144 @@ MAX_VERIFICATION_ATTEMPTS = 5
 # CONFIGURATION GOOGLE OAUTH2
 # ============================================================
 GOOGLE_OAUTH2_CLIENT_ID = config('GOOGLE_OAUTH2_CLIENT_ID', default='')
-GOOGLE_OAUTH2_CLIENT_SECRET = config('GOOGLE_OAUTH2_CLIENT_SECRET', default='')
\ No newline at end of file
+GOOGLE_OAUTH2_CLIENT_SECRET = config('GOOGLE_OAUTH2_CLIENT_SECRET', default='')
+
+# ============================================================
+# INDEX SPATIAL DES PHARMACIES
+# ============================================================
+# Taille des cellules de la grille en degrés (0.05° ≈ 5.5 km)
+PHARMACY_INDEX_CELL_SIZE = config('PHARMACY_INDEX_CELL_SIZE', default=0.05, cast=float)
+# Reconstruction complète de l'index après ce délai (secondes), pour
+# rattraper les modifications faites par les autres workers
+PHARMACY_INDEX_TTL = config('PHARMACY_INDEX_TTL', default=300, cast=int)
+
+# ============================================================
+# INDEX DE RECHERCHE DES MÉDICAMENTS
+# ============================================================
+# Reconstruction complète de l'index de trigrammes après ce délai (secondes)
+MEDICINE_INDEX_TTL = config('MEDICINE_INDEX_TTL', default=300, cast=int)
+
+# Backend de recherche textuelle (chemin Python d'une classe de
+# medicines.search_backends). Vide : PostgreSQL plein texte si la base est
+# PostgreSQL, sinon index de trigrammes en mémoire.
+MEDICINE_SEARCH_BACKEND = config('MEDICINE_SEARCH_BACKEND', default='') or None
+
+# Nombre maximal de fautes de frappe tolérées par la recherche approchée
+MEDICINE_FUZZY_MAX_DISTANCE = config('MEDICINE_FUZZY_MAX_DISTANCE', default=2, cast=int)
+
+# ============================================================
+# CACHE DES CANDIDATS DE RECHERCHE
+# ============================================================
+# Taille des cellules géographiques de la clé du cache, en degrés (0.01° ≈ 1.1 km) ;
+# une cellule plus grande élargit les candidats lus pour chaque entrée
+SEARCH_CACHE_CELL_SIZE = config('SEARCH_CACHE_CELL_SIZE', default=0.01, cast=float)
+# Durée de vie d'une entrée (secondes) ; 0 désactive le cache
+SEARCH_CACHE_TTL = config('SEARCH_CACHE_TTL', default=60, cast=int)
+# Nombre maximal d'entrées avant éviction des moins récemment utilisées
+SEARCH_CACHE_MAX_ENTRIES = config('SEARCH_CACHE_MAX_ENTRIES', default=1000, cast=int)
+# Au-delà de ce nombre de modifications de stock (autres processus) à
+# rattraper avant une lecture, le cache est vidé
+SEARCH_CACHE_CATCH_UP = config('SEARCH_CACHE_CATCH_UP', default=1000, cast=int)
+
+# ============================================================
+# PAGINATION DE LA RECHERCHE
+# ============================================================
+# Médicaments par page de /api/search/ (paramètre limit)
+SEARCH_PAGE_SIZE = config('SEARCH_PAGE_SIZE', default=20, cast=int)
+# Pharmacies par médicament (paramètre pharmacies_limit)
+SEARCH_PHARMACIES_PER_MEDICINE = config('SEARCH_PHARMACIES_PER_MEDICINE', default=10, cast=int)
+# Valeur maximale acceptée pour limit et pharmacies_limit
+SEARCH_MAX_PAGE_SIZE = config('SEARCH_MAX_PAGE_SIZE', default=100, cast=int)
+
+# ============================================================
+# MATRICE DE DISPONIBILITÉ PHARMACIE × MÉDICAMENT
+# ============================================================
+# Reconstruction complète de la matrice après ce délai (secondes) ; entre
+# deux reconstructions, chaque lecture rattrape le flux StockChange
+AVAILABILITY_MATRIX_TTL = config('AVAILABILITY_MATRIX_TTL', default=300, cast=int)
+# Au-delà de ce nombre de modifications à rattraper, reconstruction complète
+AVAILABILITY_MATRIX_CATCH_UP = config('AVAILABILITY_MATRIX_CATCH_UP', default=1000, cast=int)
+
+# ============================================================
+# CLASSEMENT DES RÉSULTATS DE RECHERCHE
+# ============================================================
+# Poids des composantes du score de pertinence (pharmacies/ranking.py),
+# par exemple "text:3,distance:2,price:1,stock:0.5,rating:1". Les
+# composantes absentes gardent leur poids par défaut.
+SEARCH_RANKING_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (
+        item.split(':') for item in config('SEARCH_RANKING_WEIGHTS', default='').split(',') if item.strip()
+    )
+}
+
+# ============================================================
+# HISTORIQUE DES RECHERCHES
+# ============================================================
+# Les recherches sont écrites en base par lots par un thread de fond
+# (users/search_recorder.py) : taille d'un lot et délai maximal (secondes)
+SEARCH_HISTORY_BATCH_SIZE = config('SEARCH_HISTORY_BATCH_SIZE', default=100, cast=int)
+SEARCH_HISTORY_FLUSH_INTERVAL = config('SEARCH_HISTORY_FLUSH_INTERVAL', default=5, cast=float)
+# Part des recherches anonymes conservées (0 : aucune, 1 : toutes)
+SEARCH_HISTORY_ANONYMOUS_SAMPLE_RATE = config('SEARCH_HISTORY_ANONYMOUS_SAMPLE_RATE', default=0.1, cast=float)
+# Événements en attente au-delà desquels les nouvelles recherches sont perdues
+SEARCH_HISTORY_MAX_BUFFER = config('SEARCH_HISTORY_MAX_BUFFER', default=10000, cast=int)
+# Thread d'écriture en arrière-plan ; désactivé pendant les tests, qui
+# appellent search_recorder.flush() explicitement
+SEARCH_HISTORY_BACKGROUND = config('SEARCH_HISTORY_BACKGROUND', default='test' not in sys.argv, cast=bool)
+
+# ============================================================
+# IMPORT ET MODIFICATION EN MASSE DES STOCKS
+# ============================================================
+# Lignes traitées par lot (une requête de résolution des médicaments et
+# un INSERT ... ON CONFLICT par lot)
+STOCK_IMPORT_BATCH_SIZE = config('STOCK_IMPORT_BATCH_SIZE', default=1000, cast=int)
+# Modifications acceptées par PATCH /api/pharmacies/{id}/stocks/batch/
+STOCK_BATCH_MAX_ITEMS = config('STOCK_BATCH_MAX_ITEMS', default=1000, cast=int)
+
+# ============================================================
+# HISTORIQUE DES MOUVEMENTS DE STOCK
+# ============================================================
+# Mouvements par page de /api/my-pharmacy/stock-history/ (paramètre limit)
+STOCK_HISTORY_PAGE_SIZE = config('STOCK_HISTORY_PAGE_SIZE', default=50, cast=int)
+STOCK_HISTORY_MAX_PAGE_SIZE = config('STOCK_HISTORY_MAX_PAGE_SIZE', default=500, cast=int)
+
+# ============================================================
+# SYNCHRONISATION INCRÉMENTALE DES CAISSES (POS)
+# ============================================================
+# Modifications lues par page de /api/pharmacies/{id}/stocks/changes/
+STOCK_SYNC_PAGE_SIZE = config('STOCK_SYNC_PAGE_SIZE', default=500, cast=int)
+STOCK_SYNC_MAX_PAGE_SIZE = config('STOCK_SYNC_MAX_PAGE_SIZE', default=5000, cast=int)
+
+# ============================================================
+# EXPIRATION DES RÉSERVATIONS
+# ============================================================
+# Réservations expirées par transaction (python manage.py expire_reservations)
+RESERVATION_EXPIRY_BATCH_SIZE = config('RESERVATION_EXPIRY_BATCH_SIZE', default=500, cast=int)
+# Secondes entre deux passages du balayeur lancé avec --loop
+RESERVATION_EXPIRY_INTERVAL = config('RESERVATION_EXPIRY_INTERVAL', default=60, cast=float)
+
+# ============================================================
+# LISTE DES RÉSERVATIONS D'UNE PHARMACIE
+# ============================================================
+# Réservations par page de /api/reservations/pharmacy/ (paramètre limit)
+RESERVATION_PAGE_SIZE = config('RESERVATION_PAGE_SIZE', default=50, cast=int)
+RESERVATION_MAX_PAGE_SIZE = config('RESERVATION_MAX_PAGE_SIZE', default=200, cast=int)
+
+# ============================================================
+# FLUX EN DIRECT DES RÉSERVATIONS (/api/reservations/events/)
+# ============================================================
+# Courtier des événements : reservations.events.LocalBroker (un seul
+# processus) ou reservations.events.PostgresBroker (LISTEN/NOTIFY, quand
+# l'API, le balayeur et le worker ASGI du flux sont des processus distincts)
+RESERVATION_EVENT_BROKER = config('RESERVATION_EVENT_BROKER', default='reservations.events.LocalBroker')
+# Événements récents gardés par pharmacie pour les reconnexions
+RESERVATION_EVENT_HISTORY = config('RESERVATION_EVENT_HISTORY', default=200, cast=int)
+# Secondes entre deux commentaires de maintien d'une connexion SSE
+RESERVATION_EVENT_HEARTBEAT = config('RESERVATION_EVENT_HEARTBEAT', default=15, cast=float)
+# Durée maximale (secondes) d'une connexion SSE avant reconnexion du client
+RESERVATION_EVENT_STREAM_TIMEOUT = config('RESERVATION_EVENT_STREAM_TIMEOUT', default=300, cast=float)
+# Délai de reconnexion (millisecondes) indiqué aux clients SSE
+RESERVATION_EVENT_RETRY = config('RESERVATION_EVENT_RETRY', default=3000, cast=int)
+# Attente maximale (secondes) d'une requête long-poll
+RESERVATION_EVENT_POLL_TIMEOUT = config('RESERVATION_EVENT_POLL_TIMEOUT', default=25, cast=float)
@@ -0,0 +1,31 @@
+"""
+Curseurs opaques pour la pagination par clé (keyset).
+
+Un curseur est la position du dernier élément renvoyé (par exemple
+``[nom, id]``), sérialisée en JSON puis encodée en base64 URL-safe. Le
+client le renvoie tel quel pour obtenir la page suivante ; le serveur
+reprend la requête juste après cette position au lieu d'utiliser un
+OFFSET.
+"""
+import base64
+import binascii
+import json
+
+
+def encode_cursor(position):
+    """Encode une position (valeurs JSON) en curseur opaque"""
+    raw = json.dumps(position, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Décode un curseur produit par ``encode_cursor``.
+
+    Lève ``ValueError`` si le curseur est invalide.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as exc:
+        raise ValueError('Curseur invalide') from exc
@@ -118,7 +118,8 @@ def admin_dashboard_stats(request):
     ).annotate(
         day=TruncDate('created_at')
     ).values('day').annotate(
-        count=Count('id')
+        # Une ligne peut représenter plusieurs recherches anonymes échantillonnées
+        count=Sum('weight')
     ).order_by('day')
     
     searches_chart_data = [
@@ -144,7 +145,7 @@ def admin_dashboard_stats(request):
     top_medicines_searched = SearchHistory.objects.filter(
         search_type='medicine'
     ).values('query').annotate(
-        count=Count('id')
+        count=Sum('weight')
     ).order_by('-count')[:10]
     
     top_medicines_data = [
@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ActiveIngredient, MedicineSynonym
+
+
+class MedicineSynonymInline(admin.TabularInline):
+    model = MedicineSynonym
+    extra = 1
+
+
+@admin.register(ActiveIngredient)
+class ActiveIngredientAdmin(admin.ModelAdmin):
+    """Principes actifs et leurs noms de marque, utilisés par la recherche"""
+
+    list_display = ['name', 'created_at']
+    search_fields = ['name', 'synonyms__name']
+    inlines = [MedicineSynonymInline]
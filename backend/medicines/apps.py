@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MedicineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'medicines'
+
+    def ready(self):
+        # Maintenir l'index de recherche à jour lors des écritures sur Medicine
+        from . import signals  # noqa: F401
@@ -0,0 +1,175 @@
+"""
+Index d'auto-complétion des médicaments en mémoire.
+
+Les lignes distinctes (nom, dosage, forme, catégorie) sont indexées dans un
+trie de suffixes : chaque suffixe du texte normalisé « nom dosage forme »
+est inséré jusqu'à ``MAX_DEPTH`` caractères, ce qui permet de retrouver une
+saisie n'importe où dans le texte (préfixe ou infixe). Chaque nœud garde les
+``TOP_K`` lignes les plus populaires qui passent par lui : une suggestion
+coûte un parcours de ``len(q)`` nœuds, sans requête SQL.
+
+La popularité d'une ligne est le nombre de stocks et d'articles réservés
+des médicaments correspondants.
+
+L'index est propre à chaque processus. Il est invalidé par les signaux de
+``Medicine`` et reconstruit à la demande suivante, ou après
+``MEDICINE_INDEX_TTL`` secondes pour suivre l'évolution de la popularité.
+La structure construite n'est jamais modifiée : une reconstruction prépare
+un nouveau trie puis remplace la référence, les lectures ne prennent donc
+pas de verrou.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count
+
+from .text_index import normalize
+
+
+# Profondeur maximale du trie : au-delà, les candidats du nœud le plus
+# profond sont filtrés par sous-chaîne
+MAX_DEPTH = 6
+
+# Lignes conservées par nœud (l'ancienne requête en lisait 10)
+TOP_K = 10
+
+# Suggestions retournées au client
+MAX_SUGGESTIONS = 8
+
+
+class _Node:
+    __slots__ = ('children', 'rows')
+
+    def __init__(self):
+        self.children = {}
+        # Ensemble pendant la construction, puis tuple trié
+        self.rows = set()
+
+
+class _Trie:
+    """Trie figé : racine, lignes et textes normalisés"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.texts = [normalize(' '.join(filter(None, (r['name'], r['dosage'], r['form'])))) for r in rows]
+        self.root = _Node()
+
+        for position, text in enumerate(self.texts):
+            for start in range(len(text)):
+                if text[start] == ' ':
+                    continue
+                node = self.root
+                for char in text[start:start + MAX_DEPTH]:
+                    node = node.children.setdefault(char, _Node())
+                    node.rows.add(position)
+
+        # Les lignes sont déjà triées par popularité : trier les positions suffit
+        self._freeze(self.root, 0)
+
+    def _freeze(self, node, depth):
+        ranked = sorted(node.rows)
+        # Les nœuds les plus profonds gardent toutes leurs lignes pour le filtrage
+        node.rows = tuple(ranked if depth == MAX_DEPTH else ranked[:TOP_K])
+        for child in node.children.values():
+            self._freeze(child, depth + 1)
+
+    def lookup(self, term, limit=TOP_K):
+        node = self.root
+        for char in term[:MAX_DEPTH]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        positions = node.rows
+        if len(term) > MAX_DEPTH:
+            positions = [p for p in positions if term in self.texts[p]]
+        return [self.rows[p] for p in positions[:limit]]
+
+
+class MedicineAutocompleteIndex:
+    """Trie de suggestions partagé par les threads du processus"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'MEDICINE_INDEX_TTL', 300)
+        self._lock = threading.Lock()
+        self._trie = None
+        self._built_at = None
+        # Incrémenté à chaque invalidation : une reconstruction lancée avant
+        # une écriture ne doit pas être considérée comme à jour
+        self._generation = 0
+
+    def rebuild(self):
+        """Reconstruit le trie depuis la base (une requête agrégée)"""
+        from .models import Medicine
+
+        generation = self._generation
+        rows = list(
+            Medicine.objects.values('name', 'dosage', 'form', 'category').annotate(
+                popularity=Count('stocks', distinct=True) + Count('reservation_items', distinct=True)
+            ).order_by('-popularity', 'name', 'dosage', 'form', 'category')
+        )
+        trie = _Trie(rows)
+        self._trie = trie
+        if generation == self._generation:
+            self._built_at = time.monotonic()
+        return trie
+
+    def invalidate(self):
+        """Force une reconstruction à la prochaine suggestion"""
+        self._generation += 1
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _current(self):
+        built_at = self._built_at
+        trie = self._trie
+        if trie is not None and built_at is not None and time.monotonic() - built_at <= self.ttl:
+            return trie
+        with self._lock:
+            # Un autre thread a pu reconstruire pendant l'attente du verrou
+            if self._built_at is not None and time.monotonic() - self._built_at <= self.ttl:
+                return self._trie
+            return self.rebuild()
+
+    def rows(self, query, limit=TOP_K):
+        """Lignes (nom, dosage, forme, catégorie) contenant la saisie, les plus populaires d'abord"""
+        term = normalize(query)
+        if not term:
+            return []
+        return self._current().lookup(term, limit)
+
+    def suggest(self, query):
+        """Suggestions au format de l'endpoint ``autocomplete``"""
+        suggestions = []
+        seen_names = set()
+
+        for med in self.rows(query):
+            # Suggestion du nom seul (unique)
+            if med['name'] not in seen_names:
+                suggestions.append({
+                    'type': 'name',
+                    'value': med['name'],
+                    'display': med['name'],
+                    'category': med['category']
+                })
+                seen_names.add(med['name'])
+
+            # Suggestion avec dosage
+            full_name = f"{med['name']} {med['dosage']}"
+            if full_name not in seen_names and med['dosage']:
+                suggestions.append({
+                    'type': 'full',
+                    'value': full_name,
+                    'display': f"{med['name']} {med['dosage']} ({med['form']})",
+                    'category': med['category']
+                })
+                seen_names.add(full_name)
+
+        return suggestions[:MAX_SUGGESTIONS]
+
+
+autocomplete_index = MedicineAutocompleteIndex()
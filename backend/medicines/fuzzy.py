@@ -0,0 +1,198 @@
+"""
+Recherche approchée des noms de médicaments (fautes de frappe).
+
+Les noms normalisés (voir ``text_index.normalize``) sont rangés dans un
+BK-tree : chaque nœud classe ses enfants par distance de Levenshtein, et
+l'inégalité triangulaire permet de n'explorer que les enfants dont la clé
+est dans ``[d - k, d + k]``. « amoxiciline » retrouve « Amoxicilline » et
+« doliprane500 » retrouve « Doliprane » sans comparer la saisie à tout le
+catalogue.
+
+Comme l'index d'auto-complétion, l'arbre est propre à chaque processus,
+invalidé par les signaux de ``Medicine`` et reconstruit à la demande
+suivante ; une fois construit il n'est plus modifié.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .text_index import normalize
+
+
+# Les nombres (dosages) et ce qui les suit sont retirés de la saisie
+_NUMBERS = re.compile(r'\d+[a-z]*')
+
+# Longueur minimale d'un mot cherché seul
+MIN_WORD_LENGTH = 4
+
+
+def _pattern(word):
+    """Masques de bits des positions de chaque caractère du mot"""
+    masks = {}
+    for i, char in enumerate(word):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return word, masks
+
+
+def _distance(pattern, text):
+    """
+    Distance de Levenshtein entre un motif préparé et un texte, par
+    l'algorithme bit-parallèle de Myers (une colonne de la matrice
+    d'édition par caractère du texte).
+    """
+    word, masks = pattern
+    length = len(word)
+    if not length:
+        return len(text)
+    full = (1 << length) - 1
+    high = 1 << (length - 1)
+    positive, negative, score = full, 0, length
+    for char in text:
+        eq = masks.get(char, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        hp = negative | (~(xh | positive) & full)
+        hn = positive & xh
+        if hp & high:
+            score += 1
+        elif hn & high:
+            score -= 1
+        hp = ((hp << 1) | 1) & full
+        hn = (hn << 1) & full
+        positive = hn | (~(xv | hp) & full)
+        negative = hp & xv
+    return score
+
+
+def levenshtein(a, b):
+    """Distance d'édition (insertion, suppression, substitution)"""
+    return _distance(_pattern(a), b)
+
+
+def distance_budget(term):
+    """Nombre de fautes tolérées selon la longueur du terme"""
+    limit = getattr(settings, 'MEDICINE_FUZZY_MAX_DISTANCE', 2)
+    return min(limit, max(1, len(term) // 4))
+
+
+class BKTree:
+    """BK-tree sur des chaînes, pour la distance de Levenshtein"""
+
+    def __init__(self, words=()):
+        self._root = None
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self._root is None:
+            self._root = (word, {})
+            self.size = 1
+            return
+        pattern = _pattern(word)
+        node_word, children = self._root
+        while True:
+            distance = _distance(pattern, node_word)
+            if distance == 0:
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (word, {})
+                self.size += 1
+                return
+            node_word, children = child
+
+    def search(self, word, max_distance):
+        """Liste ``(distance, mot)`` des mots à au plus ``max_distance``, triée"""
+        if self._root is None:
+            return []
+        pattern = _pattern(word)
+        results = []
+        stack = [self._root]
+        while stack:
+            node_word, children = stack.pop()
+            distance = _distance(pattern, node_word)
+            if distance <= max_distance:
+                results.append((distance, node_word))
+            for key in range(max(1, distance - max_distance), distance + max_distance + 1):
+                child = children.get(key)
+                if child is not None:
+                    stack.append(child)
+        return sorted(results)
+
+
+def query_terms(query):
+    """
+    Termes à chercher pour une saisie : la saisie sans ses nombres, puis
+    chacun de ses mots assez longs s'il y en a plusieurs.
+    """
+    words = _NUMBERS.sub(' ', normalize(query)).split()
+    if not words:
+        return []
+    terms = [' '.join(words)]
+    if len(words) > 1:
+        terms.extend(word for word in words if len(word) >= MIN_WORD_LENGTH)
+    return terms
+
+
+class MedicineFuzzyIndex:
+    """BK-tree des noms de médicaments partagé par les threads du processus"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'MEDICINE_INDEX_TTL', 300)
+        self._lock = threading.Lock()
+        # (arbre, nom normalisé -> (nom affiché, identifiants))
+        self._state = None
+        self._built_at = None
+        self._generation = 0
+
+    def rebuild(self):
+        """Reconstruit l'arbre depuis la base"""
+        from .models import Medicine
+
+        generation = self._generation
+        names = {}
+        for medicine_id, name in Medicine.objects.order_by('id').values_list('id', 'name').iterator():
+            key = normalize(name)
+            if key:
+                names.setdefault(key, (name, []))[1].append(medicine_id)
+
+        state = (BKTree(names), names)
+        self._state = state
+        if generation == self._generation:
+            self._built_at = time.monotonic()
+        return state
+
+    def invalidate(self):
+        """Force une reconstruction à la prochaine recherche"""
+        self._generation += 1
+        self._built_at = None
+
+    def _current(self):
+        built_at = self._built_at
+        if self._state is not None and built_at is not None and time.monotonic() - built_at <= self.ttl:
+            return self._state
+        with self._lock:
+            if self._built_at is not None and time.monotonic() - self._built_at <= self.ttl:
+                return self._state
+            return self.rebuild()
+
+    def closest(self, query):
+        """
+        Noms canoniques les plus proches de la saisie, dans le budget de
+        fautes : ``[(nom, [identifiants]), ...]`` à distance minimale, triés
+        par nom. Liste vide si rien n'est assez proche.
+        """
+        tree, names = self._current()
+        for term in query_terms(query):
+            matches = tree.search(term, distance_budget(term))
+            if matches:
+                best = matches[0][0]
+                keys = [key for distance, key in matches if distance == best]
+                return sorted((names[key] for key in keys), key=lambda entry: entry[0])
+        return []
+
+
+fuzzy_index = MedicineFuzzyIndex()
@@ -0,0 +1,74 @@
+"""
+Management command to seed active ingredients and their brand names.
+"""
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from medicines.models import ActiveIngredient, MedicineSynonym
+
+
+class Command(BaseCommand):
+    help = 'Seed active ingredients (DCI) and brand synonyms from the medicines JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete existing ingredients and synonyms before seeding',
+        )
+
+    def handle(self, *args, **options):
+        json_path = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            'data',
+            'medicines_database.json'
+        )
+
+        if not os.path.exists(json_path):
+            self.stdout.write(
+                self.style.ERROR(f'JSON file not found: {json_path}')
+            )
+            return
+
+        with open(json_path, 'r', encoding='utf-8') as f:
+            medicines_data = json.load(f)
+
+        with transaction.atomic():
+            if options['clear']:
+                deleted_count, _ = ActiveIngredient.objects.all().delete()
+                self.stdout.write(
+                    self.style.WARNING(f'Deleted {deleted_count} existing ingredients and synonyms')
+                )
+
+            names = [med_data['name'] for med_data in medicines_data]
+            existing = set(ActiveIngredient.objects.filter(name__in=names).values_list('name', flat=True))
+            ActiveIngredient.objects.bulk_create(
+                [ActiveIngredient(name=name) for name in names if name not in existing]
+            )
+            ingredients = dict(ActiveIngredient.objects.filter(name__in=names).values_list('name', 'id'))
+
+            synonyms = [
+                MedicineSynonym(ingredient_id=ingredients[med_data['name']], name=synonym, kind=kind)
+                for med_data in medicines_data
+                for kind, key in (('brand', 'brands'), ('alias', 'aliases'))
+                for synonym in med_data.get(key, [])
+            ]
+            before = MedicineSynonym.objects.count()
+            MedicineSynonym.objects.bulk_create(synonyms, ignore_conflicts=True)
+            created_synonyms = MedicineSynonym.objects.count() - before
+
+        # bulk_create sends no signals; other processes pick the new
+        # synonyms up when their index expires (MEDICINE_INDEX_TTL)
+        from medicines.synonyms import synonym_index
+        synonym_index.invalidate()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nSeeding complete!\n'
+                f'  Ingredients created: {len(names) - len(existing)}\n'
+                f'  Synonyms created: {created_synonyms}'
+            )
+        )
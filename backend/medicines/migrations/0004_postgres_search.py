@@ -0,0 +1,69 @@
+# Recherche plein texte PostgreSQL pour les médicaments :
+# - extensions unaccent et pg_trgm ;
+# - configuration française sans accents (findpharma_fr) ;
+# - colonne générée search_vector (nom A, description B, indications C)
+#   indexée en GIN ;
+# - index GIN trigrammes sur le nom normalisé.
+# Sans effet sur les autres bases (SQLite en développement et en test).
+
+from django.db import migrations
+
+
+FORWARD_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # unaccent() n'est pas IMMUTABLE : enveloppe utilisable dans les index
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS
+    $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'findpharma_fr') THEN
+            CREATE TEXT SEARCH CONFIGURATION findpharma_fr (COPY = french);
+            ALTER TEXT SEARCH CONFIGURATION findpharma_fr
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+        END IF;
+    END $$
+    """,
+    """
+    ALTER TABLE medicines_medicine ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('findpharma_fr'::regconfig, coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('findpharma_fr'::regconfig, coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('findpharma_fr'::regconfig, coalesce(indications, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS medicine_search_vector_gin "
+    "ON medicines_medicine USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS medicine_name_trgm_gin "
+    "ON medicines_medicine USING gin (f_unaccent(lower(name)) gin_trgm_ops)",
+]
+
+BACKWARD_SQL = [
+    "DROP INDEX IF EXISTS medicine_name_trgm_gin",
+    "DROP INDEX IF EXISTS medicine_search_vector_gin",
+    "ALTER TABLE medicines_medicine DROP COLUMN IF EXISTS search_vector",
+    "DROP TEXT SEARCH CONFIGURATION IF EXISTS findpharma_fr",
+    "DROP FUNCTION IF EXISTS f_unaccent(text)",
+]
+
+
+def run_sql(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("medicines", "0003_alter_medicine_options_medicine_category_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(FORWARD_SQL), run_sql(BACKWARD_SQL)),
+    ]
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("medicines", "0004_postgres_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActiveIngredient",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True, verbose_name="DCI")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Principe actif",
+                "verbose_name_plural": "Principes actifs",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.CreateModel(
+            name="MedicineSynonym",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, verbose_name="Nom")),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("brand", "Nom de marque"), ("alias", "Autre appellation")],
+                        default="brand",
+                        max_length=10,
+                        verbose_name="Type",
+                    ),
+                ),
+                (
+                    "ingredient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="synonyms",
+                        to="medicines.activeingredient",
+                        verbose_name="Principe actif",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Synonyme",
+                "verbose_name_plural": "Synonymes",
+                "ordering": ["name"],
+                "constraints": [
+                    models.UniqueConstraint(fields=("ingredient", "name"), name="unique_ingredient_synonym")
+                ],
+            },
+        ),
+    ]
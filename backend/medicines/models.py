@@ -100,4 +100,52 @@ class Medicine(models.Model):
     
     def get_category_display_fr(self):
         """Retourne le nom de la catégorie en français"""
-        return dict(self.CATEGORY_CHOICES).get(self.category, 'Autre')
\ No newline at end of file
+        return dict(self.CATEGORY_CHOICES).get(self.category, 'Autre')
+
+class ActiveIngredient(models.Model):
+    """
+    Principe actif (DCI) : regroupe les noms sous lesquels les patients
+    cherchent un même médicament (voir ``synonyms.py``).
+    """
+    name = models.CharField(max_length=255, unique=True, verbose_name="DCI")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = "Principe actif"
+        verbose_name_plural = "Principes actifs"
+
+    def __str__(self):
+        return self.name
+
+
+class MedicineSynonym(models.Model):
+    """Nom de marque ou autre appellation d'un principe actif"""
+
+    KIND_CHOICES = [
+        ('brand', 'Nom de marque'),
+        ('alias', 'Autre appellation'),
+    ]
+
+    ingredient = models.ForeignKey(
+        ActiveIngredient,
+        on_delete=models.CASCADE,
+        related_name='synonyms',
+        verbose_name="Principe actif"
+    )
+    name = models.CharField(max_length=255, verbose_name="Nom")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='brand', verbose_name="Type")
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = "Synonyme"
+        verbose_name_plural = "Synonymes"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ingredient', 'name'],
+                name='unique_ingredient_synonym'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ingredient.name})"
@@ -0,0 +1,112 @@
+"""
+Backends de recherche textuelle des médicaments.
+
+Tous les backends exposent ``search(terms, fields, limit)`` et retournent
+des identifiants de médicaments classés par pertinence :
+
+- ``PostgresFullTextBackend`` : colonne ``search_vector`` (tsvector, config
+  française avec ``unaccent``) et similarité ``pg_trgm`` sur le nom, toutes
+  deux indexées en GIN (voir la migration ``0004_postgres_search``) ;
+  classement par ``ts_rank`` + ``similarity``.
+- ``TrigramIndexBackend`` : index de trigrammes en mémoire (``text_index``),
+  utilisé sur SQLite et pour les tests.
+
+Le backend est choisi par le réglage ``MEDICINE_SEARCH_BACKEND`` (chemin
+Python d'une classe) ou, par défaut, selon le moteur de base de données.
+"""
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .text_index import INDEXED_FIELDS, medicine_index, normalize
+
+
+# Configuration plein texte créée par la migration 0004_postgres_search
+TEXT_SEARCH_CONFIG = 'findpharma_fr'
+
+# Poids tsvector de chaque champ indexé
+FIELD_LABELS = {
+    'name': 'A',
+    'description': 'B',
+    'indications': 'C',
+}
+
+
+class BaseSearchBackend:
+    """Interface commune des backends de recherche"""
+
+    def search(self, terms, fields=INDEXED_FIELDS, limit=None):
+        """
+        Identifiants des médicaments dont un des ``fields`` correspond à au
+        moins un des ``terms``, du plus pertinent au moins pertinent.
+        """
+        raise NotImplementedError
+
+
+class TrigramIndexBackend(BaseSearchBackend):
+    """Recherche par l'index de trigrammes en mémoire"""
+
+    def search(self, terms, fields=INDEXED_FIELDS, limit=None):
+        ids = medicine_index.search(terms, fields=fields)
+        return ids[:limit] if limit is not None else ids
+
+
+class PostgresFullTextBackend(BaseSearchBackend):
+    """Recherche plein texte PostgreSQL (tsvector + pg_trgm)"""
+
+    @staticmethod
+    def _tsquery(terms, fields):
+        # Mots d'un même terme combinés en ET, termes combinés en OU ; préfixe
+        # (:*) et restriction aux poids des champs demandés. normalize() ne
+        # laisse que [a-z0-9 ], la chaîne est donc une tsquery valide.
+        labels = ''.join(FIELD_LABELS[field] for field in fields)
+        clauses = []
+        for term in terms:
+            words = term.split()
+            clauses.append('(' + ' & '.join(f'{word}:*{labels}' for word in words) + ')')
+        return ' | '.join(clauses)
+
+    def search(self, terms, fields=INDEXED_FIELDS, limit=None):
+        terms = [term for term in map(normalize, terms) if term]
+        if not terms:
+            return []
+
+        params = {'tsquery': self._tsquery(terms, fields), 'limit': limit}
+        conditions = ['m.search_vector @@ q.query']
+        similarity = '0'
+        if 'name' in fields:
+            # Sous-chaîne et similarité sur le nom (index GIN gin_trgm_ops)
+            params['likes'] = [f'%{term}%' for term in terms]
+            params['term'] = ' '.join(terms)
+            conditions.append('f_unaccent(lower(m.name)) LIKE ANY(%(likes)s)')
+            conditions.append('f_unaccent(lower(m.name)) %% %(term)s')
+            similarity = 'similarity(f_unaccent(lower(m.name)), %(term)s)'
+
+        sql = f"""
+            SELECT m.id
+            FROM medicines_medicine m,
+                 to_tsquery('{TEXT_SEARCH_CONFIG}', %(tsquery)s) AS q(query)
+            WHERE {' OR '.join(conditions)}
+            ORDER BY ts_rank(m.search_vector, q.query) + {similarity} DESC, m.name, m.id
+            LIMIT %(limit)s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Instance du backend de recherche configuré (créée une seule fois)"""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'MEDICINE_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresFullTextBackend()
+        else:
+            _backend = TrigramIndexBackend()
+    return _backend
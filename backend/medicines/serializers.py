@@ -50,6 +50,8 @@ class MedicineSerializer(serializers.ModelSerializer):
 
 class MedicineSearchResultSerializer(serializers.ModelSerializer):
     pharmacies = serializers.SerializerMethodField()
+    more_pharmacies = serializers.SerializerMethodField()
+    relevance = serializers.SerializerMethodField()
     total_pharmacies = serializers.SerializerMethodField()
     min_price = serializers.SerializerMethodField()
     max_price = serializers.SerializerMethodField()
@@ -58,22 +60,42 @@ class MedicineSearchResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = Medicine
         fields = ['id', 'name', 'description', 'dosage', 'form',
-                  'requires_prescription', 'pharmacies', 'total_pharmacies',
-                  'min_price', 'max_price']
+                  'requires_prescription', 'pharmacies', 'more_pharmacies',
+                  'total_pharmacies', 'min_price', 'max_price', 'relevance']
+
+    def _pharmacies(self, obj):
+        """Pharmacies attachées par le moteur de recherche, sinon passées dans le context"""
+        pharmacies = getattr(obj, 'search_pharmacies', None)
+        if pharmacies is None:
+            pharmacies = self.context.get('pharmacies', [])
+        return pharmacies
 
     def get_pharmacies(self, obj):
-        """Liste des pharmacies avec ce médicament"""
-        # Les pharmacies avec distance seront passées dans le context
-        pharmacies = self.context.get('pharmacies', [])
+        """Liste des pharmacies avec ce médicament (page courante si limitée)"""
+        pharmacies = getattr(obj, 'pharmacies_page', None)
+        if pharmacies is None:
+            pharmacies = self._pharmacies(obj)
         return PharmacyWithStockSerializer(pharmacies, many=True).data
 
+    def get_more_pharmacies(self, obj):
+        """Curseur des pharmacies suivantes, ou None"""
+        return getattr(obj, 'more_pharmacies', None)
+
+    def get_relevance(self, obj):
+        """Score de pertinence (0 à 1) calculé par le moteur de recherche, ou None"""
+        return getattr(obj, 'relevance', None)
+
     def get_total_pharmacies(self, obj):
         """Nombre total de pharmacies ayant ce médicament"""
-        return len(self.context.get('pharmacies', []))
+        if hasattr(obj, 'search_total_pharmacies'):
+            return obj.search_total_pharmacies
+        return len(self._pharmacies(obj))
 
     def get_min_price(self, obj):
         """Prix minimum parmi toutes les pharmacies"""
-        pharmacies = self.context.get('pharmacies', [])
+        if hasattr(obj, 'search_min_price'):
+            return obj.search_min_price
+        pharmacies = self._pharmacies(obj)
         if not pharmacies:
             return None
         prices = [p.stock_info.price for p in pharmacies if hasattr(p, 'stock_info')]
@@ -81,8 +103,10 @@ class MedicineSearchResultSerializer(serializers.ModelSerializer):
 
     def get_max_price(self, obj):
         """Prix maximum parmi toutes les pharmacies"""
-        pharmacies = self.context.get('pharmacies', [])
+        if hasattr(obj, 'search_max_price'):
+            return obj.search_max_price
+        pharmacies = self._pharmacies(obj)
         if not pharmacies:
             return None
         prices = [p.stock_info.price for p in pharmacies if hasattr(p, 'stock_info')]
-        return float(max(prices)) if prices else None
\ No newline at end of file
+        return float(max(prices)) if prices else None
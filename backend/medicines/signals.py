@@ -0,0 +1,50 @@
+"""
+Signaux maintenant les index de recherche des médicaments à jour, au
+commit de l'écriture (jamais si elle est annulée).
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .fuzzy import fuzzy_index
+from .models import ActiveIngredient, Medicine, MedicineSynonym
+from .synonyms import synonym_index
+from .text_index import medicine_index
+
+
+def _invalidate_derived_indexes():
+    autocomplete_index.invalidate()
+    fuzzy_index.invalidate()
+    synonym_index.invalidate()
+
+
+@receiver(post_save, sender=Medicine)
+def update_text_index(sender, instance, **kwargs):
+    """Réindexe le médicament après création ou modification"""
+    def update():
+        medicine_index.update(instance)
+        _invalidate_derived_indexes()
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Medicine)
+def remove_from_text_index(sender, instance, **kwargs):
+    """Retire un médicament supprimé de l'index"""
+    medicine_id = instance.pk
+
+    def remove():
+        medicine_index.remove(medicine_id)
+        _invalidate_derived_indexes()
+
+    transaction.on_commit(remove)
+
+
+@receiver(post_save, sender=ActiveIngredient)
+@receiver(post_delete, sender=ActiveIngredient)
+@receiver(post_save, sender=MedicineSynonym)
+@receiver(post_delete, sender=MedicineSynonym)
+def invalidate_synonym_index(sender, instance, **kwargs):
+    """Recharge l'index des synonymes après une modification"""
+    transaction.on_commit(synonym_index.invalidate)
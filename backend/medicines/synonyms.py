@@ -0,0 +1,113 @@
+"""
+Index d'expansion des synonymes de médicaments (DCI et noms de marque).
+
+Les patients cherchent « Doliprane » ou « Coartem » alors que le catalogue
+nomme les médicaments par leur DCI (« Paracétamol »,
+« Artemether-Lumefantrine ») ou par un nom composé (« Amoxicilline + Acide
+Clavulanique »). Chaque ``ActiveIngredient`` regroupe sa DCI et ses
+``MedicineSynonym`` ; un médicament appartient au groupe si son nom
+normalisé contient l'un de ces noms comme suite de mots.
+
+L'index associe chaque nom normalisé du groupe à l'ensemble des
+identifiants des médicaments du groupe : ``expand("doliprane 500")``
+retourne directement tous les paracétamols, avant la recherche des stocks.
+Il est propre à chaque processus, invalidé par les signaux des synonymes
+et de ``Medicine`` et reconstruit à la demande suivante. Les données
+initiales viennent de ``data/medicines_database.json`` (commande
+``load_synonyms``).
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .fuzzy import query_terms
+from .text_index import normalize
+
+
+class MedicineSynonymIndex:
+    """Nom normalisé -> identifiants des médicaments équivalents"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'MEDICINE_INDEX_TTL', 300)
+        self._lock = threading.Lock()
+        # (nom normalisé -> frozenset d'identifiants, nombre de mots maximal)
+        self._state = None
+        self._built_at = None
+        self._generation = 0
+
+    def rebuild(self):
+        """Reconstruit l'index depuis la base"""
+        from .models import ActiveIngredient, Medicine, MedicineSynonym
+
+        generation = self._generation
+        groups = defaultdict(set)
+        for ingredient_id, name in ActiveIngredient.objects.values_list('id', 'name').iterator():
+            groups[ingredient_id].add(normalize(name))
+        for ingredient_id, name in MedicineSynonym.objects.values_list('ingredient_id', 'name').iterator():
+            groups[ingredient_id].add(normalize(name))
+
+        # Noms des groupes indexés par leur premier mot
+        by_first_word = defaultdict(list)
+        for ingredient_id, names in groups.items():
+            for name in names:
+                words = tuple(name.split())
+                if words:
+                    by_first_word[words[0]].append((words, ingredient_id))
+
+        members = defaultdict(set)
+        if by_first_word:
+            for medicine_id, name in Medicine.objects.values_list('id', 'name').iterator():
+                words = normalize(name).split()
+                for position, word in enumerate(words):
+                    for phrase, ingredient_id in by_first_word.get(word, ()):
+                        if tuple(words[position:position + len(phrase)]) == phrase:
+                            members[ingredient_id].add(medicine_id)
+
+        terms = defaultdict(set)
+        for ingredient_id, names in groups.items():
+            for name in names:
+                if name:
+                    terms[name] |= members[ingredient_id]
+        longest = max((len(name.split()) for name in terms), default=0)
+
+        state = ({name: frozenset(ids) for name, ids in terms.items() if ids}, longest)
+        self._state = state
+        if generation == self._generation:
+            self._built_at = time.monotonic()
+        return state
+
+    def invalidate(self):
+        """Force une reconstruction à la prochaine expansion"""
+        self._generation += 1
+        self._built_at = None
+
+    def _current(self):
+        built_at = self._built_at
+        if self._state is not None and built_at is not None and time.monotonic() - built_at <= self.ttl:
+            return self._state
+        with self._lock:
+            if self._built_at is not None and time.monotonic() - self._built_at <= self.ttl:
+                return self._state
+            return self.rebuild()
+
+    def expand(self, query):
+        """
+        Identifiants (triés) des médicaments équivalents à un nom de la
+        saisie : DCI, marque ou autre appellation, dosages ignorés.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        words = terms[0].split()
+        index, longest = self._current()
+
+        ids = set()
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + longest, len(words)) + 1):
+                ids |= index.get(' '.join(words[start:end]), frozenset())
+        return sorted(ids)
+
+
+synonym_index = MedicineSynonymIndex()
@@ -1,3 +1,298 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework import status
 
-# Create your tests here.
+from .models import ActiveIngredient, Medicine, MedicineSynonym
+from . import search_backends
+from .autocomplete import MedicineAutocompleteIndex
+from .fuzzy import BKTree, MedicineFuzzyIndex, levenshtein, query_terms
+from .search_backends import PostgresFullTextBackend, TrigramIndexBackend, get_search_backend
+from .synonyms import MedicineSynonymIndex, synonym_index
+from .text_index import MedicineTextIndex, medicine_index, normalize
+
+
+class MedicineTextIndexTestCase(TestCase):
+    """Tests pour l'index de trigrammes des médicaments"""
+
+    def setUp(self):
+        self.index = MedicineTextIndex(ttl=300)
+        self.paracetamol = Medicine.objects.create(
+            name='Paracétamol', dosage='500mg', form='comprimé',
+            description='Analgésique et antipyrétique',
+            indications='Douleurs et fièvre'
+        )
+        self.ibuprofene = Medicine.objects.create(
+            name='Ibuprofène', dosage='400mg', form='comprimé',
+            description='Anti-inflammatoire non stéroïdien'
+        )
+
+    def test_normalize(self):
+        self.assertEqual(normalize('  Ibuprofène 400MG '), 'ibuprofene 400mg')
+        self.assertEqual(normalize('Amoxicilline + Acide'), 'amoxicilline acide')
+
+    def test_accent_insensitive(self):
+        """Les variantes sans accent trouvent les noms accentués"""
+        self.assertEqual(self.index.search(['paracetamol']), [self.paracetamol.id])
+        self.assertEqual(self.index.search(['IBUPROFENE']), [self.ibuprofene.id])
+        self.assertEqual(self.index.search(['fievre']), [self.paracetamol.id])
+
+    def test_fields_and_scoring(self):
+        """Une correspondance sur le nom passe avant la description"""
+        Medicine.objects.create(
+            name='Doliprane', dosage='1000mg', form='comprimé',
+            description='Contient du paracétamol'
+        )
+        self.assertEqual(self.index.search(['fievre'], fields=('name', 'description')), [])
+        ids = self.index.search(['paracetamol'])
+        self.assertEqual(ids[0], self.paracetamol.id)
+        self.assertEqual(len(ids), 2)
+
+    def test_partial_overlap(self):
+        """Avec min_overlap < 1, un nom mal orthographié est retrouvé"""
+        self.assertEqual(self.index.search(['paracetamoll']), [])
+        self.assertIn(self.paracetamol.id, self.index.search(['paracetamoll'], min_overlap=0.7))
+
+    def test_incremental_updates(self):
+        """L'index suit les créations, modifications et suppressions"""
+        self.assertEqual(self.index.search(['quinine']), [])
+
+        quinine = Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        self.index.update(quinine)
+        self.assertEqual(self.index.search(['quinine']), [quinine.id])
+
+        quinine.name = 'Artésunate'
+        quinine.save()
+        self.index.update(quinine)
+        self.assertEqual(self.index.search(['quinine']), [])
+        self.assertEqual(self.index.search(['artesunate']), [quinine.id])
+
+        self.index.remove(quinine.id)
+        self.assertEqual(self.index.search(['artesunate']), [])
+
+
+class SearchBackendTestCase(TestCase):
+    """Tests pour le choix et l'interface des backends de recherche"""
+
+    def setUp(self):
+        search_backends._backend = None
+        medicine_index.invalidate()
+
+    def tearDown(self):
+        search_backends._backend = None
+
+    def test_default_backend_on_sqlite(self):
+        self.assertIsInstance(get_search_backend(), TrigramIndexBackend)
+
+    @override_settings(MEDICINE_SEARCH_BACKEND='medicines.search_backends.PostgresFullTextBackend')
+    def test_backend_from_settings(self):
+        self.assertIsInstance(get_search_backend(), PostgresFullTextBackend)
+
+    def test_trigram_backend_limit(self):
+        for name in ('Amoxicilline', 'Amlodipine', 'Ampicilline'):
+            Medicine.objects.create(name=name, dosage='500mg', form='gélule')
+        backend = TrigramIndexBackend()
+        self.assertEqual(len(backend.search(['am'])), 3)
+        self.assertEqual(len(backend.search(['am'], limit=2)), 2)
+
+    def test_postgres_tsquery(self):
+        """Préfixes pondérés : mots en ET, termes en OU"""
+        self.assertEqual(
+            PostgresFullTextBackend._tsquery(['acide folique', 'fer'], ('name', 'description')),
+            '(acide:*AB & folique:*AB) | (fer:*AB)'
+        )
+
+
+class MedicineAutocompleteIndexTestCase(TestCase):
+    """Tests pour le trie d'auto-complétion"""
+
+    def setUp(self):
+        Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé', category='analgesique')
+        Medicine.objects.create(name='Paracétamol', dosage='1000mg', form='comprimé', category='analgesique')
+        Medicine.objects.create(name='Amoxicilline', dosage='500mg', form='gélule', category='antibiotique')
+        self.index = MedicineAutocompleteIndex()
+
+    def test_prefix_and_infix(self):
+        self.assertEqual({r['name'] for r in self.index.rows('para')}, {'Paracétamol'})
+        self.assertEqual({r['name'] for r in self.index.rows('cetamol')}, {'Paracétamol'})
+        # Saisie plus longue que la profondeur du trie
+        self.assertEqual({r['name'] for r in self.index.rows('amoxicilline 500')}, {'Amoxicilline'})
+        self.assertEqual(self.index.rows('xyz'), [])
+
+    def test_no_query_once_built(self):
+        self.index.rows('para')
+        with self.assertNumQueries(0):
+            self.index.rows('amox')
+
+    def test_suggestion_format(self):
+        suggestions = self.index.suggest('parac')
+        self.assertEqual(suggestions[0], {
+            'type': 'name', 'value': 'Paracétamol', 'display': 'Paracétamol', 'category': 'analgesique'
+        })
+        self.assertEqual(
+            {s['display'] for s in suggestions[1:]},
+            {'Paracétamol 500mg (comprimé)', 'Paracétamol 1000mg (comprimé)'}
+        )
+
+    def test_ranked_by_popularity(self):
+        from pharmacies.models import Pharmacy
+        from stocks.models import Stock
+
+        pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Test', address='Yaoundé', phone='+237600000000',
+            latitude=3.8480, longitude=11.5021
+        )
+        amoxicilline = Medicine.objects.get(name='Amoxicilline')
+        Stock.objects.create(pharmacy=pharmacy, medicine=amoxicilline, quantity=10, price=1500)
+        self.assertEqual(self.index.rows('500')[0]['name'], 'Amoxicilline')
+
+    def test_invalidate(self):
+        self.index.rows('para')
+        Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        self.index.invalidate()
+        self.assertEqual([r['name'] for r in self.index.rows('quin')], ['Quinine'])
+
+
+class FuzzyMatchTestCase(TestCase):
+    """Tests pour la recherche approchée des noms"""
+
+    def test_levenshtein(self):
+        self.assertEqual(levenshtein('amoxiciline', 'amoxicilline'), 1)
+        self.assertEqual(levenshtein('kitten', 'sitting'), 3)
+        self.assertEqual(levenshtein('', 'abc'), 3)
+        self.assertEqual(levenshtein('abc', 'abc'), 0)
+
+    def test_bk_tree_matches_linear_scan(self):
+        words = ['paracetamol', 'amoxicilline', 'ampicilline', 'ibuprofene', 'aspirine', 'quinine']
+        tree = BKTree(words)
+        for query in ('amoxiciline', 'aspirin', 'kinine', 'zzz'):
+            expected = sorted((levenshtein(query, w), w) for w in words if levenshtein(query, w) <= 2)
+            self.assertEqual(tree.search(query, 2), expected)
+
+    def test_query_terms(self):
+        self.assertEqual(query_terms('Doliprane500'), ['doliprane'])
+        self.assertEqual(query_terms('acide folique 5mg'), ['acide folique', 'acide', 'folique'])
+
+    def test_closest(self):
+        amoxicilline = Medicine.objects.create(name='Amoxicilline', dosage='500mg', form='gélule')
+        Medicine.objects.create(name='Ampicilline', dosage='1g', form='injectable')
+        index = MedicineFuzzyIndex()
+        self.assertEqual(index.closest('amoxiciline'), [('Amoxicilline', [amoxicilline.id])])
+        self.assertEqual(index.closest('paracetamol'), [])
+
+
+class MedicineSynonymIndexTestCase(TestCase):
+    """Tests pour l'expansion des DCI et noms de marque"""
+
+    def setUp(self):
+        synonym_index.invalidate()
+        self.paracetamol = Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        self.doliprane = Medicine.objects.create(name='Doliprane', dosage='1000mg', form='comprimé')
+        self.augmentin = Medicine.objects.create(
+            name='Amoxicilline + Acide Clavulanique', dosage='1g', form='comprimé'
+        )
+        self.amoxicilline = Medicine.objects.create(name='Amoxicilline', dosage='500mg', form='gélule')
+        self.folique = Medicine.objects.create(name='Acide folique', dosage='5mg', form='comprimé')
+
+        paracetamol = ActiveIngredient.objects.create(name='Paracétamol')
+        MedicineSynonym.objects.create(ingredient=paracetamol, name='Doliprane')
+        MedicineSynonym.objects.create(ingredient=paracetamol, name='Efferalgan')
+        amoxicilline = ActiveIngredient.objects.create(name='Amoxicilline')
+        MedicineSynonym.objects.create(ingredient=amoxicilline, name='Clamoxyl')
+
+    def test_brand_expands_to_ingredient(self):
+        index = MedicineSynonymIndex()
+        expected = sorted([self.paracetamol.id, self.doliprane.id])
+        self.assertEqual(index.expand('doliprane'), expected)
+        self.assertEqual(index.expand('Efferalgan 500mg'), expected)
+        self.assertEqual(index.expand('paracetamol'), expected)
+
+    def test_composite_names_belong_to_each_ingredient(self):
+        index = MedicineSynonymIndex()
+        self.assertEqual(
+            index.expand('clamoxyl'),
+            sorted([self.augmentin.id, self.amoxicilline.id])
+        )
+        # « acide » seul n'est le nom d'aucun principe actif
+        self.assertEqual(index.expand('acide'), [])
+        self.assertEqual(index.expand('ibuprofene'), [])
+
+    def test_reloaded_on_change(self):
+        self.assertEqual(synonym_index.expand('dafalgan'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            MedicineSynonym.objects.create(
+                ingredient=ActiveIngredient.objects.get(name='Paracétamol'), name='Dafalgan'
+            )
+        self.assertIn(self.paracetamol.id, synonym_index.expand('dafalgan'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dafalgan = Medicine.objects.create(name='Dafalgan', dosage='500mg', form='comprimé')
+        self.assertIn(dafalgan.id, synonym_index.expand('paracetamol'))
+
+    def test_load_synonyms_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        call_command('load_synonyms', stdout=StringIO())
+        call_command('load_synonyms', stdout=StringIO())
+        coartem = MedicineSynonym.objects.get(name='Coartem')
+        self.assertEqual(coartem.ingredient.name, 'Artemether-Lumefantrine')
+        self.assertEqual(MedicineSynonym.objects.filter(name='Doliprane').count(), 1)
+
+
+class MedicineSearchEndpointsTestCase(APITestCase):
+    """Tests pour les endpoints de recherche de médicaments"""
+
+    def setUp(self):
+        medicine_index.invalidate()
+        Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        Medicine.objects.create(
+            name='Ibuprofène', dosage='400mg', form='comprimé',
+            indications='Douleurs musculaires'
+        )
+
+    def test_search_action(self):
+        response = self.client.get(reverse('medicine-search'), {'q': 'paracetamol'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['name'] for m in response.data['results']], ['Paracétamol'])
+
+    def test_list_search_uses_index(self):
+        """Le filtre ?search= couvre aussi les indications, sans accents"""
+        response = self.client.get(reverse('medicine-list'), {'search': 'musculaires'})
+        self.assertEqual([m['name'] for m in response.data['results']], ['Ibuprofène'])
+
+    def test_autocomplete(self):
+        from .autocomplete import autocomplete_index
+
+        autocomplete_index.invalidate()
+        response = self.client.get(reverse('medicine-autocomplete'), {'q': 'ibu'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [s['value'] for s in response.data['suggestions']], ['Ibuprofène', 'Ibuprofène 400mg']
+        )
+        # Le trie est invalidé au commit des écritures sur Medicine
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.create(name='Ibuprofène Enfant', dosage='100mg', form='sirop')
+        response = self.client.get(reverse('medicine-autocomplete'), {'q': 'ibu'})
+        self.assertIn('Ibuprofène Enfant', [s['value'] for s in response.data['suggestions']])
+
+    def test_index_patched_on_save(self):
+        """Un médicament créé après construction de l'index est trouvé"""
+        url = reverse('medicine-search')
+        self.assertEqual(self.client.get(url, {'q': 'quinine'}).data['results'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        self.assertEqual(len(self.client.get(url, {'q': 'quinine'}).data['results']), 1)
+
+    def test_rolled_back_save_leaves_index_untouched(self):
+        from django.db import transaction
+
+        medicine_index.search(['quinine'])
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+                    raise RuntimeError('annulée')
+            except RuntimeError:
+                pass
+        self.assertEqual(medicine_index.search(['quinine']), [])
@@ -0,0 +1,195 @@
+"""
+Index inversé en mémoire sur les trigrammes des médicaments.
+
+Les champs ``name``, ``description`` et ``indications`` sont normalisés
+(minuscules, accents supprimés, ponctuation remplacée par des espaces) puis
+découpés en trigrammes. Une recherche intersecte les listes de trigrammes
+du terme au lieu de parcourir toute la table avec ``icontains``, et
+« paracetamol » trouve « Paracétamol ».
+
+L'index est propre à chaque processus : construit à la première
+utilisation, patché par les signaux de ``Medicine`` (voir ``signals.py``)
+et reconstruit périodiquement pour rattraper les écritures des autres
+workers.
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+
+INDEXED_FIELDS = ('name', 'description', 'indications')
+
+# Poids d'une correspondance selon le champ : le nom prime sur le reste
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'description': 1.0,
+    'indications': 1.0,
+}
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """Minuscules, sans accents, ponctuation remplacée par des espaces"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', text.lower()).strip()
+
+
+def trigrams(text):
+    """Ensemble des trigrammes d'un texte déjà normalisé"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class MedicineTextIndex:
+    """
+    Pour chaque champ indexé : trigramme -> ensemble d'identifiants de
+    médicaments, et identifiant -> texte normalisé.
+
+    Toutes les méthodes publiques sont thread-safe.
+    """
+
+    def __init__(self, ttl=None):
+        # Durée de vie de l'index avant reconstruction complète (secondes)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'MEDICINE_INDEX_TTL', 300)
+        self._lock = threading.RLock()
+        self._postings = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        self._texts = {field: {} for field in INDEXED_FIELDS}
+        self._built_at = None
+
+    def _add(self, postings, texts, medicine_id, values):
+        for field in INDEXED_FIELDS:
+            text = normalize(values.get(field))
+            texts[field][medicine_id] = text
+            for gram in trigrams(text):
+                postings[field][gram].add(medicine_id)
+
+    def _discard(self, medicine_id):
+        for field in INDEXED_FIELDS:
+            text = self._texts[field].pop(medicine_id, None)
+            if text is None:
+                continue
+            for gram in trigrams(text):
+                ids = self._postings[field].get(gram)
+                if ids is not None:
+                    ids.discard(medicine_id)
+                    if not ids:
+                        del self._postings[field][gram]
+
+    def rebuild(self):
+        """Reconstruit entièrement l'index depuis la base"""
+        from .models import Medicine
+
+        postings = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        texts = {field: {} for field in INDEXED_FIELDS}
+        for values in Medicine.objects.values('id', *INDEXED_FIELDS).iterator():
+            self._add(postings, texts, values['id'], values)
+
+        with self._lock:
+            self._postings = postings
+            self._texts = texts
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Force une reconstruction à la prochaine recherche"""
+        with self._lock:
+            self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _ensure_built(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at > self.ttl:
+            self.rebuild()
+
+    def update(self, medicine):
+        """Indexe ou réindexe un médicament (sans effet si l'index n'est pas construit)"""
+        with self._lock:
+            if not self.is_built:
+                return
+            self._discard(medicine.pk)
+            values = {field: getattr(medicine, field) for field in INDEXED_FIELDS}
+            self._add(self._postings, self._texts, medicine.pk, values)
+
+    def remove(self, medicine_id):
+        """Retire un médicament de l'index"""
+        with self._lock:
+            if self.is_built:
+                self._discard(medicine_id)
+
+    def _match(self, term, field, min_overlap):
+        """Identifiants correspondant au terme dans un champ, avec leur taux de recouvrement"""
+        texts = self._texts[field]
+        if len(term) < 3:
+            # Terme trop court pour les trigrammes : parcours des textes en mémoire
+            return {medicine_id: 1.0 for medicine_id, text in texts.items() if term in text}
+
+        grams = trigrams(term)
+        postings = self._postings[field]
+        if min_overlap >= 1:
+            lists = sorted((postings.get(gram, ()) for gram in grams), key=len)
+            if not lists[0]:
+                return {}
+            candidates = set(lists[0]).intersection(*lists[1:])
+            # Vérifier la sous-chaîne : tous les trigrammes ne suffisent pas
+            return {medicine_id: 1.0 for medicine_id in candidates if term in texts[medicine_id]}
+
+        counts = Counter()
+        for gram in grams:
+            counts.update(postings.get(gram, ()))
+        overlaps = {medicine_id: count / len(grams) for medicine_id, count in counts.items()}
+        return {medicine_id: overlap for medicine_id, overlap in overlaps.items() if overlap >= min_overlap}
+
+    def named(self, names):
+        """
+        Identifiants des médicaments dont le nom est exactement l'un de
+        ``names``, sans tenir compte des accents ni de la casse.
+        """
+        self._ensure_built()
+        result = set()
+        with self._lock:
+            texts = self._texts['name']
+            for name in names:
+                name = normalize(name)
+                if name:
+                    result.update(
+                        medicine_id for medicine_id in self._match(name, 'name', 1.0) if texts[medicine_id] == name
+                    )
+        return result
+
+    def search(self, terms, fields=INDEXED_FIELDS, min_overlap=1.0):
+        """
+        Identifiants des médicaments dont un des ``fields`` contient au moins
+        un des ``terms`` (sans tenir compte des accents ni de la casse).
+
+        Avec ``min_overlap`` < 1, un médicament est retenu dès qu'il partage
+        cette proportion des trigrammes du terme. Les identifiants sont triés
+        par score décroissant (recouvrement pondéré par champ), puis par nom.
+        """
+        self._ensure_built()
+        scores = defaultdict(float)
+
+        with self._lock:
+            for term in terms:
+                term = normalize(term)
+                if not term:
+                    continue
+                for field in fields:
+                    for medicine_id, overlap in self._match(term, field, min_overlap).items():
+                        scores[medicine_id] += FIELD_WEIGHTS[field] * overlap
+            names = self._texts['name']
+            return sorted(
+                scores,
+                key=lambda medicine_id: (-scores[medicine_id], names.get(medicine_id, ''), medicine_id)
+            )
+
+
+medicine_index = MedicineTextIndex()
@@ -2,9 +2,10 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes as perm_classes
 from rest_framework.response import Response
 from django.db import IntegrityError
-from django.db.models import Q
+from .autocomplete import autocomplete_index
 from .models import Medicine
 from .serializers import MedicineSerializer
+from .search_backends import get_search_backend
 from .wikipedia_service import get_medicine_info_from_wikipedia
 
 
@@ -67,11 +68,8 @@ class MedicineViewSet(viewsets.ModelViewSet):
         category = self.request.query_params.get('category', None)
         
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | 
-                Q(description__icontains=search) |
-                Q(indications__icontains=search)
-            )
+            # Backend de recherche : insensible aux accents, sans parcours de table
+            queryset = queryset.filter(id__in=get_search_backend().search([search]))
         
         if category:
             queryset = queryset.filter(category=category)
@@ -89,10 +87,10 @@ class MedicineViewSet(viewsets.ModelViewSet):
         if not query:
             return Response({'results': []})
         
-        medicines = Medicine.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query)
-        )[:20]
+        # Meilleurs scores du backend de recherche (le nom prime)
+        medicine_ids = get_search_backend().search([query], fields=('name', 'description'), limit=20)
+        medicines_by_id = Medicine.objects.in_bulk(medicine_ids)
+        medicines = [medicines_by_id[pk] for pk in medicine_ids if pk in medicines_by_id]
         serializer = self.get_serializer(medicines, many=True)
         
         return Response({'results': serializer.data})
@@ -109,40 +107,12 @@ class MedicineViewSet(viewsets.ModelViewSet):
         if not query or len(query) < 2:
             return Response({'suggestions': []})
         
-        # Recherche rapide sur le nom uniquement
-        medicines = Medicine.objects.filter(
-            name__icontains=query
-        ).values('name', 'dosage', 'form', 'category').distinct()[:10]
-        
-        # Formatter les suggestions
-        suggestions = []
-        seen_names = set()
-        
-        for med in medicines:
-            # Suggestion du nom seul (unique)
-            if med['name'] not in seen_names:
-                suggestions.append({
-                    'type': 'name',
-                    'value': med['name'],
-                    'display': med['name'],
-                    'category': med['category']
-                })
-                seen_names.add(med['name'])
-            
-            # Suggestion avec dosage
-            full_name = f"{med['name']} {med['dosage']}"
-            if full_name not in seen_names and med['dosage']:
-                suggestions.append({
-                    'type': 'full',
-                    'value': full_name,
-                    'display': f"{med['name']} {med['dosage']} ({med['form']})",
-                    'category': med['category']
-                })
-                seen_names.add(full_name)
+        # Trie en mémoire : préfixe ou infixe, sans requête SQL
+        suggestions = autocomplete_index.suggest(query)
         
         return Response({
             'query': query,
-            'suggestions': suggestions[:8]  # Limiter à 8 suggestions
+            'suggestions': suggestions
         })
     
     @action(detail=False, methods=['get'])
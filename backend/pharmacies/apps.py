@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class PharmaciesConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'pharmacies'
+
+    def ready(self):
+        # Maintenir l'index spatial à jour lors des écritures sur Pharmacy
+        from . import signals  # noqa: F401
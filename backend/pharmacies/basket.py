@@ -0,0 +1,146 @@
+"""
+Recherche d'un panier de médicaments (ordonnance) dans les pharmacies.
+
+La matrice de disponibilité (``stocks.availability``) désigne sans
+requête les pharmacies, dans le rayon si une position est fournie, qui
+ont au moins un médicament du panier (OU des bitmaps) : seuls leurs
+stocks disponibles sont chargés, en une seule requête. Chaque
+pharmacie reçoit un masque de bits : le bit ``i`` est à 1 si elle a le
+``i``-ème médicament du panier. La couverture d'une pharmacie, les
+médicaments manquants et la couverture gloutonne se calculent ensuite par
+opérations sur ces entiers, sans requête supplémentaire.
+"""
+from django.db.models import Prefetch
+
+from stocks.availability import availability
+from stocks.models import Stock
+
+from . import geo
+from .models import PharmacyReview
+
+
+class BasketPharmacy:
+    """Pharmacie candidate : masque de couverture, stocks et prix total"""
+
+    __slots__ = ('pharmacy', 'mask', 'stocks', 'total_price')
+
+    def __init__(self, pharmacy):
+        self.pharmacy = pharmacy
+        self.mask = 0
+        self.stocks = {}
+        self.total_price = 0
+
+    @property
+    def coverage(self):
+        return self.mask.bit_count()
+
+    @property
+    def distance(self):
+        return getattr(self.pharmacy, 'distance', None)
+
+    def rank_key(self):
+        """Couverture décroissante, puis distance, puis prix total"""
+        distance = self.distance
+        return (-self.coverage, distance if distance is not None else 0, self.total_price, self.pharmacy.pk)
+
+
+def basket_stocks(medicine_ids, latitude=None, longitude=None, max_distance=50):
+    """
+    Stocks disponibles des médicaments du panier dans les pharmacies qui en
+    ont au moins un, en une requête ; triés par distance si une position
+    est fournie.
+    """
+    distances = None
+    if latitude is not None and longitude is not None:
+        distances = geo.pharmacy_distances_within(latitude, longitude, max_distance)
+    pharmacy_ids = availability.any_of(medicine_ids, list(distances) if distances is not None else None)
+    if not pharmacy_ids:
+        return []
+
+    stocks = list(Stock.objects.filter(
+        medicine_id__in=medicine_ids,
+        pharmacy_id__in=pharmacy_ids,
+        is_available=True,
+        quantity__gt=0,
+        pharmacy__is_active=True,
+    ).select_related('pharmacy', 'medicine').prefetch_related(
+        Prefetch('pharmacy__reviews', queryset=PharmacyReview.objects.only('id', 'pharmacy_id', 'rating'))
+    ))
+
+    if distances is not None:
+        for stock in stocks:
+            stock.distance = round(distances[stock.pharmacy_id], 2)
+        stocks.sort(key=lambda stock: stock.distance)
+    return stocks
+
+
+def medicine_bits(medicine_ids):
+    """Bit de chaque médicament du panier"""
+    return {medicine_id: 1 << position for position, medicine_id in enumerate(medicine_ids)}
+
+
+def build_candidates(bits, stocks):
+    """Pharmacies candidates, triées par couverture, distance et prix total"""
+    candidates = {}
+    for stock in stocks:
+        candidate = candidates.get(stock.pharmacy_id)
+        if candidate is None:
+            pharmacy = stock.pharmacy
+            if hasattr(stock, 'distance'):
+                pharmacy.distance = stock.distance
+            candidate = candidates[stock.pharmacy_id] = BasketPharmacy(pharmacy)
+        candidate.mask |= bits[stock.medicine_id]
+        candidate.stocks[stock.medicine_id] = stock
+        candidate.total_price += stock.price
+
+    return sorted(candidates.values(), key=BasketPharmacy.rank_key)
+
+
+def greedy_cover(candidates, bits):
+    """
+    Couverture gloutonne du panier : choisit à chaque étape la pharmacie
+    qui apporte le plus de médicaments encore manquants (à égalité la plus
+    proche, puis la moins chère pour ces médicaments).
+
+    Retourne ``(choix, reste)`` : la liste des ``(candidate, identifiants
+    des médicaments qui lui sont attribués)`` et le masque des médicaments
+    qu'aucune pharmacie ne couvre.
+    """
+    remaining = 0
+    for bit in bits.values():
+        remaining |= bit
+
+    chosen = []
+    while remaining:
+        best, best_key, best_gain = None, None, 0
+        for candidate in candidates:
+            gain = candidate.mask & remaining
+            if not gain:
+                continue
+            distance = candidate.distance
+            price = sum(
+                stock.price for medicine_id, stock in candidate.stocks.items()
+                if gain & bits[medicine_id]
+            )
+            key = (-gain.bit_count(), distance if distance is not None else 0, price, candidate.pharmacy.pk)
+            if best_key is None or key < best_key:
+                best, best_key, best_gain = candidate, key, gain
+        if best is None:
+            break
+        chosen.append((best, [medicine_id for medicine_id, bit in bits.items() if best_gain & bit]))
+        remaining &= ~best_gain
+    return chosen, remaining
+
+
+def search_basket(medicine_ids, latitude=None, longitude=None, max_distance=50):
+    """
+    Recherche d'un panier : retourne ``(candidates, cover, uncovered)``,
+    les pharmacies classées, la couverture gloutonne et les identifiants
+    des médicaments introuvables.
+    """
+    bits = medicine_bits(medicine_ids)
+    stocks = basket_stocks(medicine_ids, latitude, longitude, max_distance)
+    candidates = build_candidates(bits, stocks)
+    cover, remaining = greedy_cover(candidates, bits)
+    uncovered = [medicine_id for medicine_id, bit in bits.items() if remaining & bit]
+    return candidates, cover, uncovered
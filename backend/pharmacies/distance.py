@@ -0,0 +1,96 @@
+"""
+Noyau de calcul de distances vectorisé (NumPy).
+
+Les coordonnées des pharmacies candidates sont gardées dans des tableaux
+float64 contigus ; distances, filtrage par rayon et tri sont calculés pour
+tout l'ensemble en un seul appel au lieu d'une boucle Python par pharmacie.
+
+Ce module ne dépend pas de Django : il est partagé par la recherche, les
+pharmacies à proximité et les futurs calculs d'itinéraires.
+"""
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine(latitude, longitude, lats, lons):
+    """
+    Distances en kilomètres (formule de Haversine) entre le point
+    (latitude, longitude) et chaque point des tableaux ``lats``/``lons``.
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Distance en kilomètres entre deux points GPS"""
+    return float(haversine(lat1, lon1, np.float64(lat2), np.float64(lon2)))
+
+
+def rank_within(latitude, longitude, lats, lons, radius_km=None):
+    """
+    Filtre et trie un ensemble de points par distance.
+
+    Retourne ``(order, distances)`` : les indices des points situés à moins
+    de ``radius_km`` km (tous si ``radius_km`` vaut None), triés par distance
+    croissante (tri stable : l'ordre d'entrée départage les égalités), et
+    les distances correspondantes.
+    """
+    distances = haversine(latitude, longitude, lats, lons)
+    if radius_km is None:
+        candidates = np.arange(len(distances))
+    else:
+        candidates = np.flatnonzero(distances <= radius_km)
+    order = candidates[np.argsort(distances[candidates], kind='stable')]
+    return order, distances[order]
+
+
+class CoordinateSet:
+    """
+    Ensemble de points identifiés, stocké en tableaux contigus :
+    ``ids`` (int64), ``lats`` et ``lons`` (float64).
+    """
+
+    __slots__ = ('ids', 'lats', 'lons')
+
+    def __init__(self, ids=(), lats=(), lons=()):
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        self.lats = np.ascontiguousarray(lats, dtype=np.float64)
+        self.lons = np.ascontiguousarray(lons, dtype=np.float64)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Construit l'ensemble depuis des tuples ``(id, latitude, longitude)``"""
+        rows = list(rows)
+        if not rows:
+            return cls()
+        ids, lats, lons = zip(*rows)
+        return cls(ids, lats, lons)
+
+    @classmethod
+    def concatenate(cls, sets):
+        """Fusionne plusieurs ensembles en un seul"""
+        sets = [s for s in sets if len(s)]
+        if not sets:
+            return cls()
+        return cls(
+            np.concatenate([s.ids for s in sets]),
+            np.concatenate([s.lats for s in sets]),
+            np.concatenate([s.lons for s in sets]),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def within(self, latitude, longitude, radius_km=None):
+        """
+        Identifiants des points à moins de ``radius_km`` km, triés par
+        distance, et leurs distances en km.
+        """
+        order, distances = rank_within(latitude, longitude, self.lats, self.lons, radius_km)
+        return self.ids[order], distances
@@ -0,0 +1,127 @@
+"""
+Couche de requêtes géographiques sur les pharmacies.
+
+Deux implémentations derrière la même interface :
+
+- PostGIS : filtrage ``ST_DWithin`` sur ``Pharmacy.location`` (index GiST
+  créé par le ``PointField``), tri KNN avec l'opérateur ``<->`` et distance
+  calculée en SQL.
+- Portable (SQLite / ``location`` en JSONField) : présélection par l'index
+  spatial en mémoire puis calcul vectorisé des distances (``distance.py``) ;
+  seules les lignes dans le rayon sont chargées depuis la base.
+
+Les fonctions retournent des listes d'objets triés par distance croissante,
+chacun portant un attribut ``distance`` en kilomètres arrondi à 2 décimales.
+Comme les vues d'origine, le rayon est comparé par défaut à la distance
+arrondie (``rounded=True``) : une pharmacie à 5,004 km est dans un rayon
+de 5 km.
+"""
+from django.db import connection
+
+from .models import Pharmacy, GIS_AVAILABLE
+from .spatial_index import pharmacy_index
+
+
+# Élargissement du rayon de recherche couvrant les distances arrondies au
+# rayon (arrondi à 2 décimales)
+ROUNDING_MARGIN_KM = 0.005
+
+
+def _in_radius(distance, radius_km, rounded):
+    return (round(distance, 2) if rounded else distance) <= radius_km
+
+
+def use_postgis():
+    """Vrai si la base courante est PostGIS et le champ location géographique"""
+    return GIS_AVAILABLE and getattr(connection.ops, 'postgis', False)
+
+
+def _within_postgis(queryset, latitude, longitude, radius_km, path, rounded):
+    from django.contrib.gis.db.models.functions import Distance, GeometryDistance
+    from django.contrib.gis.geos import Point
+    from django.contrib.gis.measure import D
+
+    point = Point(longitude, latitude, srid=4326)
+    field = f'{path}location'
+    queryset = queryset.filter(
+        **{f'{field}__dwithin': (point, D(km=radius_km + ROUNDING_MARGIN_KM))}
+    ).annotate(
+        geo_distance=Distance(field, point)
+    ).order_by(GeometryDistance(field, point))
+
+    results = [obj for obj in queryset if _in_radius(obj.geo_distance.km, radius_km, rounded)]
+    for obj in results:
+        obj.distance = round(obj.geo_distance.km, 2)
+    return results
+
+
+def _within_portable(queryset, latitude, longitude, radius_km, path, rounded):
+    # Distances calculées en un seul appel vectorisé sur les candidats
+    search_radius = radius_km + ROUNDING_MARGIN_KM
+    candidates = pharmacy_index.candidates(latitude, longitude, search_radius)
+    ids, distances = candidates.within(latitude, longitude, search_radius)
+    distance_by_id = {
+        pharmacy_id: round(distance, 2)
+        for pharmacy_id, distance in zip(ids.tolist(), distances.tolist())
+        if _in_radius(distance, radius_km, rounded)
+    }
+
+    id_attr = f"{path.rstrip('_')}_id" if path else 'pk'
+    results = list(queryset.filter(**{f'{path}id__in': list(distance_by_id)}))
+    for obj in results:
+        obj.distance = distance_by_id[getattr(obj, id_attr)]
+
+    results.sort(key=lambda obj: obj.distance)
+    return results
+
+
+def _within(queryset, latitude, longitude, radius_km, path='', rounded=True):
+    if use_postgis():
+        return _within_postgis(queryset, latitude, longitude, radius_km, path, rounded)
+    return _within_portable(queryset, latitude, longitude, radius_km, path, rounded)
+
+
+def pharmacies_within(latitude, longitude, radius_km, queryset=None, rounded=True):
+    """
+    Pharmacies actives à moins de ``radius_km`` km de (latitude, longitude),
+    triées par distance. ``rounded=False`` compare le rayon à la distance
+    exacte (``PharmacyViewSet.nearby``).
+    """
+    if queryset is None:
+        queryset = Pharmacy.objects.filter(is_active=True)
+    return _within(queryset, latitude, longitude, radius_km, rounded=rounded)
+
+
+def pharmacy_distances_within(latitude, longitude, radius_km):
+    """
+    Distances (km, non arrondies) des pharmacies dont la distance arrondie
+    est d'au plus ``radius_km`` km : ``{pharmacy_id: distance}``. Sans
+    requête hors PostGIS.
+    """
+    search_radius = radius_km + ROUNDING_MARGIN_KM
+    if use_postgis():
+        from django.contrib.gis.db.models.functions import Distance
+        from django.contrib.gis.geos import Point
+        from django.contrib.gis.measure import D
+
+        point = Point(longitude, latitude, srid=4326)
+        rows = Pharmacy.objects.filter(
+            location__dwithin=(point, D(km=search_radius))
+        ).annotate(geo_distance=Distance('location', point)).values_list('id', 'geo_distance')
+        distances = ((pharmacy_id, distance.km) for pharmacy_id, distance in rows)
+    else:
+        candidates = pharmacy_index.candidates(latitude, longitude, search_radius)
+        ids, values = candidates.within(latitude, longitude, search_radius)
+        distances = zip(ids.tolist(), values.tolist())
+    return {
+        pharmacy_id: distance for pharmacy_id, distance in distances
+        if _in_radius(distance, radius_km, True)
+    }
+
+
+def stocks_within(queryset, latitude, longitude, radius_km):
+    """
+    Stocks (``queryset`` de ``Stock``) dont la pharmacie est à moins de
+    ``radius_km`` km, triés par distance de la pharmacie.
+    """
+    return _within(queryset, latitude, longitude, radius_km, path='pharmacy__')
@@ -0,0 +1,24 @@
+# Remplit Pharmacy.location à partir de latitude/longitude pour que les
+# requêtes PostGIS (ST_DWithin, tri KNN) couvrent toutes les pharmacies.
+
+from django.db import migrations
+
+
+def backfill_location(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "UPDATE pharmacies_pharmacy "
+        "SET location = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography "
+        "WHERE location IS NULL"
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pharmacies", "0003_alter_pharmacy_options_pharmacy_approval_status_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_location, migrations.RunPython.noop),
+    ]
@@ -114,6 +114,16 @@ class Pharmacy(models.Model):
             status = " ❌"
         return f"{self.name}{status}"
     
+    def save(self, *args, **kwargs):
+        """Synchronise le champ location avec latitude/longitude"""
+        if self.latitude is not None and self.longitude is not None:
+            if GIS_AVAILABLE:
+                from django.contrib.gis.geos import Point
+                self.location = Point(self.longitude, self.latitude, srid=4326)
+            else:
+                self.location = [self.latitude, self.longitude]
+        super().save(*args, **kwargs)
+    
     @property
     def is_approved(self):
         """Vérifie si la pharmacie est approuvée"""
@@ -0,0 +1,95 @@
+"""
+Classement par pertinence des résultats de recherche.
+
+Chaque couple (médicament, pharmacie) candidat reçoit un score entre 0 et 1,
+moyenne pondérée de cinq composantes normalisées :
+
+- ``text`` : rang du médicament dans la réponse du backend de recherche ;
+- ``distance`` : ``1 - distance / max_distance`` (ignorée sans position) ;
+- ``price`` : prix rapporté à ``Medicine.average_price`` (1 jusqu'à la
+  moitié du prix moyen, 0 à partir de 1,5 fois ; 0,5 sans prix moyen) ;
+- ``stock`` : profondeur du stock, ``log(1 + quantité)`` rapporté au
+  maximum des candidats ;
+- ``rating`` : note moyenne de la pharmacie sur 5 (0,5 sans avis).
+
+Les poids viennent du réglage ``SEARCH_RANKING_WEIGHTS``. Tous les scores
+sont calculés en une passe vectorisée sur les tableaux des candidats ; un
+médicament prend le score de son meilleur couple.
+"""
+import numpy as np
+from django.conf import settings
+
+
+DEFAULT_WEIGHTS = {
+    'text': 3.0,
+    'distance': 2.0,
+    'price': 1.0,
+    'stock': 0.5,
+    'rating': 1.0,
+}
+
+# Valeur des composantes inconnues (pas de prix moyen, pas d'avis)
+NEUTRAL = 0.5
+
+
+def ranking_weights():
+    """Poids par défaut, remplacés par ceux du réglage ``SEARCH_RANKING_WEIGHTS``"""
+    weights = dict(DEFAULT_WEIGHTS)
+    weights.update(getattr(settings, 'SEARCH_RANKING_WEIGHTS', None) or {})
+    return weights
+
+
+def _as_float(values):
+    """Tableau float64, ``None`` devenant NaN"""
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def score_hits(text, prices, average_prices, quantities, ratings,
+               distances=None, max_distance=None, weights=None):
+    """
+    Scores des couples candidats (tableaux alignés, un élément par couple).
+
+    ``distances`` vaut ``None`` sans position : la composante de distance
+    est alors retirée de la moyenne.
+    """
+    weights = weights or ranking_weights()
+    text = np.asarray(text, dtype=np.float64)
+    prices = _as_float(prices)
+    average_prices = _as_float(average_prices)
+    quantities = np.asarray(quantities, dtype=np.float64)
+    ratings = _as_float(ratings)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price = np.clip(1.5 - prices / average_prices, 0.0, 1.0)
+    price = np.where(np.isfinite(price) & (average_prices > 0), price, NEUTRAL)
+
+    depth = np.log1p(np.maximum(quantities, 0))
+    stock = depth / depth.max() if len(depth) and depth.max() > 0 else np.zeros_like(depth)
+
+    rating = np.where(np.isnan(ratings), NEUTRAL, ratings / 5.0)
+
+    components = {'text': text, 'price': price, 'stock': stock, 'rating': rating}
+    if distances is not None:
+        distances = np.asarray(distances, dtype=np.float64)
+        components['distance'] = np.clip(1.0 - distances / max_distance, 0.0, 1.0) if max_distance else np.ones_like(distances)
+
+    total = sum(weights.get(name, 0.0) for name in components)
+    if total <= 0:
+        return np.zeros(len(text))
+    score = sum(weights.get(name, 0.0) * values for name, values in components.items())
+    return score / total
+
+
+def rank_medicines(medicine_ids, scores):
+    """
+    Meilleur score de chaque médicament à partir des scores des couples.
+
+    Retourne ``(ids, best)`` triés par score décroissant puis identifiant
+    croissant.
+    """
+    medicine_ids = np.asarray(medicine_ids, dtype=np.int64)
+    unique, inverse = np.unique(medicine_ids, return_inverse=True)
+    best = np.full(len(unique), -np.inf)
+    np.maximum.at(best, inverse, scores)
+    order = np.lexsort((unique, -best))
+    return unique[order], best[order]
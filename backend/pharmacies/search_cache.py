@@ -0,0 +1,222 @@
+"""
+Cache en mémoire des candidats de ``search_medicine``.
+
+Une entrée est identifiée par la recherche normalisée, la cellule
+géographique de la position (latitude et longitude arrondies à
+``SEARCH_CACHE_CELL_SIZE`` degrés) et ``max_distance``. Elle ne contient
+que ce qui ne dépend pas de la position exacte : les médicaments
+correspondants et leurs stocks disponibles dans les pharmacies situées à
+moins de ``max_distance`` km d'un point quelconque de la cellule (rayon
+élargi de ``cell_reach`` autour du centre de la cellule). Distances,
+filtrage par rayon et classement sont recalculés à chaque requête depuis
+la position de l'utilisateur.
+
+Les entrées expirent après ``SEARCH_CACHE_TTL`` secondes et les moins
+récemment utilisées sont évincées au-delà de ``SEARCH_CACHE_MAX_ENTRIES``.
+Chaque entrée retient les médicaments correspondant à la recherche : une
+écriture sur le stock d'un médicament n'invalide que les entrées qui le
+concernent.
+
+Le cache est propre à chaque processus. Les écritures du processus
+l'invalident au commit (voir ``signals.py``) ; avant chaque lecture, les
+lignes du flux ``StockChange`` postérieures à la position atteinte
+(écritures des autres workers, des commandes et du balayeur) invalident
+les médicaments concernés. Au-delà de ``SEARCH_CACHE_CATCH_UP`` lignes, le
+cache est vidé. Les compteurs de ``stats()`` servent à régler la taille
+des cellules.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from math import floor
+
+from django.conf import settings
+
+from medicines.text_index import normalize
+
+from .distance import distance_km
+
+
+class SearchResultCache:
+    """
+    Cache LRU avec durée de vie, indexé aussi par médicament.
+
+    Toutes les méthodes publiques sont thread-safe.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, cell_size=None, catch_up=None):
+        self.max_entries = max_entries if max_entries is not None else getattr(settings, 'SEARCH_CACHE_MAX_ENTRIES', 1000)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'SEARCH_CACHE_TTL', 60)
+        self.cell_size = cell_size or getattr(settings, 'SEARCH_CACHE_CELL_SIZE', 0.01)
+        self.catch_up = catch_up if catch_up is not None else getattr(settings, 'SEARCH_CACHE_CATCH_UP', 1000)
+        self._lock = threading.Lock()
+        # Un seul rattrapage du flux à la fois ; jamais tenu avec ``_lock``
+        # pendant une requête SQL
+        self._refresh_lock = threading.Lock()
+        # Position atteinte dans le flux StockChange (lue au premier accès)
+        self._position = None
+        # clé -> (expiration, valeur, identifiants des médicaments)
+        self._entries = OrderedDict()
+        self._by_medicine = defaultdict(set)
+        # Incrémenté à chaque invalidation : des candidats lus avant une
+        # écriture ne doivent pas être mis en cache après elle
+        self.version = 0
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def key(self, query, latitude=None, longitude=None, max_distance=None):
+        """Clé d'une recherche : texte normalisé, cellule et rayon"""
+        if latitude is None or longitude is None:
+            return (normalize(query), None, None, None)
+        return (
+            normalize(query),
+            floor(latitude / self.cell_size),
+            floor(longitude / self.cell_size),
+            float(max_distance),
+        )
+
+    def cell_center(self, key):
+        """Coordonnées du centre de la cellule d'une clé, ``(None, None)`` sans position"""
+        row, col = key[1], key[2]
+        if row is None:
+            return None, None
+        return (row + 0.5) * self.cell_size, (col + 0.5) * self.cell_size
+
+    def cell_reach(self, key):
+        """Distance (km) entre le centre de la cellule d'une clé et ses coins les plus éloignés"""
+        latitude, longitude = self.cell_center(key)
+        if latitude is None:
+            return 0.0
+        half = self.cell_size / 2
+        return max(
+            distance_km(latitude, longitude, latitude + dlat, longitude + dlon)
+            for dlat in (-half, half) for dlon in (-half, half)
+        )
+
+    def _remove(self, key):
+        _, _, medicine_ids = self._entries.pop(key)
+        for medicine_id in medicine_ids:
+            keys = self._by_medicine.get(medicine_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_medicine[medicine_id]
+
+    def _apply_changes(self):
+        """Invalide les médicaments des modifications du flux postérieures à la position atteinte"""
+        from stocks.sync import committed_changes
+
+        # Rattrapage en cours dans un autre thread : l'état courant est utilisé
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if self._position is not None:
+                rows = list(
+                    committed_changes(self._position).values_list(
+                        'transaction_id', 'id', 'medicine_id'
+                    )[:self.catch_up + 1]
+                )
+                if not rows:
+                    return
+                if len(rows) <= self.catch_up:
+                    self.invalidate_medicines({row[2] for row in rows})
+                    self._position = tuple(rows[-1][:2])
+                    return
+            # Premier accès ou retard trop important : le cache repart de la
+            # tête du flux, lue avant de le vider
+            head = committed_changes().values_list('transaction_id', 'id').last()
+            self.clear()
+            self._position = tuple(head) if head else (0, 0)
+        finally:
+            self._refresh_lock.release()
+
+    def get(self, key):
+        """Valeur en cache, ou ``None`` si absente ou expirée"""
+        if self.enabled:
+            self._apply_changes()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, medicine_ids, version=None):
+        """
+        Enregistre des candidats et les médicaments dont ils dépendent.
+
+        ``version`` est la valeur de ``self.version`` lue avant la lecture
+        des candidats : s'il y a eu une invalidation depuis, rien n'est
+        stocké.
+        """
+        if not self.enabled:
+            return
+        medicine_ids = frozenset(medicine_ids)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, medicine_ids)
+            for medicine_id in medicine_ids:
+                self._by_medicine[medicine_id].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_medicines(self, medicine_ids):
+        """Retire les entrées qui dépendent d'un de ces médicaments"""
+        with self._lock:
+            self.version += 1
+            for medicine_id in medicine_ids:
+                for key in list(self._by_medicine.get(medicine_id, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """
+        Vide le cache (les compteurs sont conservés) ; la position dans le
+        flux des modifications est relue au prochain accès.
+        """
+        with self._lock:
+            self.version += 1
+            self._position = None
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_medicine.clear()
+
+    def stats(self):
+        """Compteurs et paramètres du cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'cell_size': self.cell_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._reset_counters()
+
+
+search_cache = SearchResultCache()
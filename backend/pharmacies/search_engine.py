@@ -0,0 +1,328 @@
+"""
+Moteur d'exécution de la recherche de médicaments.
+
+Les médicaments correspondants sont trouvés par le backend de recherche
+configuré (``medicines.search_backends``). Une première requête légère
+(valeurs seulement) lit les couples (médicament, pharmacie) candidats
+(``find_candidates``), dans le rayon si une position est fournie. Ces
+candidats ne dépendent que de la recherche et d'une zone : la vue les met
+en cache pour toute une cellule géographique. Les distances depuis la
+position exacte, le filtrage par rayon et le classement par pertinence
+(une passe vectorisée, ``ranking.py``) sont calculés à chaque requête, et
+la page demandée est choisie après le curseur.
+
+Chaque médicament ne porte que ``pharmacies_limit`` pharmacies, les plus
+pertinentes d'abord, avec un curseur ``more_pharmacies`` pour obtenir les
+suivantes (``medicine_pharmacies``). Ces pages de pharmacies sont
+choisies en mémoire sur les candidats (lignes de valeurs, en cache) ;
+seuls leurs stocks sont ensuite chargés, en une requête jointe. Le nombre
+de requêtes SQL et d'objets chargés ne dépend donc ni du nombre de
+médicaments trouvés ni du nombre de pharmacies qui ont chaque médicament.
+
+Les noms de marque et DCI de la saisie sont étendus à tous les
+médicaments équivalents (``medicines.synonyms``). Si la recherche exacte
+ne trouve rien, les noms les plus proches de la saisie (BK-tree,
+``medicines.fuzzy``) sont utilisés à la place.
+"""
+from collections import namedtuple
+
+import numpy as np
+from django.db.models import Avg, OuterRef, Prefetch, Subquery
+
+from core.cursors import encode_cursor
+from medicines.fuzzy import fuzzy_index
+from medicines.search_backends import get_search_backend
+from medicines.synonyms import synonym_index
+from stocks.availability import availability
+from stocks.models import Stock
+
+from . import geo
+from .ranking import rank_medicines, score_hits
+from .models import PharmacyReview
+
+
+def matching_medicine_ids(query):
+    """
+    Identifiants des médicaments dont le nom ou la description contient au
+    moins un des mots de la recherche (sans tenir compte des accents),
+    suivis des médicaments équivalents par DCI ou nom de marque.
+    """
+    medicine_ids = get_search_backend().search(query.split(), fields=('name', 'description'))
+    found = set(medicine_ids)
+    medicine_ids.extend(
+        medicine_id for medicine_id in synonym_index.expand(query) if medicine_id not in found
+    )
+    return medicine_ids
+
+
+# Candidats d'une recherche : identifiants de tous les médicaments
+# correspondants (même sans stock), noms corrigés utilisés par le repli
+# approché et stocks disponibles (``StockRows``).
+Candidates = namedtuple('Candidates', ['medicine_ids', 'corrections', 'rows'])
+
+# Colonnes des stocks candidats : tableaux NumPy alignés, une ligne par
+# couple (médicament, pharmacie). ``updated`` est la date de mise à jour
+# du stock (horodatage), qui départage les pharmacies sans position.
+StockRows = namedtuple('StockRows', [
+    'stock', 'medicine', 'pharmacy', 'price', 'quantity', 'average_price', 'rating', 'updated',
+])
+
+# Résultat d'une recherche : médicaments de la page, identifiants de tous
+# les médicaments correspondants (même sans stock), noms corrigés utilisés
+# par le repli approché, et position ``[score, id]`` du dernier médicament
+# de la page s'il y a une page suivante (``None`` sinon).
+SearchPage = namedtuple('SearchPage', ['medicines', 'medicine_ids', 'corrections', 'next_position'])
+
+
+def _stock_conditions(medicine_ids, pharmacy_ids=None):
+    conditions = {
+        'medicine_id__in': medicine_ids,
+        'is_available': True,
+        'quantity__gt': 0,
+        'pharmacy__is_active': True,
+    }
+    if pharmacy_ids is not None:
+        conditions['pharmacy_id__in'] = pharmacy_ids
+    return conditions
+
+
+def _floats(values):
+    """Tableau float64, ``None`` devenant NaN"""
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def _candidate_rows(medicine_ids, pharmacy_ids=None):
+    """Stocks disponibles des médicaments, parmi ``pharmacy_ids`` si fourni, en une requête de valeurs"""
+    average_rating = PharmacyReview.objects.filter(
+        pharmacy_id=OuterRef('pharmacy_id')
+    ).order_by().values('pharmacy_id').annotate(average=Avg('rating')).values('average')
+    rows = list(
+        Stock.objects.filter(**_stock_conditions(medicine_ids, pharmacy_ids)).annotate(
+            pharmacy_rating=Subquery(average_rating)
+        ).values_list(
+            'id', 'medicine_id', 'pharmacy_id', 'price', 'quantity',
+            'medicine__average_price', 'pharmacy_rating', 'last_updated'
+        )
+    ) if medicine_ids else []
+    columns = list(zip(*rows)) or [()] * len(StockRows._fields)
+    stock, medicine, pharmacy, price, quantity, average_price, rating, updated = columns
+    return StockRows(
+        np.array(stock, dtype=np.int64), np.array(medicine, dtype=np.int64), np.array(pharmacy, dtype=np.int64),
+        _floats(price), np.array(quantity, dtype=np.float64), _floats(average_price), _floats(rating),
+        np.array([value.timestamp() for value in updated], dtype=np.float64),
+    )
+
+
+def _select(rows, indices):
+    return StockRows(*(column[indices] for column in rows))
+
+
+def find_candidates(query, latitude=None, longitude=None, max_distance=50):
+    """
+    Médicaments correspondant à la saisie et leurs stocks disponibles dans
+    les pharmacies actives, à moins de ``max_distance`` km de la position
+    si fournie. Si la saisie ne correspond à aucun médicament, les noms les
+    plus proches sont utilisés et retournés dans ``corrections``.
+    """
+    corrections = []
+    medicine_ids = matching_medicine_ids(query)
+    if not medicine_ids:
+        # Repli sur les noms les plus proches (fautes de frappe)
+        for name, ids in fuzzy_index.closest(query):
+            corrections.append(name)
+            medicine_ids.extend(ids)
+        if not medicine_ids:
+            return Candidates([], corrections, _candidate_rows([]))
+
+    pharmacy_ids = None
+    if latitude is not None and longitude is not None:
+        pharmacy_ids = list(geo.pharmacy_distances_within(latitude, longitude, max_distance))
+
+    # Médicaments sans aucune pharmacie (dans le rayon) écartés par la
+    # matrice de disponibilité (sur-ensemble, la requête suivante fait foi)
+    candidate_ids = availability.available_medicines(medicine_ids, pharmacy_ids)
+    return Candidates(medicine_ids, corrections, _candidate_rows(candidate_ids, pharmacy_ids))
+
+
+def rows_within(rows, distances=None):
+    """
+    Stocks des pharmacies du rayon (``distances`` : ``{pharmacy_id: km}``)
+    et distance de chacun ; tous les stocks et ``None`` sans position.
+    """
+    if distances is None:
+        return rows, None
+    row_distances = np.array([distances.get(p, np.nan) for p in rows.pharmacy.tolist()], dtype=np.float64)
+    keep = np.flatnonzero(~np.isnan(row_distances))
+    return _select(rows, keep), row_distances[keep]
+
+
+def _candidate_rows_within(candidates, latitude, longitude, max_distance):
+    """Stocks candidats dans le rayon de la position et leurs distances"""
+    distances = None
+    if latitude is not None and longitude is not None:
+        distances = geo.pharmacy_distances_within(latitude, longitude, max_distance)
+    return rows_within(candidates.rows, distances)
+
+
+def rank_candidates(medicine_ids, rows, distances=None, max_distance=None):
+    """
+    Classe par pertinence les médicaments des stocks ``rows``.
+
+    ``medicine_ids`` est la réponse du backend de recherche, dans l'ordre
+    de pertinence textuelle ; ``distances`` donne la distance de chaque
+    stock (``rows_within``). Retourne ``(ids, scores)``, tableaux triés
+    par score décroissant puis identifiant.
+    """
+    if not len(rows.medicine):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    positions = {medicine_id: position for position, medicine_id in enumerate(medicine_ids)}
+    text = [1.0 - positions.get(medicine_id, 0) / len(medicine_ids) for medicine_id in rows.medicine.tolist()]
+    scores = score_hits(
+        text, rows.price, rows.average_price, rows.quantity, rows.rating,
+        distances=distances, max_distance=max_distance,
+    )
+    return rank_medicines(rows.medicine, scores)
+
+
+def page_after(ids, scores, after=None, limit=20):
+    """
+    ``limit + 1`` premiers couples ``(id, score)`` du classement situés
+    après la position ``after`` (``[score, id]``). Le couple supplémentaire
+    indique qu'une page suivante existe.
+    """
+    if after is not None:
+        score, medicine_id = after
+        keep = (scores < score) | ((scores == score) & (ids > medicine_id))
+        ids, scores = ids[keep], scores[keep]
+    return list(zip(ids[:limit + 1].tolist(), scores[:limit + 1].tolist()))
+
+
+def rank_pharmacies(rows, distances=None, max_distance=None):
+    """
+    Ordre (indices) des stocks d'un médicament par pertinence de la
+    pharmacie (distance, prix, stock, note), calculée en une passe sur
+    tous ses stocks ; la distance, ou sans position la mise à jour la plus
+    récente, départage les égalités.
+    """
+    scores = score_hits(
+        np.ones(len(rows.stock)), rows.price, rows.average_price, rows.quantity, rows.rating,
+        distances=distances, max_distance=max_distance,
+    )
+    order = np.argsort(distances if distances is not None else -rows.updated, kind='stable')
+    return order[np.argsort(-scores[order], kind='stable')]
+
+
+def page_pharmacies(medicine_ids, rows, distances=None, max_distance=None, offset=0, limit=10):
+    """
+    Médicaments de ``medicine_ids`` (dans cet ordre) ayant des stocks dans
+    ``rows``, chacun avec ses ``limit`` pharmacies les plus pertinentes à
+    partir de ``offset`` : ``pharmacies_page`` (pharmacies avec
+    ``stock_info`` et ``distance`` si calculée) et le curseur
+    ``more_pharmacies`` des suivantes, ou ``None``. Le nombre de
+    pharmacies et les prix extrêmes (``search_total_pharmacies``,
+    ``search_min_price``, ``search_max_price``) portent sur tous les
+    stocks. Seuls les stocks des pages sont chargés, en une requête.
+    """
+    end = offset + limit
+    pages = []
+    for medicine_id in medicine_ids:
+        selected = np.flatnonzero(rows.medicine == medicine_id)
+        if not len(selected):
+            continue
+        medicine_rows = _select(rows, selected)
+        medicine_distances = distances[selected] if distances is not None else None
+        order = rank_pharmacies(medicine_rows, medicine_distances, max_distance)
+        page = [
+            (stock_id, round(medicine_distances[i], 2) if distances is not None else None)
+            for i, stock_id in zip(order[offset:end].tolist(), medicine_rows.stock[order[offset:end]].tolist())
+        ]
+        pages.append((medicine_id, page, len(order), medicine_rows.price.min(), medicine_rows.price.max()))
+
+    stocks = Stock.objects.filter(pk__in=[stock_id for _, page, *_ in pages for stock_id, _ in page]).filter(
+        is_available=True, quantity__gt=0, pharmacy__is_active=True
+    ).select_related('medicine', 'pharmacy').prefetch_related(
+        # Notes uniquement : utilisées par Pharmacy.average_rating/reviews_count
+        Prefetch('pharmacy__reviews', queryset=PharmacyReview.objects.only('id', 'pharmacy_id', 'rating'))
+    ).in_bulk() if pages else {}
+
+    medicines = []
+    for medicine_id, page, total, min_price, max_price in pages:
+        pharmacies = []
+        for stock_id, distance in page:
+            stock = stocks.get(stock_id)
+            if stock is None:
+                # Modifié depuis la lecture des candidats
+                continue
+            pharmacy = stock.pharmacy
+            if distance is not None:
+                pharmacy.distance = distance
+            pharmacy.stock_info = stock
+            pharmacies.append(pharmacy)
+        if not pharmacies:
+            continue
+        medicine = pharmacies[0].stock_info.medicine
+        medicine.pharmacies_page = pharmacies
+        medicine.more_pharmacies = encode_cursor([medicine_id, end]) if end < total else None
+        medicine.search_total_pharmacies = total
+        medicine.search_min_price = float(min_price)
+        medicine.search_max_price = float(max_price)
+        medicines.append(medicine)
+    return medicines
+
+
+def execute_search(query, latitude=None, longitude=None, max_distance=50,
+                   after=None, limit=20, pharmacies_limit=10, candidates=None):
+    """
+    Exécute une recherche de médicaments avec pharmacies disponibles.
+
+    Retourne une ``SearchPage`` : au plus ``limit`` médicaments ayant au
+    moins une pharmacie (dans le rayon si une position est fournie), après
+    la position ``after``, chacun avec au plus ``pharmacies_limit``
+    pharmacies. ``candidates`` (``find_candidates``, éventuellement lus en
+    cache pour une zone plus large que le rayon) évite de relire les
+    médicaments correspondants et leurs stocks.
+    """
+    if candidates is None:
+        candidates = find_candidates(query, latitude, longitude, max_distance)
+    medicine_ids, corrections = candidates.medicine_ids, candidates.corrections
+    if not medicine_ids:
+        return SearchPage([], [], corrections, None)
+
+    rows, distances = _candidate_rows_within(candidates, latitude, longitude, max_distance)
+    ids, scores = rank_candidates(medicine_ids, rows, distances, max_distance)
+    ranked = page_after(ids, scores, after=after, limit=limit)
+    page = ranked[:limit]
+    relevance = dict(page)
+
+    medicines = page_pharmacies(list(relevance), rows, distances, max_distance, limit=pharmacies_limit) if page else []
+    for medicine in medicines:
+        medicine.relevance = round(relevance[medicine.pk], 4)
+
+    next_position = None
+    if len(ranked) > limit:
+        last_id, last_score = page[-1]
+        next_position = [last_score, last_id]
+    return SearchPage(medicines, medicine_ids, corrections, next_position)
+
+
+def medicine_pharmacies(medicine_id, offset, limit=10, latitude=None, longitude=None, max_distance=50,
+                        candidates=None):
+    """
+    Pharmacies suivantes d'un médicament (curseur ``more_pharmacies``) :
+    liste contenant le médicament avec ``limit`` pharmacies à partir de
+    ``offset``, ou liste vide s'il n'a plus de stock. ``candidates`` est
+    celui de la recherche d'origine, s'il est connu.
+    """
+    if candidates is None:
+        within = None
+        if latitude is not None and longitude is not None:
+            within = list(geo.pharmacy_distances_within(latitude, longitude, max_distance))
+        # Stocks lus dans les seules pharmacies qui ont le médicament
+        # (matrice de disponibilité), aucune requête s'il n'y en a pas
+        pharmacy_ids = availability.pharmacies_with(medicine_id, within)
+        if not pharmacy_ids:
+            return []
+        candidates = Candidates([medicine_id], [], _candidate_rows([medicine_id], pharmacy_ids))
+    rows, distances = _candidate_rows_within(candidates, latitude, longitude, max_distance)
+    return page_pharmacies([medicine_id], rows, distances, max_distance, offset=offset, limit=limit)
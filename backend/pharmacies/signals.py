@@ -0,0 +1,74 @@
+"""
+Signaux maintenant l'index spatial des pharmacies et le cache de
+recherche à jour. Les structures en mémoire ne sont modifiées qu'au
+commit, pour ne jamais refléter une écriture annulée.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from medicines.models import ActiveIngredient, Medicine, MedicineSynonym
+from stocks.models import Stock
+from stocks.signals import stocks_bulk_saved
+
+from .models import Pharmacy
+from .search_cache import search_cache
+from .spatial_index import pharmacy_index
+
+
+@receiver(post_save, sender=Pharmacy)
+def update_spatial_index(sender, instance, **kwargs):
+    """Ajoute, déplace ou retire la pharmacie de l'index selon son état (au commit)"""
+    pharmacy_id, latitude, longitude = instance.pk, instance.latitude, instance.longitude
+    is_active = instance.is_active
+
+    def update():
+        if is_active:
+            pharmacy_index.upsert(pharmacy_id, latitude, longitude)
+        else:
+            pharmacy_index.remove(pharmacy_id)
+        search_cache.clear()
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Pharmacy)
+def remove_from_spatial_index(sender, instance, **kwargs):
+    """Retire une pharmacie supprimée de l'index (au commit)"""
+    pharmacy_id = instance.pk
+
+    def remove():
+        pharmacy_index.remove(pharmacy_id)
+        search_cache.clear()
+
+    transaction.on_commit(remove)
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stock_searches(sender, instance, **kwargs):
+    """Invalide, au commit, les recherches qui portent sur le médicament de ce stock"""
+    medicine_id = instance.medicine_id
+    transaction.on_commit(lambda: search_cache.invalidate_medicines([medicine_id]))
+
+
+@receiver(stocks_bulk_saved)
+def invalidate_bulk_stock_searches(sender, stocks, **kwargs):
+    """Invalide les recherches portant sur les médicaments écrits en masse"""
+    search_cache.invalidate_medicines({stock.medicine_id for stock in stocks})
+
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def invalidate_medicine_searches(sender, instance, **kwargs):
+    """Un médicament créé, renommé ou supprimé peut changer toute recherche"""
+    transaction.on_commit(search_cache.clear)
+
+
+@receiver(post_save, sender=ActiveIngredient)
+@receiver(post_delete, sender=ActiveIngredient)
+@receiver(post_save, sender=MedicineSynonym)
+@receiver(post_delete, sender=MedicineSynonym)
+def invalidate_synonym_searches(sender, instance, **kwargs):
+    """Un synonyme modifié change l'expansion des recherches"""
+    transaction.on_commit(search_cache.clear)
@@ -0,0 +1,177 @@
+"""
+Index spatial en mémoire des pharmacies actives.
+
+Les pharmacies sont rangées dans une grille uniforme latitude/longitude :
+chaque cellule contient les identifiants et coordonnées des pharmacies qui
+s'y trouvent. Une recherche par rayon ne parcourt que les cellules qui
+recoupent la boîte englobante du cercle, au lieu de charger toutes les
+pharmacies depuis la base à chaque requête.
+
+Chaque cellule garde aussi ses coordonnées en tableaux contigus
+(``CoordinateSet``) pour que le calcul des distances se fasse en un seul
+appel vectorisé sur l'ensemble des candidats.
+
+L'index est propre à chaque processus : il est construit à la première
+utilisation, patché par les signaux de ``Pharmacy`` (voir ``signals.py``)
+et reconstruit périodiquement pour rattraper les écritures faites par les
+autres workers.
+"""
+import threading
+import time
+from math import radians, degrees, sin, cos, asin, floor
+
+from django.conf import settings
+
+from .distance import CoordinateSet, EARTH_RADIUS_KM
+
+
+# Marge ajoutée au rayon de la boîte englobante pour ne pas perdre de
+# pharmacie en bordure à cause des erreurs d'arrondi flottant.
+RADIUS_MARGIN_KM = 0.01
+
+
+class PharmacySpatialIndex:
+    """
+    Grille de cellules ``(ligne, colonne)`` -> ``{pharmacy_id: (lat, lon)}``.
+
+    Toutes les méthodes publiques sont thread-safe.
+    """
+
+    def __init__(self, cell_size=None, ttl=None):
+        # Taille d'une cellule en degrés (0.05° ≈ 5.5 km à l'équateur)
+        self.cell_size = cell_size or getattr(settings, 'PHARMACY_INDEX_CELL_SIZE', 0.05)
+        # Durée de vie de l'index avant reconstruction complète (secondes)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'PHARMACY_INDEX_TTL', 300)
+        self._lock = threading.RLock()
+        self._cells = {}
+        self._arrays = {}
+        self._entries = {}
+        self._built_at = None
+
+    def _cell(self, lat, lon):
+        return (floor(lat / self.cell_size), floor(lon / self.cell_size))
+
+    def _add(self, cells, entries, pharmacy_id, lat, lon):
+        cell = self._cell(lat, lon)
+        cells.setdefault(cell, {})[pharmacy_id] = (lat, lon)
+        entries[pharmacy_id] = cell
+        return cell
+
+    @staticmethod
+    def _to_arrays(bucket):
+        return CoordinateSet.from_rows(
+            (pharmacy_id, lat, lon) for pharmacy_id, (lat, lon) in bucket.items()
+        )
+
+    def rebuild(self):
+        """Reconstruit entièrement l'index depuis la base"""
+        from .models import Pharmacy
+
+        rows = Pharmacy.objects.filter(is_active=True).values_list(
+            'id', 'latitude', 'longitude'
+        )
+        cells, entries = {}, {}
+        for pharmacy_id, lat, lon in rows:
+            self._add(cells, entries, pharmacy_id, lat, lon)
+        arrays = {cell: self._to_arrays(bucket) for cell, bucket in cells.items()}
+
+        with self._lock:
+            self._cells = cells
+            self._arrays = arrays
+            self._entries = entries
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Force une reconstruction à la prochaine recherche"""
+        with self._lock:
+            self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _ensure_built(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at > self.ttl:
+            self.rebuild()
+
+    def upsert(self, pharmacy_id, lat, lon):
+        """Ajoute ou déplace une pharmacie (sans effet si l'index n'est pas construit)"""
+        with self._lock:
+            if not self.is_built:
+                return
+            self._discard(pharmacy_id)
+            cell = self._add(self._cells, self._entries, pharmacy_id, lat, lon)
+            self._arrays[cell] = self._to_arrays(self._cells[cell])
+
+    def remove(self, pharmacy_id):
+        """Retire une pharmacie de l'index"""
+        with self._lock:
+            if self.is_built:
+                self._discard(pharmacy_id)
+
+    def _discard(self, pharmacy_id):
+        cell = self._entries.pop(pharmacy_id, None)
+        if cell is None:
+            return
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(pharmacy_id, None)
+            if bucket:
+                self._arrays[cell] = self._to_arrays(bucket)
+            else:
+                del self._cells[cell]
+                del self._arrays[cell]
+
+    def _bounding_cells(self, lat, lon, radius_km):
+        """
+        Retourne les bornes (lignes, colonnes) de la boîte englobante du
+        cercle, ou ``None`` pour les colonnes si toutes les longitudes sont
+        concernées (pôles, antiméridien ou rayon très grand).
+        """
+        angular = radius_km / EARTH_RADIUS_KM
+        min_lat = lat - degrees(angular)
+        max_lat = lat + degrees(angular)
+        rows = (floor(min_lat / self.cell_size), floor(max_lat / self.cell_size))
+
+        if min_lat <= -90 or max_lat >= 90 or sin(angular) >= cos(radians(lat)):
+            return rows, None
+
+        delta_lon = degrees(asin(sin(angular) / cos(radians(lat))))
+        min_lon, max_lon = lon - delta_lon, lon + delta_lon
+        if min_lon < -180 or max_lon > 180:
+            return rows, None
+        return rows, (floor(min_lon / self.cell_size), floor(max_lon / self.cell_size))
+
+    def candidates(self, lat, lon, radius_km):
+        """
+        Coordonnées (``CoordinateSet``) des pharmacies situées dans les
+        cellules qui recoupent le cercle de centre (lat, lon) et de rayon
+        ``radius_km``.
+
+        Le résultat est un sur-ensemble des pharmacies dans le rayon : la
+        distance exacte reste à calculer par l'appelant (``within``).
+        """
+        self._ensure_built()
+        (row_min, row_max), cols = self._bounding_cells(lat, lon, radius_km + RADIUS_MARGIN_KM)
+
+        with self._lock:
+            n_cells = (row_max - row_min + 1) * ((cols[1] - cols[0] + 1) if cols else 1)
+            if cols is None or n_cells > len(self._arrays):
+                # Parcourir les cellules non vides plutôt que la grille complète
+                selected = [
+                    arrays for (row, col), arrays in self._arrays.items()
+                    if row_min <= row <= row_max
+                    and (cols is None or cols[0] <= col <= cols[1])
+                ]
+            else:
+                selected = [
+                    self._arrays[(row, col)]
+                    for row in range(row_min, row_max + 1)
+                    for col in range(cols[0], cols[1] + 1)
+                    if (row, col) in self._arrays
+                ]
+        return CoordinateSet.concatenate(selected)
+
+
+pharmacy_index = PharmacySpatialIndex()
@@ -0,0 +1,642 @@
+import time
+
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework import status
+
+from .models import Pharmacy
+from stocks.availability import availability
+
+from .search_cache import SearchResultCache, search_cache
+from .spatial_index import PharmacySpatialIndex, pharmacy_index
+from .distance import CoordinateSet, distance_km, haversine
+
+
+class PharmacySpatialIndexTestCase(TestCase):
+    """Tests pour l'index spatial en mémoire des pharmacies"""
+
+    def setUp(self):
+        self.index = PharmacySpatialIndex(cell_size=0.05, ttl=300)
+        self.center = Pharmacy.objects.create(
+            name='Centre', address='Yaoundé', phone='600000001',
+            latitude=3.8480, longitude=11.5021
+        )
+        self.close = Pharmacy.objects.create(
+            name='Proche', address='Yaoundé', phone='600000002',
+            latitude=3.8600, longitude=11.5200
+        )
+        self.far = Pharmacy.objects.create(
+            name='Douala', address='Douala', phone='600000003',
+            latitude=4.0511, longitude=9.7679
+        )
+
+    def test_candidates_only_nearby_cells(self):
+        """Une recherche locale ne retourne pas les pharmacies lointaines"""
+        ids = self.index.candidates(3.8480, 11.5021, 5).ids.tolist()
+        self.assertIn(self.center.id, ids)
+        self.assertIn(self.close.id, ids)
+        self.assertNotIn(self.far.id, ids)
+
+    def test_candidates_superset_of_radius(self):
+        """Toute pharmacie dans le rayon fait partie des candidats"""
+        for radius in [1, 5, 50, 300]:
+            ids = set(self.index.candidates(3.8480, 11.5021, radius).ids.tolist())
+            for pharmacy in Pharmacy.objects.all():
+                if distance_km(3.8480, 11.5021, pharmacy.latitude, pharmacy.longitude) <= radius:
+                    self.assertIn(pharmacy.id, ids)
+
+    def test_upsert_and_remove(self):
+        """L'index est patché sans reconstruction"""
+        self.index.rebuild()
+        self.index.upsert(self.far.id, 3.8490, 11.5030)
+        self.assertIn(self.far.id, self.index.candidates(3.8480, 11.5021, 1).ids)
+        self.index.remove(self.far.id)
+        self.assertNotIn(self.far.id, self.index.candidates(3.8480, 11.5021, 1).ids)
+
+
+class DistanceKernelTestCase(TestCase):
+    """Tests pour le noyau de distances vectorisé"""
+
+    def test_matches_scalar_haversine(self):
+        """Le calcul vectorisé donne les mêmes distances que le calcul scalaire"""
+        from math import radians, cos, sin, asin, sqrt
+        lats, lons = [3.8667, 4.0511, -3.0], [11.5167, 9.7679, 10.0]
+        expected = []
+        for lat, lon in zip(lats, lons):
+            lat1, lon1, lat2, lon2 = map(radians, [3.8480, 11.5021, lat, lon])
+            a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+            expected.append(6371 * 2 * asin(sqrt(a)))
+        for got, want in zip(haversine(3.8480, 11.5021, lats, lons), expected):
+            self.assertAlmostEqual(got, want, places=9)
+
+    def test_within_filters_and_sorts(self):
+        """within() filtre par rayon et trie par distance, de façon stable"""
+        points = CoordinateSet(
+            [1, 2, 3, 4],
+            [4.0511, 3.8667, 3.8480, 3.8667],
+            [9.7679, 11.5167, 11.5021, 11.5167],
+        )
+        ids, distances = points.within(3.8480, 11.5021, 10)
+        self.assertEqual(ids.tolist(), [3, 2, 4])
+        self.assertEqual(distances[0], 0)
+
+
+class NearbyPharmaciesTestCase(APITestCase):
+    """Tests pour les endpoints de pharmacies à proximité"""
+
+    def setUp(self):
+        pharmacy_index.invalidate()
+        coordinates = [
+            (3.8480, 11.5021), (3.8667, 11.5167), (3.8300, 11.4900),
+            (3.9000, 11.5500), (4.0511, 9.7679), (3.8480, 11.5021),
+        ]
+        for i, (lat, lon) in enumerate(coordinates):
+            Pharmacy.objects.create(
+                name=f'Pharmacie {i}', address='Cameroun', phone=f'60000000{i}',
+                latitude=lat, longitude=lon
+            )
+
+    def test_nearby_sorted_by_distance(self):
+        """Les résultats sont filtrés par rayon et triés par distance"""
+        response = self.client.get(
+            reverse('nearby_pharmacies'),
+            {'latitude': 3.8480, 'longitude': 11.5021, 'radius': 10}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        distances = [p['distance'] for p in response.data['pharmacies']]
+        self.assertEqual(len(distances), 5)
+        self.assertEqual(distances, sorted(distances))
+
+    def test_radius_edge_rounding(self):
+        """/api/nearby/ compare le rayon à la distance arrondie, nearby à la distance exacte"""
+        from .distance import distance_km
+
+        latitude = 4.0600
+        distance = distance_km(latitude, 9.7679, 4.0511, 9.7679)
+        while round(distance, 2) >= distance:
+            latitude += 0.00001
+            distance = distance_km(latitude, 9.7679, 4.0511, 9.7679)
+        params = {'latitude': latitude, 'longitude': 9.7679, 'radius': round(distance, 2)}
+        names = [p['name'] for p in self.client.get(reverse('nearby_pharmacies'), params).data['pharmacies']]
+        self.assertIn('Pharmacie 4', names)
+        names = [p['name'] for p in self.client.get(reverse('pharmacy-nearby'), params).data['results']]
+        self.assertNotIn('Pharmacie 4', names)
+
+    def test_new_pharmacy_visible_immediately(self):
+        """Une pharmacie créée après construction de l'index est trouvée"""
+        url = reverse('pharmacy-nearby')
+        params = {'latitude': 4.0511, 'longitude': 9.7679, 'radius': 2}
+        self.assertEqual(self.client.get(url, params).data['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Pharmacy.objects.create(
+                name='Nouvelle', address='Douala', phone='600000099',
+                latitude=4.0520, longitude=9.7690
+            )
+        self.assertEqual(self.client.get(url, params).data['count'], 2)
+
+    def test_deactivated_pharmacy_hidden(self):
+        """Une pharmacie désactivée disparaît des résultats"""
+        url = reverse('pharmacy-nearby')
+        params = {'latitude': 4.0511, 'longitude': 9.7679, 'radius': 2}
+        self.assertEqual(self.client.get(url, params).data['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Pharmacy.objects.filter(name='Pharmacie 4').get().reject('Test')
+        self.assertEqual(self.client.get(url, params).data['count'], 0)
+
+
+class SearchMedicineTestCase(APITestCase):
+    """Tests pour la recherche de médicaments avec pharmacies"""
+
+    def setUp(self):
+        from decimal import Decimal
+        from medicines.models import Medicine
+        from medicines.synonyms import synonym_index
+        from medicines.text_index import medicine_index
+        from stocks.models import Stock
+
+        pharmacy_index.invalidate()
+        medicine_index.invalidate()
+        synonym_index.invalidate()
+        search_cache.clear()
+        availability.invalidate()
+        self.yaounde = Pharmacy.objects.create(
+            name='Pharmacie Yaoundé', address='Yaoundé', phone='600000001',
+            latitude=3.8480, longitude=11.5021
+        )
+        self.mvog = Pharmacy.objects.create(
+            name='Pharmacie Mvog-Mbi', address='Yaoundé', phone='600000002',
+            latitude=3.8600, longitude=11.5200
+        )
+        self.douala = Pharmacy.objects.create(
+            name='Pharmacie Douala', address='Douala', phone='600000003',
+            latitude=4.0511, longitude=9.7679
+        )
+        self.paracetamol = Medicine.objects.create(
+            name='Paracétamol', dosage='500mg', form='comprimé',
+            description='Analgésique et antipyrétique'
+        )
+        self.amoxicilline = Medicine.objects.create(
+            name='Amoxicilline', dosage='500mg', form='gélule',
+            description='Antibiotique'
+        )
+        for pharmacy, price in [(self.douala, 450), (self.mvog, 550), (self.yaounde, 500)]:
+            Stock.objects.create(
+                pharmacy=pharmacy, medicine=self.paracetamol,
+                quantity=10, price=Decimal(price)
+            )
+        Stock.objects.create(
+            pharmacy=self.douala, medicine=self.amoxicilline,
+            quantity=5, price=Decimal(1500)
+        )
+
+    def test_search_filters_and_sorts_by_distance(self):
+        """Seules les pharmacies dans le rayon sont retournées, triées par distance"""
+        response = self.client.get(reverse('search'), {
+            'q': 'paracétamol', 'latitude': 3.8480, 'longitude': 11.5021,
+            'max_distance': 10
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        result = response.data['results'][0]
+        self.assertEqual(
+            [p['name'] for p in result['pharmacies']],
+            ['Pharmacie Yaoundé', 'Pharmacie Mvog-Mbi']
+        )
+        self.assertEqual(result['min_price'], 500.0)
+
+    def test_search_without_location(self):
+        """Sans coordonnées, toutes les pharmacies en stock sont retournées"""
+        response = self.client.get(reverse('search'), {'q': 'paracétamol'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['total_pharmacies'], 3)
+
+    def test_search_ignores_accents(self):
+        """« paracetamol » trouve « Paracétamol »"""
+        response = self.client.get(reverse('search'), {'q': 'PARACETAMOL'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Paracétamol')
+
+    def test_search_no_match(self):
+        """Une recherche sans résultat retourne un message"""
+        response = self.client.get(reverse('search'), {'q': 'inexistant'})
+        self.assertEqual(response.data['results'], [])
+        self.assertIn('message', response.data)
+
+    def test_search_by_brand_name(self):
+        """« doliprane » trouve le paracétamol par son nom de marque"""
+        from medicines.models import ActiveIngredient, MedicineSynonym
+
+        ingredient = ActiveIngredient.objects.create(name='Paracétamol')
+        MedicineSynonym.objects.create(ingredient=ingredient, name='Doliprane')
+        response = self.client.get(reverse('search'), {'q': 'doliprane 500'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Paracétamol')
+        self.assertNotIn('suggestions', response.data)
+
+    def test_search_typo_falls_back_to_closest_name(self):
+        """« amoxiciline 500 » retrouve « Amoxicilline » avec une suggestion"""
+        response = self.client.get(reverse('search'), {'q': 'amoxiciline 500'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Amoxicilline')
+        self.assertEqual(response.data['suggestions'], ['Amoxicilline'])
+
+    def test_search_query_count_is_constant(self):
+        """Le nombre de requêtes ne dépend pas du nombre de médicaments trouvés"""
+        from decimal import Decimal
+        from medicines.models import Medicine
+        from stocks.models import Stock
+        from medicines.synonyms import synonym_index
+        from medicines.text_index import medicine_index
+        from .models import PharmacyReview
+        from users.models import User
+
+        user = User.objects.create_user(username='client', password='Pass123!')
+        PharmacyReview.objects.create(pharmacy=self.yaounde, user=user, rating=4)
+        for i in range(20):
+            medicine = Medicine.objects.create(
+                name=f'Antalgique {i}', dosage='100mg', form='comprimé'
+            )
+            for pharmacy in [self.yaounde, self.mvog, self.douala]:
+                Stock.objects.create(
+                    pharmacy=pharmacy, medicine=medicine,
+                    quantity=3, price=Decimal(100 + i)
+                )
+        pharmacy_index.rebuild()
+        medicine_index.rebuild()
+        synonym_index.rebuild()
+        availability.rebuild()
+
+        params = {'q': 'a', 'latitude': 3.8480, 'longitude': 11.5021, 'limit': 50}
+        # 2 requêtes pour le flux des modifications (cache de recherche et
+        # matrice de disponibilité) + 1 pour la page + 1 requête jointe pour
+        # les stocks + 1 pour les notes des pharmacies
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.data['count'], 21)
+        self.assertEqual(response.data['results'][0]['pharmacies'][0]['average_rating'], 4.0)
+
+        with self.assertNumQueries(5):
+            self.client.get(reverse('search'), {'q': 'a', 'limit': 5})
+
+    def test_search_cursor_pagination(self):
+        """Les pages se suivent par curseur, sans doublon ni omission"""
+        from decimal import Decimal
+        from medicines.models import Medicine
+        from stocks.models import Stock
+
+        for name in ['Acide folique', 'Albendazole', 'Artésunate']:
+            medicine = Medicine.objects.create(name=name, dosage='100mg', form='comprimé')
+            Stock.objects.create(pharmacy=self.yaounde, medicine=medicine, quantity=3, price=Decimal(100))
+
+        names, scores, cursor = [], [], None
+        while True:
+            params = {'q': 'a', 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(reverse('search'), params)
+            self.assertLessEqual(response.data['count'], 2)
+            names += [m['name'] for m in response.data['results']]
+            scores += [m['relevance'] for m in response.data['results']]
+            cursor = response.data['next']
+            if not cursor:
+                break
+        self.assertEqual(
+            sorted(names), ['Acide folique', 'Albendazole', 'Amoxicilline', 'Artésunate', 'Paracétamol']
+        )
+        # Du plus pertinent au moins pertinent, d'une page à l'autre
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_search_loads_only_the_pharmacy_page(self):
+        """Seuls les stocks de la page de pharmacies sont chargés, quel que soit leur nombre"""
+        import re
+        from decimal import Decimal
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from stocks.models import Stock
+
+        for i in range(6):
+            pharmacy = Pharmacy.objects.create(
+                name=f'Pharmacie {i}', address='Yaoundé', phone=f'60000010{i}',
+                latitude=3.85 + i / 1000, longitude=11.50
+            )
+            Stock.objects.create(pharmacy=pharmacy, medicine=self.paracetamol, quantity=i + 1, price=Decimal(400 + i))
+
+        params = {'q': 'paracetamol', 'pharmacies_limit': 2}
+        self.client.get(reverse('search'), params)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('search'), params)
+        loaded = [
+            re.search(r'"stocks_stock"\."id" IN \(([^)]*)\)', query['sql']) for query in queries.captured_queries
+        ]
+        self.assertEqual([len(match.group(1).split(',')) for match in loaded if match], [2])
+
+        result = response.data['results'][0]
+        self.assertEqual(result['total_pharmacies'], 9)
+        self.assertEqual((result['min_price'], result['max_price']), (400.0, 550.0))
+        names = [p['name'] for p in result['pharmacies']]
+        while result['more_pharmacies']:
+            response = self.client.get(reverse('search'), dict(params, pharmacies_cursor=result['more_pharmacies']))
+            result = response.data['results'][0]
+            self.assertLessEqual(len(result['pharmacies']), 2)
+            names += [p['name'] for p in result['pharmacies']]
+        self.assertEqual(len(names), 9)
+        self.assertEqual(len(set(names)), 9)
+
+    def test_search_pharmacies_are_capped_with_more_cursor(self):
+        """Les pharmacies d'un médicament sont limitées, les suivantes via more_pharmacies"""
+        response = self.client.get(reverse('search'), {'q': 'paracetamol', 'pharmacies_limit': 2})
+        result = response.data['results'][0]
+        self.assertEqual(len(result['pharmacies']), 2)
+        self.assertEqual(result['total_pharmacies'], 3)
+        self.assertEqual(result['min_price'], 450.0)
+
+        response = self.client.get(reverse('search'), {
+            'q': 'paracetamol', 'pharmacies_limit': 2, 'pharmacies_cursor': result['more_pharmacies']
+        })
+        result = response.data['results'][0]
+        self.assertEqual([p['name'] for p in result['pharmacies']], ['Pharmacie Douala'])
+        self.assertIsNone(result['more_pharmacies'])
+
+    def test_search_invalid_cursor(self):
+        response = self.client.get(reverse('search'), {'q': 'a', 'cursor': 'pas-un-curseur'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SearchResultCacheTestCase(TestCase):
+    """Tests pour le cache des résultats de recherche"""
+
+    def setUp(self):
+        self.cache = SearchResultCache(max_entries=2, ttl=60, cell_size=0.01)
+        # Position initiale dans le flux des modifications de stock
+        self.cache._apply_changes()
+
+    def test_key_groups_positions_by_cell(self):
+        key = self.cache.key('Paracétamol', 3.8481, 11.5021, 10)
+        self.assertEqual(key, self.cache.key('paracetamol', 3.8489, 11.5029, 10))
+        self.assertNotEqual(key, self.cache.key('paracetamol', 3.8581, 11.5021, 10))
+        self.assertNotEqual(key, self.cache.key('paracetamol', 3.8481, 11.5021, 20))
+        lat, lon = self.cache.cell_center(key)
+        self.assertAlmostEqual(lat, 3.845)
+        self.assertAlmostEqual(lon, 11.505)
+        # Tout point de la cellule est à moins de cell_reach du centre
+        self.assertGreaterEqual(self.cache.cell_reach(key), distance_km(lat, lon, 3.8401, 11.5001))
+        self.assertLess(self.cache.cell_reach(key), 0.8)
+
+    def test_hit_miss_and_lru_eviction(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 1, [1])
+        self.cache.set('b', 2, [2])
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3, [3])  # évince « b », le moins récemment utilisé
+        self.assertIsNone(self.cache.get('b'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 2, 1))
+
+    def test_invalidate_only_affected_entries(self):
+        self.cache.set('a', 1, [1, 2])
+        self.cache.set('b', 2, [3])
+        self.cache.invalidate_medicines([2])
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_stale_result_not_stored(self):
+        version = self.cache.version
+        self.cache.invalidate_medicines([1])
+        self.cache.set('a', 1, [1], version=version)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_expired_entry(self):
+        from unittest import mock
+
+        self.cache.set('a', 1, [1])
+        with mock.patch('pharmacies.search_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+class SearchCacheEndpointTestCase(APITestCase):
+    """Tests pour le cache de search_medicine et son invalidation"""
+
+    def setUp(self):
+        from decimal import Decimal
+        from medicines.models import Medicine
+        from medicines.synonyms import synonym_index
+        from medicines.text_index import medicine_index
+        from stocks.models import Stock
+
+        pharmacy_index.invalidate()
+        medicine_index.invalidate()
+        synonym_index.invalidate()
+        search_cache.clear()
+        search_cache.reset_stats()
+        availability.invalidate()
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Yaoundé', address='Yaoundé', phone='600000001',
+            latitude=3.8480, longitude=11.5021
+        )
+        self.paracetamol = Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        self.quinine = Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        self.stock = Stock.objects.create(
+            pharmacy=self.pharmacy, medicine=self.paracetamol, quantity=10, price=Decimal(500)
+        )
+        Stock.objects.create(pharmacy=self.pharmacy, medicine=self.quinine, quantity=5, price=Decimal(800))
+        self.params = {'q': 'paracetamol', 'latitude': 3.8480, 'longitude': 11.5021, 'max_distance': 10}
+
+    def test_repeated_search_reuses_cached_candidates(self):
+        self.client.get(reverse('search'), self.params)
+        # Seuls le flux des modifications, les stocks de la page et les notes
+        # des pharmacies sont lus
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('search'), dict(self.params, latitude=3.8482))
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+    def test_cached_candidates_use_the_real_position(self):
+        """Deux positions d'une même cellule ont leurs propres distances et leur propre rayon"""
+        near = {'latitude': 3.8475, 'longitude': 11.5016}
+        far = {'latitude': 3.8401, 'longitude': 11.5099}
+        self.assertEqual(search_cache.key('q', near['latitude'], near['longitude'], 1),
+                         search_cache.key('q', far['latitude'], far['longitude'], 1))
+        params = dict(self.params, max_distance=1)
+
+        response = self.client.get(reverse('search'), dict(params, **near))
+        distance = response.data['results'][0]['pharmacies'][0]['distance']
+        self.assertEqual(distance, round(distance_km(near['latitude'], near['longitude'], 3.8480, 11.5021), 2))
+
+        response = self.client.get(reverse('search'), dict(params, **far))
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get(reverse('search'), dict(params, **far, max_distance=2))
+        distance = response.data['results'][0]['pharmacies'][0]['distance']
+        self.assertEqual(distance, round(distance_km(far['latitude'], far['longitude'], 3.8480, 11.5021), 2))
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+    def test_stock_change_invalidates_matching_searches_only(self):
+        self.client.get(reverse('search'), self.params)
+        self.client.get(reverse('search'), dict(self.params, q='quinine'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.quantity = 0
+            self.stock.save()
+        self.assertEqual(search_cache.stats()['entries'], 1)
+
+        response = self.client.get(reverse('search'), self.params)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_writes_of_other_processes_invalidate_matching_searches(self):
+        """Une écriture hors de ce processus (sans signal) est lue depuis le flux StockChange"""
+        from stocks.models import Stock, StockChange
+
+        self.assertEqual(self.client.get(reverse('search'), self.params).data['count'], 1)
+        self.client.get(reverse('search'), dict(self.params, q='quinine'))
+
+        Stock.objects.filter(pk=self.stock.pk).update(quantity=0, is_available=False)
+        StockChange.for_stocks([self.stock])
+        self.assertEqual(self.client.get(reverse('search'), self.params).data['count'], 0)
+        self.client.get(reverse('search'), dict(self.params, q='quinine'))
+        # Seule la recherche du médicament modifié a été invalidée
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+    def test_stats_endpoint_requires_admin(self):
+        from users.models import User
+
+        url = reverse('search-cache-stats')
+        self.assertIn(self.client.get(url).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        admin = User.objects.create_superuser(username='admin', password='Pass123!', email='admin@example.com')
+        self.client.force_authenticate(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_rate', response.data)
+
+
+class BasketSearchTestCase(APITestCase):
+    """Tests pour la recherche d'une ordonnance complète"""
+
+    def setUp(self):
+        from decimal import Decimal
+        from medicines.models import Medicine
+        from stocks.models import Stock
+
+        pharmacy_index.invalidate()
+        availability.invalidate()
+        self.near = Pharmacy.objects.create(
+            name='Pharmacie Proche', address='Yaoundé', phone='600000001',
+            latitude=3.8480, longitude=11.5021
+        )
+        self.other = Pharmacy.objects.create(
+            name='Pharmacie Voisine', address='Yaoundé', phone='600000002',
+            latitude=3.8600, longitude=11.5200
+        )
+        self.medicines = [
+            Medicine.objects.create(name=name, dosage='500mg', form='comprimé')
+            for name in ('Paracétamol', 'Amoxicilline', 'Quinine')
+        ]
+        paracetamol, amoxicilline, quinine = self.medicines
+        for pharmacy, medicine, price in [
+            (self.near, paracetamol, 500), (self.near, amoxicilline, 1500),
+            (self.other, paracetamol, 450), (self.other, quinine, 800),
+        ]:
+            Stock.objects.create(pharmacy=pharmacy, medicine=medicine, quantity=5, price=Decimal(price))
+        self.ids = ','.join(str(m.id) for m in self.medicines)
+
+    def test_ranking_and_greedy_cover(self):
+        response = self.client.get(reverse('basket-search'), {
+            'medicines': self.ids, 'latitude': 3.8480, 'longitude': 11.5021
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Même couverture (2/3) : la plus proche d'abord
+        self.assertEqual([p['name'] for p in response.data['pharmacies']], ['Pharmacie Proche', 'Pharmacie Voisine'])
+        self.assertEqual(response.data['pharmacies'][0]['missing'], [self.medicines[2].id])
+        self.assertEqual(response.data['pharmacies'][0]['total_price'], 2000.0)
+
+        cover = response.data['cover']
+        self.assertTrue(cover['complete'])
+        self.assertEqual([p['name'] for p in cover['pharmacies']], ['Pharmacie Proche', 'Pharmacie Voisine'])
+        self.assertEqual([m['medicine_name'] for m in cover['pharmacies'][1]['medicines']], ['Quinine'])
+
+    def test_single_pharmacy_covering_basket(self):
+        from decimal import Decimal
+        from stocks.models import Stock
+
+        Stock.objects.create(pharmacy=self.other, medicine=self.medicines[1], quantity=1, price=Decimal(1600))
+        response = self.client.get(reverse('basket-search'), {'medicines': self.ids})
+        self.assertEqual(response.data['pharmacies'][0]['name'], 'Pharmacie Voisine')
+        self.assertEqual(response.data['pharmacies'][0]['coverage'], 3)
+        self.assertEqual([p['name'] for p in response.data['cover']['pharmacies']], ['Pharmacie Voisine'])
+
+    def test_uncovered_medicine(self):
+        from medicines.models import Medicine
+
+        missing = Medicine.objects.create(name='Artésunate', dosage='100mg', form='comprimé')
+        response = self.client.get(reverse('basket-search'), {'medicines': f'{self.ids},{missing.id}'})
+        self.assertFalse(response.data['cover']['complete'])
+        self.assertEqual(response.data['cover']['uncovered'], [missing.id])
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        availability.rebuild()
+        # Flux des modifications + stocks des pharmacies désignées par la
+        # matrice + notes des pharmacies
+        with self.assertNumQueries(3):
+            self.client.get(reverse('basket-search'), {'medicines': self.ids})
+
+    def test_reads_only_pharmacies_with_the_medicines(self):
+        from medicines.models import Medicine
+        from .basket import basket_stocks
+
+        Pharmacy.objects.create(
+            name='Pharmacie Vide', address='Yaoundé', phone='600000003',
+            latitude=3.8490, longitude=11.5030
+        )
+        missing = Medicine.objects.create(name='Artésunate', dosage='100mg', form='comprimé')
+        availability.rebuild()
+        self.assertEqual(basket_stocks([missing.id], 3.8480, 11.5021), [])
+        stocks = basket_stocks([m.id for m in self.medicines], 3.8480, 11.5021)
+        self.assertEqual({s.pharmacy.name for s in stocks}, {'Pharmacie Proche', 'Pharmacie Voisine'})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('basket-search')).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('basket-search'), {'medicines': '1,abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RankingTestCase(TestCase):
+    """Tests pour le score de pertinence vectorisé"""
+
+    def test_components(self):
+        from .ranking import score_hits
+
+        weights = {'text': 1, 'distance': 1, 'price': 1, 'stock': 1, 'rating': 1}
+        scores = score_hits(
+            text=[1, 1, 1],
+            prices=[500, 500, 1000],
+            average_prices=[1000, 1000, 1000],
+            quantities=[10, 10, 10],
+            ratings=[None, None, None],
+            distances=[1, 5, 1],
+            max_distance=10,
+            weights=weights,
+        )
+        # Plus proche à prix égal, puis moins cher à distance égale
+        self.assertGreater(scores[0], scores[1])
+        self.assertGreater(scores[0], scores[2])
+        self.assertTrue(((scores >= 0) & (scores <= 1)).all())
+
+    def test_weights_change_order(self):
+        from .ranking import score_hits
+
+        args = dict(
+            text=[1, 1], prices=[400, 900], average_prices=[1000, 1000],
+            quantities=[5, 5], ratings=[None, None], distances=[9, 1], max_distance=10,
+        )
+        by_price = score_hits(weights={'price': 1, 'distance': 0.1}, **args)
+        by_distance = score_hits(weights={'price': 0.1, 'distance': 1}, **args)
+        self.assertGreater(by_price[0], by_price[1])
+        self.assertGreater(by_distance[1], by_distance[0])
+
+    def test_rank_medicines_uses_best_hit(self):
+        import numpy as np
+        from .ranking import rank_medicines
+
+        ids, best = rank_medicines([7, 7, 3, 5], np.array([0.2, 0.9, 0.5, 0.9]))
+        self.assertEqual(ids.tolist(), [5, 7, 3])
+        self.assertEqual(best.tolist(), [0.9, 0.9, 0.5])
@@ -10,6 +10,8 @@ router.register(r'reviews', PharmacyReviewViewSet, basename='review')
 urlpatterns = [
     path('', include(router.urls)),
     path('search/', views.search_medicine, name='search'),
+    path('search/basket/', views.basket_search, name='basket-search'),
+    path('search/cache-stats/', views.search_cache_stats, name='search-cache-stats'),
     path('nearby/', views.nearby_pharmacies, name='nearby_pharmacies'),
     path('pharmacy/<int:pharmacy_id>/', views.pharmacy_detail, name='pharmacy_detail'),
     
@@ -1,28 +1,30 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action , api_view
+from rest_framework.decorators import action , api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
-from math import radians, cos, sin, asin, sqrt, atan2
 from .models import Pharmacy
 from .serializers import PharmacySerializer
+from . import geo
+from .basket import search_basket
+from .search_cache import search_cache
+from .search_engine import SearchPage, execute_search, find_candidates, medicine_pharmacies
+from core.cursors import decode_cursor, encode_cursor
+from users.search_recorder import search_recorder
+from datetime import datetime, time
+from django.conf import settings
 from django.db.models import Q 
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from medicines.models import Medicine
 from stocks.models import Stock 
 from medicines.serializers import MedicineSearchResultSerializer , MedicineSerializer
-def haversine(lon1, lat1, lon2, lat2):
-    """
-    Calcule la distance entre deux points GPS en kilomètres
-    """
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    km = 6371 * c
-    return km
+
+
+def _position_query(latitude, longitude):
+    """Texte enregistré dans l'historique pour une recherche de proximité"""
+    return f'{latitude:.4f},{longitude:.4f}'
 
 
 class PharmacyViewSet(viewsets.ModelViewSet):
@@ -88,19 +90,10 @@ class PharmacyViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Récupérer toutes les pharmacies actives
-        pharmacies = Pharmacy.objects.filter(is_active=True)
-        
-        # Calculer les distances et filtrer
-        nearby_pharmacies = []
-        for pharmacy in pharmacies:
-            distance = haversine(user_lon, user_lat, pharmacy.longitude, pharmacy.latitude)
-            if distance <= radius:
-                pharmacy.distance = round(distance, 2)
-                nearby_pharmacies.append(pharmacy)
-        
-        # Trier par distance
-        nearby_pharmacies.sort(key=lambda x: x.distance)
+        # Filtrer par rayon (distance exacte, comme à l'origine) et trier
+        # par distance (PostGIS ou index spatial)
+        nearby_pharmacies = geo.pharmacies_within(user_lat, user_lon, radius, rounded=False)
+        search_recorder.record(request.user, _position_query(user_lat, user_lon), 'nearby', len(nearby_pharmacies))
         
         serializer = self.get_serializer(nearby_pharmacies, many=True)
         return Response({
@@ -114,22 +107,15 @@ class PharmacyViewSet(viewsets.ModelViewSet):
         })
 
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """
-    Calcule la distance entre deux points GPS (formule de Haversine)
-    Retourne la distance en kilomètres
-    """
-    R = 6371  # Rayon de la Terre en km
-    
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    distance = R * c
-    
-    return round(distance, 2)
+# Nombre maximal de médicaments dans une recherche de panier
+MAX_BASKET_SIZE = 20
+
+
+def _bounded_int(value, default, maximum):
+    """Entier entre 1 et ``maximum`` ; ``default`` si absent"""
+    if value in (None, ''):
+        return default
+    return min(max(int(value), 1), maximum)
 
 
 @api_view(['GET'])
@@ -142,6 +128,12 @@ def search_medicine(request):
     - latitude: position de l'utilisateur (optionnel)
     - longitude: position de l'utilisateur (optionnel)
     - max_distance: distance max en km (optionnel, défaut: 50)
+    - limit: médicaments par page (optionnel, défaut: SEARCH_PAGE_SIZE)
+    - cursor: curseur "next" de la page précédente (optionnel)
+    - pharmacies_limit: pharmacies par médicament (optionnel,
+      défaut: SEARCH_PHARMACIES_PER_MEDICINE)
+    - pharmacies_cursor: curseur "more_pharmacies" d'un médicament, pour
+      obtenir ses pharmacies suivantes (optionnel)
     
     Exemple: /api/search/?q=doliprane&latitude=3.848&longitude=11.502
     """
@@ -173,82 +165,210 @@ def search_medicine(request):
                 'error': 'Les coordonnées doivent être des nombres valides'
             }, status=status.HTTP_400_BAD_REQUEST)
     
-    # 4. Rechercher les médicaments (recherche floue et flexible)
-    # Split query into words for better partial matching
-    query_words = query.lower().split()
+    # 4. Pagination par curseurs
+    cursor = request.GET.get('cursor')
+    pharmacies_cursor = request.GET.get('pharmacies_cursor')
+    try:
+        limit = _bounded_int(request.GET.get('limit'), settings.SEARCH_PAGE_SIZE, settings.SEARCH_MAX_PAGE_SIZE)
+        pharmacies_limit = _bounded_int(
+            request.GET.get('pharmacies_limit'),
+            settings.SEARCH_PHARMACIES_PER_MEDICINE,
+            settings.SEARCH_MAX_PAGE_SIZE
+        )
+        after = decode_cursor(cursor) if cursor else None
+        more = decode_cursor(pharmacies_cursor) if pharmacies_cursor else None
+        if after is not None:
+            score, medicine_id = after
+            after = [float(score), int(medicine_id)]
+        if more is not None:
+            medicine_id, offset = more
+            more = [int(medicine_id), max(0, int(offset))]
+    except (TypeError, ValueError):
+        return Response({
+            'error': 'Paramètres de pagination invalides'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # 5. Candidats (médicaments correspondants et leurs stocks) en cache par
+    # recherche normalisée, cellule géographique et rayon
+    has_location = bool(user_lat and user_lon)
+    latitude = user_lat if has_location else None
+    longitude = user_lon if has_location else None
+    cache_key = search_cache.key(query, latitude=latitude, longitude=longitude, max_distance=max_distance)
+    candidates = search_cache.get(cache_key)
+    if candidates is None and more is None:
+        version = search_cache.version
+        if has_location and search_cache.enabled:
+            # Mêmes candidats pour toute la cellule : pharmacies du rayon
+            # élargi autour de son centre
+            center_lat, center_lon = search_cache.cell_center(cache_key)
+            candidates = find_candidates(
+                query, center_lat, center_lon, max_distance + search_cache.cell_reach(cache_key)
+            )
+        else:
+            candidates = find_candidates(query, latitude, longitude, max_distance)
+        search_cache.set(cache_key, candidates, candidates.medicine_ids, version=version)
+    
+    # 6. Distances, rayon et classement depuis la position de l'utilisateur
+    if more is not None:
+        # 6a. Pharmacies suivantes d'un seul médicament, depuis les candidats
+        # de la recherche d'origine s'ils sont en cache, sinon depuis les
+        # pharmacies qui l'ont selon la matrice de disponibilité
+        medicines = medicine_pharmacies(
+            more[0], more[1], limit=pharmacies_limit,
+            latitude=latitude, longitude=longitude, max_distance=max_distance, candidates=candidates
+        )
+        page = SearchPage(medicines, [more[0]], [], None)
+    else:
+        # 6b. Page de médicaments, puis les stocks de leurs pages de
+        # pharmacies en une requête
+        page = execute_search(
+            query, latitude=latitude, longitude=longitude, max_distance=max_distance,
+            after=after, limit=limit, pharmacies_limit=pharmacies_limit, candidates=candidates
+        )
     
-    # Build query for each word
-    medicine_query = Q()
-    for word in query_words:
-        medicine_query |= Q(name__icontains=word) | Q(description__icontains=word)
+    # 7. Sérialiser la page en une passe
+    payload = {
+        'found': bool(page.medicine_ids),
+        'results': MedicineSearchResultSerializer(page.medicines, many=True).data,
+        'corrections': page.corrections,
+        'next': encode_cursor(page.next_position) if page.next_position else None,
+    }
     
-    medicines = Medicine.objects.filter(medicine_query).distinct()
+    if cursor is None and pharmacies_cursor is None:
+        # Historique : seules les premières pages comptent comme une recherche
+        search_recorder.record(
+            request.user, query, 'medicine',
+            len(payload['results']) if payload['found'] else 0
+        )
     
-    if not medicines.exists():
+    if not payload['found']:
         return Response({
             'message': f'Aucun médicament trouvé pour "{query}"',
             'results': []
         })
     
-    # 5. Pour chaque médicament, trouver les pharmacies avec stock
-    results = []
-    
-    for medicine in medicines:
-        # Récupérer les stocks disponibles
-        stocks = Stock.objects.filter(
-            medicine=medicine,
-            is_available=True,
-            quantity__gt=0
-        ).select_related('pharmacy').filter(
-            pharmacy__is_active=True
-        )
-        
-        if not stocks.exists():
-            continue
-        
-        # Préparer les pharmacies avec infos de stock
-        pharmacies_with_stock = []
-        
-        for stock in stocks:
-            pharmacy = stock.pharmacy
-            
-            # Calculer la distance si coordonnées fournies
-            if user_lat and user_lon:
-                distance = calculate_distance(
-                    user_lat, user_lon,
-                    pharmacy.latitude, pharmacy.longitude
-                )
-                
-                # Filtrer par distance max
-                if distance > max_distance:
-                    continue
-                
-                pharmacy.distance = distance
-            
-            # Attacher les infos de stock à la pharmacie
-            pharmacy.stock_info = stock
-            pharmacies_with_stock.append(pharmacy)
-        
-        # Trier par distance si disponible
-        if user_lat and user_lon:
-            pharmacies_with_stock.sort(key=lambda p: getattr(p, 'distance', float('inf')))
-        
-        # Serializer le résultat
-        if pharmacies_with_stock:
-            serializer = MedicineSearchResultSerializer(
-                medicine,
-                context={'pharmacies': pharmacies_with_stock}
-            )
-            results.append(serializer.data)
+    # 8. Retourner les résultats
+    data = {
+        'query': query,
+        'count': len(payload['results']),
+        'results': payload['results'],
+        'next': payload['next']
+    }
+    if payload['corrections']:
+        # Résultats obtenus avec les noms corrigés
+        data['suggestions'] = payload['corrections']
+    return Response(data)
+
+
+@api_view(['GET'])
+def basket_search(request):
+    """
+    Recherche d'une ordonnance complète (panier de médicaments)
+    
+    Paramètres GET:
+    - medicines: identifiants des médicaments séparés par des virgules (obligatoire)
+    - latitude: position de l'utilisateur (optionnel)
+    - longitude: position de l'utilisateur (optionnel)
+    - max_distance: distance max en km (optionnel, défaut: 50)
+    - limit: nombre de pharmacies classées retournées (optionnel, défaut: 20)
+    
+    Retourne les pharmacies classées par couverture du panier, distance et
+    prix total, et le plus petit ensemble de pharmacies couvrant le panier
+    (couverture gloutonne).
+    
+    Exemple: /api/search/basket/?medicines=3,8,12&latitude=3.848&longitude=11.502
+    """
+    try:
+        medicine_ids = list(dict.fromkeys(
+            int(value) for value in request.GET.get('medicines', '').split(',') if value.strip()
+        ))
+        max_distance = float(request.GET.get('max_distance', 50))
+        limit = _bounded_int(request.GET.get('limit'), 20, settings.SEARCH_MAX_PAGE_SIZE)
+        user_lat = request.GET.get('latitude')
+        user_lon = request.GET.get('longitude')
+        has_location = bool(user_lat and user_lon)
+        if has_location:
+            user_lat, user_lon = float(user_lat), float(user_lon)
+    except ValueError:
+        return Response({
+            'error': 'Paramètres invalides'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not medicine_ids:
+        return Response({
+            'error': 'Le paramètre "medicines" est obligatoire'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(medicine_ids) > MAX_BASKET_SIZE:
+        return Response({
+            'error': f'Un panier contient au plus {MAX_BASKET_SIZE} médicaments'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    candidates, cover, uncovered = search_basket(
+        medicine_ids,
+        latitude=user_lat if has_location else None,
+        longitude=user_lon if has_location else None,
+        max_distance=max_distance
+    )
+    
+    def stock_lines(candidate, ids):
+        return [
+            {
+                'medicine_id': medicine_id,
+                'medicine_name': candidate.stocks[medicine_id].medicine.name,
+                'price': float(candidate.stocks[medicine_id].price),
+                'quantity': candidate.stocks[medicine_id].quantity,
+            }
+            for medicine_id in ids
+        ]
+    
+    pharmacies = []
+    for candidate in candidates[:limit]:
+        available = [medicine_id for medicine_id in medicine_ids if medicine_id in candidate.stocks]
+        pharmacies.append({
+            **PharmacySerializer(candidate.pharmacy).data,
+            'coverage': candidate.coverage,
+            'coverage_ratio': round(candidate.coverage / len(medicine_ids), 2),
+            'total_price': float(candidate.total_price),
+            'medicines': stock_lines(candidate, available),
+            'missing': [medicine_id for medicine_id in medicine_ids if medicine_id not in candidate.stocks],
+        })
     
-    # 6. Retourner les résultats
     return Response({
-        'query': query,
-        'count': len(results),
-        'results': results
+        'medicines': medicine_ids,
+        'count': len(pharmacies),
+        'pharmacies': pharmacies,
+        'cover': {
+            'complete': not uncovered,
+            'pharmacies': [
+                {
+                    'id': candidate.pharmacy.pk,
+                    'name': candidate.pharmacy.name,
+                    'distance': candidate.distance,
+                    'medicines': stock_lines(candidate, ids),
+                    'total_price': float(sum(candidate.stocks[medicine_id].price for medicine_id in ids)),
+                }
+                for candidate, ids in cover
+            ],
+            'uncovered': uncovered,
+        },
     })
 
 
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def search_cache_stats(request):
+    """
+    Compteurs du cache de recherche de ce processus (administrateurs)
+    
+    GET /api/search/cache-stats/ : succès, échecs, évictions, invalidations
+    DELETE /api/search/cache-stats/ : remet les compteurs à zéro
+    """
+    if request.method == 'DELETE':
+        search_cache.reset_stats()
+    return Response(search_cache.stats())
+
+
 @api_view(['GET'])
 def nearby_pharmacies(request):
     """
@@ -279,23 +399,9 @@ def nearby_pharmacies(request):
             'error': 'Les coordonnées doivent être des nombres valides'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Récupérer toutes les pharmacies actives
-    pharmacies = Pharmacy.objects.filter(is_active=True)
-    
-    # Calculer la distance pour chaque pharmacie
-    pharmacies_with_distance = []
-    for pharmacy in pharmacies:
-        distance = calculate_distance(
-            user_lat, user_lon,
-            pharmacy.latitude, pharmacy.longitude
-        )
-        
-        if distance <= radius:
-            pharmacy.distance = distance
-            pharmacies_with_distance.append(pharmacy)
-    
-    # Trier par distance
-    pharmacies_with_distance.sort(key=lambda p: p.distance)
+    # Filtrer par rayon et trier par distance (PostGIS ou index spatial)
+    pharmacies_with_distance = geo.pharmacies_within(user_lat, user_lon, radius)
+    search_recorder.record(request.user, _position_query(user_lat, user_lon), 'nearby', len(pharmacies_with_distance))
     
     # Serializer
     from .serializers import PharmacySerializer
@@ -527,13 +633,21 @@ def pharmacy_stock_stats(request):
 
 
 @extend_schema(
-    summary="Historique récent des modifications de stocks",
-    description="Retourne les dernières modifications de stocks de la pharmacie",
+    summary="Historique des mouvements de stocks",
+    description="Retourne le journal des variations de quantité des stocks de la pharmacie, "
+                "du plus récent au plus ancien, paginé par curseur. Filtres optionnels : "
+                "since / until (date ou date-heure ISO 8601), medicine (identifiant).",
 )
 @api_view(['GET'])
 def pharmacy_stock_history(request):
     """
-    Historique des 50 dernières modifications de stocks.
+    Journal des mouvements de stocks de la pharmacie de l'utilisateur.
+    
+    Paramètres GET:
+    - since, until: bornes de la période (optionnel)
+    - medicine: identifiant du médicament (optionnel)
+    - limit: mouvements par page (optionnel, défaut: STOCK_HISTORY_PAGE_SIZE)
+    - cursor: curseur "next" de la page précédente (optionnel)
     """
     if not request.user.is_authenticated:
         return Response(
@@ -547,22 +661,68 @@ def pharmacy_stock_history(request):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    pharmacy = request.user.pharmacy
+    from stocks.models import StockMovement
+    from stocks.serializers import StockMovementSerializer
     
-    # Récupérer les 50 derniers stocks modifiés
-    recent_stocks = Stock.objects.filter(
-        pharmacy=pharmacy
-    ).select_related('medicine').order_by('-last_updated')[:50]
+    movements = StockMovement.objects.filter(pharmacy=request.user.pharmacy)
+    try:
+        limit = _bounded_int(
+            request.GET.get('limit'), settings.STOCK_HISTORY_PAGE_SIZE, settings.STOCK_HISTORY_MAX_PAGE_SIZE
+        )
+        since = _parse_moment(request.GET.get('since'))
+        until = _parse_moment(request.GET.get('until'), end_of_day=True)
+        if since is not None:
+            movements = movements.filter(created_at__gte=since)
+        if until is not None:
+            movements = movements.filter(created_at__lte=until)
+        if request.GET.get('medicine'):
+            movements = movements.filter(medicine_id=int(request.GET['medicine']))
+        cursor = request.GET.get('cursor')
+        if cursor:
+            # Reprise juste après le dernier mouvement de la page précédente
+            created_at, movement_id = decode_cursor(cursor)
+            created_at = _parse_moment(created_at)
+            movements = movements.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=int(movement_id))
+            )
+    except (TypeError, ValueError):
+        return Response({
+            'error': 'Paramètres de filtre ou de pagination invalides'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    from stocks.serializers import StockListSerializer
-    serializer = StockListSerializer(recent_stocks, many=True)
+    rows = list(movements.select_related('medicine').order_by('-created_at', '-id')[:limit + 1])
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor([last.created_at.isoformat(), last.id])
     
     return Response({
-        'count': recent_stocks.count(),
-        'results': serializer.data
+        'count': len(page),
+        'results': StockMovementSerializer(page, many=True).data,
+        'next': next_cursor
     })
 
 
+def _parse_moment(value, end_of_day=False):
+    """
+    Date-heure ISO 8601 (ou date seule : début du jour, fin du jour si
+    ``end_of_day``) ; ``None`` si absente. Lève ``ValueError`` si invalide.
+    """
+    if value in (None, ''):
+        return None
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(value)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
 # ============================================================
 # VUES POUR LES AVIS (User Story 7)
 # ============================================================
@@ -3,7 +3,7 @@
 Configuration admin pour les réservations (User Story 6)
 """
 from django.contrib import admin
-from .models import Reservation, ReservationItem
+from .models import Reservation, ReservationCounter, ReservationItem
 
 
 class ReservationItemInline(admin.TabularInline):
@@ -66,6 +66,10 @@ class ReservationAdmin(admin.ModelAdmin):
     
     actions = ['confirm_reservations', 'mark_ready', 'cancel_reservations']
     
+    def get_queryset(self, request):
+        """Totaux calculés par la base, utilisateur et pharmacie joints"""
+        return super().get_queryset(request).select_related('user', 'pharmacy').with_totals()
+    
     @admin.action(description="Confirmer les réservations sélectionnées")
     def confirm_reservations(self, request, queryset):
         count = 0
@@ -112,3 +116,15 @@ class ReservationItemAdmin(admin.ModelAdmin):
     search_fields = ['reservation__reservation_number', 'medicine__name']
     readonly_fields = ['subtotal']
     raw_id_fields = ['reservation', 'medicine', 'stock']
+
+
+@admin.register(ReservationCounter)
+class ReservationCounterAdmin(admin.ModelAdmin):
+    """Admin des compteurs par statut, tenus à jour par les transitions"""
+    
+    list_display = [
+        'pharmacy', 'pending', 'confirmed', 'ready', 'collected',
+        'cancelled', 'expired', 'updated_at'
+    ]
+    readonly_fields = ['pending', 'confirmed', 'ready', 'collected', 'cancelled', 'expired', 'updated_at']
+    raw_id_fields = ['pharmacy']
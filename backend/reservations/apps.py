@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ReservationsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "reservations"
+
+    def ready(self):
+        # Maintenir les compteurs de réservations à jour lors des suppressions
+        from . import signals  # noqa: F401
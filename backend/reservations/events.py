@@ -0,0 +1,244 @@
+"""
+Diffusion en direct des événements de réservation aux tableaux de bord
+des pharmacies (création d'une réservation, changement de statut).
+
+``Reservation.save`` et le balayeur d'expiration publient via
+``publish_reservation`` ; le flux ``/api/reservations/events/`` (voir
+``streams.py``) attend les événements de la pharmacie de l'utilisateur au
+lieu de relire la liste toutes les quelques secondes.
+
+Le courtier est choisi par ``RESERVATION_EVENT_BROKER`` :
+
+- ``LocalBroker`` (défaut) diffuse au sein du processus, au commit de la
+  transaction qui publie : suffisant en développement ou avec un seul
+  processus servant à la fois l'API et le flux ;
+- ``PostgresBroker`` publie avec ``NOTIFY`` (remis au commit, abandonné
+  au rollback) ; chaque processus qui sert le flux écoute le canal dans
+  un thread et rediffuse localement. Les écritures faites par les workers
+  WSGI ou le balayeur atteignent ainsi les connexions du worker ASGI.
+
+Chaque courtier garde par pharmacie les ``RESERVATION_EVENT_HISTORY``
+derniers événements, numérotés ``<époque>:<séquence>`` : un client qui
+se reconnecte avec son dernier identifiant reçoit ce qu'il a manqué. Si
+l'identifiant vient d'un autre processus (époque différente) ou est sorti
+de l'historique, le client est invité à recharger la liste (``reset``).
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def reservation_event(reservation, previous=None, at=None):
+    """Événement d'une réservation créée (``previous`` vide) ou changée de statut"""
+    at = at or reservation.updated_at
+    return {
+        'type': 'status' if previous else 'created',
+        'reservation': reservation.id,
+        'reservation_number': reservation.reservation_number,
+        'status': reservation.status,
+        'previous_status': previous,
+        'at': at.isoformat() if at else None,
+    }
+
+
+class Subscription:
+    """
+    Abonnement d'un client asynchrone aux événements d'une pharmacie.
+
+    ``notify`` peut être appelé depuis n'importe quel thread.
+    """
+
+    def __init__(self, broker, pharmacy_id):
+        self.broker = broker
+        self.pharmacy_id = pharmacy_id
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Boucle fermée : le client est parti
+            pass
+
+    async def wait(self, timeout):
+        """Attend un événement au plus ``timeout`` secondes ; ``False`` à l'expiration"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    Courtier en mémoire, propre au processus.
+
+    Toutes les méthodes publiques sont thread-safe.
+    """
+
+    def __init__(self, history=None):
+        self.history = history if history is not None else getattr(settings, 'RESERVATION_EVENT_HISTORY', 200)
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._sequence = 0
+        # pharmacie -> événements récents (identifiant, événement)
+        self._events = defaultdict(lambda: deque(maxlen=self.history))
+        # pharmacie -> séquence du plus ancien événement retiré de l'historique
+        self._dropped = defaultdict(int)
+        self._subscribers = defaultdict(set)
+
+    def publish(self, pharmacy_id, event):
+        """Publie ``event`` aux abonnés de la pharmacie au commit de la transaction courante"""
+        transaction.on_commit(lambda: self.deliver(pharmacy_id, event))
+
+    def deliver(self, pharmacy_id, event):
+        """Ajoute ``event`` à l'historique de la pharmacie et réveille ses abonnés"""
+        with self._lock:
+            self._sequence += 1
+            events = self._events[pharmacy_id]
+            if len(events) == events.maxlen:
+                self._dropped[pharmacy_id] = events[0][0]
+            events.append((self._sequence, event))
+            subscribers = list(self._subscribers.get(pharmacy_id, ()))
+        for subscription in subscribers:
+            subscription.notify()
+
+    def subscribe(self, pharmacy_id):
+        """Abonne le client asynchrone courant (à appeler depuis la boucle d'événements)"""
+        subscription = Subscription(self, pharmacy_id)
+        with self._lock:
+            self._subscribers[pharmacy_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.pharmacy_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.pharmacy_id]
+
+    def event_id(self, sequence):
+        return f'{self.epoch}:{sequence}'
+
+    def parse_id(self, event_id):
+        """
+        Séquence d'un identifiant de ce processus, ``None`` s'il vient d'un
+        autre processus ; lève ``ValueError`` s'il est mal formé.
+        """
+        epoch, _, sequence = (event_id or '').partition(':')
+        sequence = int(sequence)
+        if sequence < 0:
+            raise ValueError(event_id)
+        return sequence if epoch == self.epoch else None
+
+    def head(self):
+        """Identifiant du dernier événement publié dans le processus"""
+        with self._lock:
+            return self.event_id(self._sequence)
+
+    def since(self, pharmacy_id, event_id=None):
+        """
+        Événements de la pharmacie après ``event_id`` : ``(événements,
+        dernier identifiant, reset)``. Chaque événement porte son ``id``.
+        Sans identifiant, seule la position courante est retournée ;
+        ``reset`` indique que des événements ont pu être manqués.
+        """
+        sequence = None
+        if event_id:
+            try:
+                sequence = self.parse_id(event_id)
+            except ValueError:
+                sequence = None
+        with self._lock:
+            head = self._sequence
+            if sequence is None or sequence > head or sequence < self._dropped.get(pharmacy_id, 0):
+                return [], self.event_id(head), bool(event_id)
+            events = [
+                dict(event, id=self.event_id(position))
+                for position, event in self._events.get(pharmacy_id, ())
+                if position > sequence
+            ]
+        return events, events[-1]['id'] if events else event_id, False
+
+    def clear(self):
+        """Vide l'historique (les abonnés sont conservés)"""
+        with self._lock:
+            self._events.clear()
+            self._dropped.clear()
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Courtier inter-processus fondé sur ``LISTEN``/``NOTIFY`` de PostgreSQL.
+
+    La publication passe par la transaction courante ; l'écoute démarre au
+    premier abonnement, sur une connexion dédiée, et se rétablit seule
+    après une coupure (les événements émis pendant la coupure sont perdus :
+    les clients reçoivent ``reset`` au besoin).
+    """
+
+    channel = 'reservation_events'
+
+    def __init__(self, history=None):
+        super().__init__(history)
+        self._listener = None
+
+    def publish(self, pharmacy_id, event):
+        payload = json.dumps({'pharmacy': pharmacy_id, 'event': event})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def subscribe(self, pharmacy_id):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='reservation-events', daemon=True)
+                self._listener.start()
+        return super().subscribe(pharmacy_id)
+
+    def _listen(self):
+        wrapper = connections['default']
+        while True:
+            try:
+                listener = wrapper.get_new_connection(wrapper.get_connection_params())
+                listener.autocommit = True
+                with listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                try:
+                    while True:
+                        if select.select([listener], [], [], 30) == ([], [], []):
+                            continue
+                        listener.poll()
+                        while listener.notifies:
+                            notify = listener.notifies.pop(0)
+                            message = json.loads(notify.payload)
+                            self.deliver(message['pharmacy'], message['event'])
+                finally:
+                    listener.close()
+            except Exception:
+                logger.exception("Écoute des événements de réservation interrompue, reprise dans 5 s")
+                time.sleep(5)
+
+
+broker = import_string(getattr(settings, 'RESERVATION_EVENT_BROKER', 'reservations.events.LocalBroker'))()
+
+
+def publish_reservation(reservation, previous=None, at=None):
+    """Publie la création ou le changement de statut d'une réservation"""
+    broker.publish(reservation.pharmacy_id, reservation_event(reservation, previous, at))
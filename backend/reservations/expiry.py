@@ -0,0 +1,89 @@
+"""
+Expiration des réservations non récupérées à temps.
+
+Les vues de lecture ne modifient plus les réservations : la commande
+``expire_reservations`` (lancée périodiquement ou en continu avec
+``--loop``) appelle ``expire_due``, qui traite les réservations actives
+dont ``expires_at`` est dépassé par lots de
+``RESERVATION_EXPIRY_BATCH_SIZE``. Pour chaque lot, dans une transaction :
+
+1. les réservations sont lues et verrouillées en une requête (index
+   partiel ``reservation_active_expiry``) ; avec PostgreSQL, les lignes
+   déjà verrouillées par une autre instance sont ignorées
+   (``skip_locked``), plusieurs balayeurs peuvent donc tourner ;
+2. les articles dont le stock a été décrémenté sont lus et verrouillés ;
+3. les stocks sont restaurés en une requête (``return_reserved_stock``) ;
+4. les articles et les réservations sont mis à jour en une requête
+   chacun, puis les compteurs de chaque pharmacie concernée ; un
+   événement ``status`` est publié par réservation (voir ``events.py``).
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from stocks.quantities import return_reserved_stock
+
+from .events import publish_reservation
+from .models import Reservation, ReservationCounter, ReservationItem
+
+
+def _expire_batch(now, batch_size):
+    """Expire un lot ; retourne les identifiants des réservations expirées"""
+    with transaction.atomic():
+        due = list(
+            Reservation.objects.select_for_update(skip_locked=True)
+            .filter(status__in=Reservation.ACTIVE_STATUSES, expires_at__lt=now)
+            .order_by('expires_at', 'id')
+            .values_list('id', 'pharmacy_id', 'status', 'reservation_number')[:batch_size]
+        )
+        if not due:
+            return []
+        ids = [reservation_id for reservation_id, _, _, _ in due]
+
+        items = list(
+            ReservationItem.objects.select_for_update()
+            .filter(reservation_id__in=ids, stock__isnull=False, stock_decremented=True)
+            .order_by('reservation_id', 'id')
+            .values_list('id', 'stock_id', 'quantity', 'reservation_id')
+        )
+        if items:
+            return_reserved_stock(
+                [(stock_id, quantity, reservation_id) for _, stock_id, quantity, reservation_id in items]
+            )
+            ReservationItem.objects.filter(pk__in=[item[0] for item in items]).update(stock_decremented=False)
+
+        Reservation.objects.filter(pk__in=ids).update(status='expired', updated_at=now)
+
+        # Compteurs des pharmacies concernées (une requête par pharmacie)
+        # et événements du flux en direct
+        changes = defaultdict(Counter)
+        for reservation_id, pharmacy_id, previous, number in due:
+            changes[pharmacy_id][previous] -= 1
+            changes[pharmacy_id]['expired'] += 1
+            publish_reservation(
+                Reservation(id=reservation_id, pharmacy_id=pharmacy_id, reservation_number=number, status='expired'),
+                previous, now
+            )
+        for pharmacy_id, counts in changes.items():
+            ReservationCounter.adjust(pharmacy_id, counts)
+    return ids
+
+
+def expire_due(now=None, batch_size=None, max_batches=None):
+    """
+    Expire les réservations actives dont ``expires_at`` est antérieur à
+    ``now`` et retourne leur nombre. S'arrête après ``max_batches`` lots
+    si précisé.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.RESERVATION_EXPIRY_BATCH_SIZE
+    expired = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = _expire_batch(now, batch_size)
+        expired += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+    return expired
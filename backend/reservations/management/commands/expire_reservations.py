@@ -0,0 +1,45 @@
+"""
+Management command expiring reservations past their expires_at date and
+restoring their stock.
+
+Run it periodically (cron) or as a long-running worker with --loop.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from reservations.expiry import expire_due
+
+
+class Command(BaseCommand):
+    help = 'Expire active reservations past their expiry date, in batches, and restore their stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Reservations expired per transaction (default: RESERVATION_EXPIRY_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running and sweep every --interval seconds'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help='Seconds between sweeps with --loop (default: RESERVATION_EXPIRY_INTERVAL)'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.RESERVATION_EXPIRY_INTERVAL
+        while True:
+            started = time.perf_counter()
+            expired = expire_due(batch_size=options['batch_size'])
+            elapsed = (time.perf_counter() - started) * 1000
+            if expired or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'{expired} reservations expired in {elapsed:.1f} ms'))
+            if not options['loop']:
+                return
+            time.sleep(interval)
+            # The database may have dropped the idle connection between sweeps
+            close_old_connections()
@@ -0,0 +1,29 @@
+"""
+Management command recomputing the per-pharmacy reservation counters
+(ReservationCounter) from the reservations table.
+
+Counters are maintained incrementally; run this after bulk edits made
+outside the ORM (raw SQL, restored dumps) or to check for drift.
+"""
+from django.core.management.base import BaseCommand
+
+from pharmacies.models import Pharmacy
+from reservations.models import ReservationCounter
+
+
+class Command(BaseCommand):
+    help = 'Recompute the reservation counters of every pharmacy'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pharmacy', type=int, action='append', dest='pharmacies',
+            help='Only rebuild this pharmacy (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        pharmacy_ids = options['pharmacies'] or Pharmacy.objects.order_by('id').values_list('id', flat=True)
+        rebuilt = 0
+        for pharmacy_id in pharmacy_ids:
+            ReservationCounter.rebuild(pharmacy_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'{rebuilt} reservation counters rebuilt'))
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reservations", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                condition=models.Q(("status__in", ["pending", "confirmed", "ready"])),
+                fields=["expires_at"],
+                name="reservation_active_expiry",
+            ),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pharmacies", "0004_backfill_pharmacy_location"),
+        ("reservations", "0002_reservation_active_expiry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(fields=["pharmacy", "-created_at", "-id"], name="reservation_pharmacy_recent"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pharmacies", "0004_backfill_pharmacy_location"),
+        ("reservations", "0003_reservation_pharmacy_recent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReservationCounter",
+            fields=[
+                (
+                    "pharmacy",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="reservation_counter",
+                        serialize=False,
+                        to="pharmacies.pharmacy",
+                    ),
+                ),
+                ("pending", models.IntegerField(default=0)),
+                ("confirmed", models.IntegerField(default=0)),
+                ("ready", models.IntegerField(default=0)),
+                ("collected", models.IntegerField(default=0)),
+                ("cancelled", models.IntegerField(default=0)),
+                ("expired", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Compteur de réservations",
+                "verbose_name_plural": "Compteurs de réservations",
+            },
+        ),
+    ]
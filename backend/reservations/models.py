@@ -2,13 +2,61 @@
 """
 Modèles pour le système de réservation de médicaments (User Story 6)
 """
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.utils import timezone
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 import uuid
 
+from stocks.quantities import return_stock, take_stock
+
+from .events import publish_reservation
+
+
+class ReservationQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annote le nombre d'articles et le prix total calculés par la base,
+        lus par ``total_items`` et ``total_price`` sans requête par
+        réservation.
+        """
+        return self.annotate(
+            total_items_sum=Coalesce(Sum('items__quantity'), 0),
+            total_price_sum=Coalesce(
+                Sum(F('items__quantity') * F('items__unit_price'),
+                    output_field=DecimalField(max_digits=12, decimal_places=2)),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+    def picked_up_on(self, day):
+        """
+        Réservations à récupérer le jour ``day`` (fuseau courant), filtrées
+        par intervalle sur ``pickup_date`` : contrairement à
+        ``pickup_date__date``, le filtre peut utiliser un index.
+        """
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        return self.filter(pickup_date__gte=start, pickup_date__lt=start + timedelta(days=1))
+
+    def status_counts(self, today=None):
+        """
+        Nombre de réservations par statut, total, actives et à récupérer le
+        jour ``today`` (aujourd'hui par défaut), en une requête.
+        """
+        today = today or timezone.now().date()
+        counts = self.aggregate(
+            total=Count('id'),
+            today=Count('id', filter=Q(pickup_date__date=today)),
+            **{code: Count('id', filter=Q(status=code)) for code, _ in Reservation.STATUS_CHOICES}
+        )
+        counts['active'] = sum(counts[code] for code in Reservation.ACTIVE_STATUSES)
+        return counts
+
 
 class Reservation(models.Model):
     """
@@ -26,6 +74,9 @@ class Reservation(models.Model):
         ('expired', 'Expirée'),               # Réservation expirée (non récupérée à temps)
     ]
     
+    # Statuts d'une réservation en cours (stock décompté)
+    ACTIVE_STATUSES = ('pending', 'confirmed', 'ready')
+    
     # Identifiant unique lisible
     reservation_number = models.CharField(
         max_length=20,
@@ -146,6 +197,8 @@ class Reservation(models.Model):
         help_text="Date d'expiration de la réservation si non récupérée"
     )
     
+    objects = ReservationQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Réservation'
         verbose_name_plural = 'Réservations'
@@ -156,6 +209,16 @@ class Reservation(models.Model):
             models.Index(fields=['reservation_number']),
             models.Index(fields=['-created_at']),
             models.Index(fields=['pickup_date']),
+            # Pagination par clé de la liste d'une pharmacie
+            models.Index(fields=['pharmacy', '-created_at', '-id'], name='reservation_pharmacy_recent'),
+            # Réservations du jour d'une pharmacie (statistiques)
+            models.Index(fields=['pharmacy', 'pickup_date'], name='reservation_pharmacy_pickup'),
+            # Réservations actives à expirer (reservations/expiry.py)
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(status__in=['pending', 'confirmed', 'ready']),
+                name='reservation_active_expiry',
+            ),
         ]
     
     def __str__(self):
@@ -170,7 +233,26 @@ class Reservation(models.Model):
         if not self.expires_at and self.pickup_date:
             self.expires_at = self.pickup_date + timezone.timedelta(hours=24)
         
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        writes_status = update_fields is None or 'status' in update_fields
+        with transaction.atomic():
+            previous = None
+            if not adding and writes_status:
+                # Statut en base relu sous verrou : une transition concurrente
+                # (balayeur d'expiration, autre requête) depuis la lecture de
+                # cette instance ne fausse pas les compteurs
+                previous = Reservation.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'status', flat=True
+                ).first()
+            super().save(*args, **kwargs)
+            # Compteurs de la pharmacie (statistiques) et flux en direct
+            if adding:
+                ReservationCounter.adjust(self.pharmacy_id, {self.status: 1})
+                publish_reservation(self)
+            elif previous is not None and previous != self.status:
+                ReservationCounter.adjust(self.pharmacy_id, {previous: -1, self.status: 1})
+                publish_reservation(self, previous)
     
     def _generate_reservation_number(self):
         """Génère un numéro de réservation unique"""
@@ -180,12 +262,16 @@ class Reservation(models.Model):
     
     @property
     def total_items(self):
-        """Nombre total d'articles dans la réservation"""
+        """Nombre total d'articles dans la réservation (voir ``with_totals``)"""
+        if hasattr(self, 'total_items_sum'):
+            return self.total_items_sum
         return sum(item.quantity for item in self.items.all())
     
     @property
     def total_price(self):
-        """Prix total de la réservation"""
+        """Prix total de la réservation (voir ``with_totals``)"""
+        if hasattr(self, 'total_price_sum'):
+            return self.total_price_sum
         return sum(item.subtotal for item in self.items.all())
     
     @property
@@ -234,28 +320,69 @@ class Reservation(models.Model):
         if not self.is_cancellable:
             raise ValueError("Cette réservation ne peut plus être annulée")
         
-        # Restaurer les stocks
-        for item in self.items.all():
-            item.restore_stock()
-        
-        self.status = 'cancelled'
-        self.cancelled_at = timezone.now()
-        self.cancelled_by = user
-        if reason:
-            self.pharmacy_notes = reason
-        self.save()
+        with transaction.atomic():
+            # Restaurer les stocks
+            self.restore_stock()
+            
+            self.status = 'cancelled'
+            self.cancelled_at = timezone.now()
+            self.cancelled_by = user
+            if reason:
+                self.pharmacy_notes = reason
+            self.save()
     
     def check_and_update_expiration(self):
         """Vérifie et met à jour le statut si expiré"""
         if self.is_expired:
-            # Restaurer les stocks avant expiration
-            for item in self.items.all():
-                item.restore_stock()
-            
-            self.status = 'expired'
-            self.save()
+            with transaction.atomic():
+                # Restaurer les stocks avant expiration
+                self.restore_stock()
+                
+                self.status = 'expired'
+                self.save()
             return True
         return False
+    
+    def decrement_stock(self, items=None):
+        """
+        Décrémente en une requête conditionnelle les stocks de tous les
+        articles (ou de ``items``) non encore décrémentés. Lève
+        ``InsufficientStock`` (``ValueError``) sans rien décrémenter si
+        l'un des stocks est insuffisant.
+        """
+        queryset = self.items.all() if items is None else ReservationItem.objects.filter(
+            pk__in=[item.pk for item in items]
+        )
+        with transaction.atomic():
+            # Verrouille les articles : deux appels concurrents ne
+            # décrémentent pas deux fois le même article
+            pending = list(
+                queryset.select_for_update().filter(stock__isnull=False, stock_decremented=False)
+            )
+            if not pending:
+                return []
+            take_stock([(item.stock_id, item.quantity) for item in pending], reservation=self)
+            ReservationItem.objects.filter(pk__in=[item.pk for item in pending]).update(stock_decremented=True)
+        for item in pending:
+            item.stock_decremented = True
+        return pending
+    
+    def restore_stock(self, items=None):
+        """Restaure en une requête les stocks décrémentés (voir ``decrement_stock``)"""
+        queryset = self.items.all() if items is None else ReservationItem.objects.filter(
+            pk__in=[item.pk for item in items]
+        )
+        with transaction.atomic():
+            decremented = list(
+                queryset.select_for_update().filter(stock__isnull=False, stock_decremented=True)
+            )
+            if not decremented:
+                return []
+            return_stock([(item.stock_id, item.quantity) for item in decremented], reservation=self)
+            ReservationItem.objects.filter(pk__in=[item.pk for item in decremented]).update(stock_decremented=False)
+        for item in decremented:
+            item.stock_decremented = False
+        return decremented
 
 
 class ReservationItem(models.Model):
@@ -329,30 +456,25 @@ class ReservationItem(models.Model):
     
     def decrement_stock(self):
         """Décrémente le stock lors de la création de la réservation"""
-        if self.stock and not self.stock_decremented:
-            if self.stock.quantity >= self.quantity:
-                self.stock.quantity -= self.quantity
-                self.stock.save()
-                self.stock_decremented = True
-                self.save()
-                return True
-            else:
-                raise ValueError(
-                    f"Stock insuffisant pour {self.medicine.name}. "
-                    f"Disponible: {self.stock.quantity}, Demandé: {self.quantity}"
-                )
+        if self.stock_id and not self.stock_decremented:
+            return self._sync(self.reservation.decrement_stock([self]), True)
         return False
     
     def restore_stock(self):
         """Restaure le stock lors d'une annulation"""
-        if self.stock and self.stock_decremented:
-            self.stock.quantity += self.quantity
-            self.stock.save()
-            self.stock_decremented = False
-            self.save()
-            return True
+        if self.stock_id and self.stock_decremented:
+            return self._sync(self.reservation.restore_stock([self]), False)
         return False
     
+    def _sync(self, changed, decremented):
+        # Les quantités ont été modifiées en base : recharger le stock en cache
+        if not changed:
+            return False
+        self.stock_decremented = decremented
+        if ReservationItem.stock.is_cached(self):
+            self.stock.refresh_from_db(fields=['quantity', 'last_updated'])
+        return True
+    
     def save(self, *args, **kwargs):
         """Validation et sauvegarde"""
         # Si nouveau et pas de prix, prendre le prix du stock
@@ -360,3 +482,97 @@ class ReservationItem(models.Model):
             self.unit_price = self.stock.price
         
         super().save(*args, **kwargs)
+
+
+class ReservationCounter(models.Model):
+    """
+    Nombre de réservations d'une pharmacie par statut, tenu à jour par les
+    transitions (``Reservation.save``, balayeur d'expiration, suppression)
+    pour que les tableaux de bord lisent leurs statistiques en une ligne.
+
+    Une pharmacie sans ligne est comptée depuis ``Reservation`` à la
+    première transition ou lecture ; la commande
+    ``rebuild_reservation_counters`` recalcule toutes les lignes.
+    """
+    
+    pharmacy = models.OneToOneField(
+        'pharmacies.Pharmacy',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='reservation_counter'
+    )
+    pending = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    ready = models.IntegerField(default=0)
+    collected = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Compteur de réservations'
+        verbose_name_plural = 'Compteurs de réservations'
+    
+    def __str__(self):
+        return f"Réservations @ {self.pharmacy_id}"
+    
+    def as_dict(self):
+        """Compteurs par statut, total et réservations actives"""
+        counts = {code: getattr(self, code) for code, _ in Reservation.STATUS_CHOICES}
+        counts['total'] = sum(counts.values())
+        counts['active'] = sum(counts[code] for code in Reservation.ACTIVE_STATUSES)
+        return counts
+    
+    @classmethod
+    def adjust(cls, pharmacy_id, changes):
+        """
+        Applique les variations ``{statut: nombre}`` aux compteurs de la
+        pharmacie en une requête (la ligne est créée au besoin).
+        """
+        changes = {code: delta for code, delta in changes.items() if delta}
+        if not changes:
+            return
+        if cls._apply(pharmacy_id, changes):
+            return
+        # Variations déjà écrites en base : le recomptage les inclut
+        _, stored = cls._store_counts(pharmacy_id)
+        if not stored:
+            # Ligne créée entre-temps par une transition concurrente, dont le
+            # recomptage ne voyait pas nos écritures non validées
+            cls._apply(pharmacy_id, changes)
+    
+    @classmethod
+    def _apply(cls, pharmacy_id, changes):
+        """Ajoute les variations à la ligne existante ; ``False`` si elle n'existe pas"""
+        return bool(cls.objects.filter(pk=pharmacy_id).update(
+            updated_at=timezone.now(), **{code: F(code) + delta for code, delta in changes.items()}
+        ))
+    
+    @classmethod
+    def _store_counts(cls, pharmacy_id):
+        """
+        Enregistre le recomptage des réservations de la pharmacie.
+        
+        Retourne ``(compteur, False)`` si une transition concurrente a créé
+        la ligne entre-temps : le recomptage n'est alors pas enregistré.
+        """
+        counts = Reservation.objects.filter(pharmacy_id=pharmacy_id).status_counts()
+        defaults = {code: counts[code] for code, _ in Reservation.STATUS_CHOICES}
+        try:
+            with transaction.atomic():
+                counter, _ = cls.objects.update_or_create(pharmacy_id=pharmacy_id, defaults=defaults)
+        except IntegrityError:
+            return cls.objects.get(pharmacy_id=pharmacy_id), False
+        return counter, True
+    
+    @classmethod
+    def rebuild(cls, pharmacy_id):
+        """Recompte les réservations de la pharmacie et enregistre ses compteurs"""
+        counter, _ = cls._store_counts(pharmacy_id)
+        return counter
+    
+    @classmethod
+    def for_pharmacy(cls, pharmacy_id):
+        """Compteurs de la pharmacie, calculés à la première lecture"""
+        counter = cls.objects.filter(pk=pharmacy_id).first()
+        return counter if counter is not None else cls.rebuild(pharmacy_id)
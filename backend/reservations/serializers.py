@@ -2,12 +2,16 @@
 """
 Serializers pour les réservations de médicaments (User Story 6)
 """
+from collections import Counter
+
 from rest_framework import serializers
+from django.db import transaction
 from django.utils import timezone
 from .models import Reservation, ReservationItem
 from medicines.models import Medicine
 from pharmacies.models import Pharmacy
 from stocks.models import Stock
+from stocks.quantities import InsufficientStock, take_stock
 
 
 class ReservationItemSerializer(serializers.ModelSerializer):
@@ -99,75 +103,97 @@ class ReservationCreateSerializer(serializers.Serializer):
         return value
     
     def validate_items(self, value):
-        """Vérifie que tous les items sont valides"""
+        """
+        Vérifie que tous les items sont valides : médicaments et stocks sont
+        lus en une requête chacun, quel que soit le nombre d'articles.
+        """
         if not value:
             raise serializers.ValidationError(
                 "La réservation doit contenir au moins un article"
             )
         
+        medicines = Medicine.objects.only('id', 'name').in_bulk({item['medicine_id'] for item in value})
+        stocks = Stock.objects.only('id', 'quantity').in_bulk(
+            {item['stock_id'] for item in value if 'stock_id' in item}
+        )
+        
+        # Quantités demandées par stock (un stock peut figurer plusieurs fois)
+        requested = Counter()
         for item in value:
             # Vérifier que le médicament existe
-            try:
-                medicine = Medicine.objects.get(pk=item['medicine_id'])
-            except Medicine.DoesNotExist:
+            medicine = medicines.get(item['medicine_id'])
+            if medicine is None:
                 raise serializers.ValidationError(
                     f"Médicament avec ID {item['medicine_id']} introuvable"
                 )
             
             # Si stock_id fourni, vérifier le stock
             if 'stock_id' in item:
-                try:
-                    stock = Stock.objects.get(pk=item['stock_id'])
-                    if stock.quantity < item['quantity']:
-                        raise serializers.ValidationError(
-                            f"Stock insuffisant pour {medicine.name}. "
-                            f"Disponible: {stock.quantity}, Demandé: {item['quantity']}"
-                        )
-                except Stock.DoesNotExist:
+                stock = stocks.get(item['stock_id'])
+                if stock is None:
                     raise serializers.ValidationError(
                         f"Stock avec ID {item['stock_id']} introuvable"
                     )
+                requested[stock.pk] += item['quantity']
+                if stock.quantity < requested[stock.pk]:
+                    raise serializers.ValidationError(
+                        f"Stock insuffisant pour {medicine.name}. "
+                        f"Disponible: {stock.quantity}, Demandé: {requested[stock.pk]}"
+                    )
         
         return value
     
     def create(self, validated_data):
-        """Crée la réservation avec ses articles"""
+        """
+        Crée la réservation avec ses articles, en une transaction et un
+        nombre de requêtes indépendant du nombre d'articles : lecture
+        verrouillée des stocks (prix), création de la réservation,
+        décrémentation conditionnelle de tous les stocks puis création des
+        articles en une requête.
+        """
         user = self.context['request'].user
         pharmacy_id = validated_data['pharmacy_id']
         items_data = validated_data['items']
         
-        # Créer la réservation
-        reservation = Reservation.objects.create(
-            user=user,
-            pharmacy_id=pharmacy_id,
-            contact_name=validated_data['contact_name'],
-            contact_phone=validated_data['contact_phone'],
-            contact_email=validated_data.get('contact_email', ''),
-            pickup_date=validated_data['pickup_date'],
-            notes=validated_data.get('notes', '')
-        )
-        
-        # Créer les items et décrémenter les stocks
-        for item_data in items_data:
-            medicine = Medicine.objects.get(pk=item_data['medicine_id'])
-            stock = None
-            unit_price = 0
-            
-            if 'stock_id' in item_data:
-                stock = Stock.objects.get(pk=item_data['stock_id'])
-                unit_price = stock.price
+        with transaction.atomic():
+            stocks = Stock.objects.select_for_update().only('id', 'price').in_bulk(
+                {item['stock_id'] for item in items_data if 'stock_id' in item}
+            )
             
-            # Créer l'item
-            reservation_item = ReservationItem.objects.create(
-                reservation=reservation,
-                medicine=medicine,
-                stock=stock,
-                quantity=item_data['quantity'],
-                unit_price=unit_price
+            # Créer la réservation
+            reservation = Reservation.objects.create(
+                user=user,
+                pharmacy_id=pharmacy_id,
+                contact_name=validated_data['contact_name'],
+                contact_phone=validated_data['contact_phone'],
+                contact_email=validated_data.get('contact_email', ''),
+                pickup_date=validated_data['pickup_date'],
+                notes=validated_data.get('notes', '')
             )
             
-            # Décrémenter le stock
-            reservation_item.decrement_stock()
+            # Décrémenter tous les stocks en une requête conditionnelle : la
+            # vérification de validate_items peut être dépassée par une
+            # réservation concurrente, c'est ici que la quantité fait foi
+            try:
+                take_stock(
+                    [(item['stock_id'], item['quantity']) for item in items_data if 'stock_id' in item],
+                    reservation=reservation,
+                )
+            except InsufficientStock as error:
+                raise serializers.ValidationError({'items': [str(error)]})
+            
+            # Créer les items, déjà décomptés
+            ReservationItem.objects.bulk_create([
+                ReservationItem(
+                    reservation=reservation,
+                    medicine_id=item['medicine_id'],
+                    stock_id=item.get('stock_id'),
+                    quantity=item['quantity'],
+                    unit_price=stocks[item['stock_id']].price if 'stock_id' in item else 0,
+                    stock_decremented='stock_id' in item,
+                )
+                for item in items_data
+            ])
         
         return reservation
 
@@ -0,0 +1,17 @@
+"""
+Signaux maintenant à jour les compteurs de réservations des pharmacies.
+"""
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from pharmacies.models import Pharmacy
+
+from .models import Reservation, ReservationCounter
+
+
+@receiver(post_delete, sender=Reservation)
+def count_deleted_reservation(sender, instance, origin=None, **kwargs):
+    # Pharmacie supprimée : ses compteurs disparaissent avec elle
+    if isinstance(origin, Pharmacy) or getattr(origin, 'model', None) is Pharmacy:
+        return
+    ReservationCounter.adjust(instance.pharmacy_id, {instance.status: -1})
@@ -0,0 +1,113 @@
+"""
+Flux en direct des réservations d'une pharmacie :
+``GET /api/reservations/events/``.
+
+Vue asynchrone : sous un worker ASGI, une connexion en attente ne
+mobilise aucun thread, une connexion remplace donc des centaines de
+relectures de ``/api/reservations/pharmacy/``. Deux modes (le flux SSE
+n'est envoyé au fil de l'eau que sous ASGI ; sous WSGI, utiliser le
+long-poll) :
+
+- Server-Sent Events (``Accept: text/event-stream``) : un message par
+  événement (``id``, ``event``, ``data`` JSON), un commentaire toutes les
+  ``RESERVATION_EVENT_HEARTBEAT`` secondes, fermeture après
+  ``RESERVATION_EVENT_STREAM_TIMEOUT`` secondes ; le client se reconnecte
+  avec l'en-tête ``Last-Event-ID`` ;
+- long-poll (autres requêtes) : ``?since=<id>&timeout=<secondes>`` répond
+  dès qu'un événement est disponible, ou vide à l'expiration du délai
+  (au plus ``RESERVATION_EVENT_POLL_TIMEOUT``). Sans ``since``, la réponse
+  est immédiate et donne la position de départ.
+
+Un événement ``reset`` (ou ``"reset": true``) signale que des événements
+ont pu être manqués : le client recharge alors la liste.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .events import broker
+
+
+def _authenticate(request):
+    """Utilisateur authentifié par les mécanismes de l'API (JWT, session), ou ``None``"""
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def _format(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+async def _stream(pharmacy_id, last_id):
+    subscription = broker.subscribe(pharmacy_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.RESERVATION_EVENT_STREAM_TIMEOUT
+    try:
+        yield f'retry: {settings.RESERVATION_EVENT_RETRY}\n\n'
+        while True:
+            events, last_id, reset = broker.since(pharmacy_id, last_id)
+            if reset:
+                yield _format(last_id, 'reset', {})
+            for event in events:
+                yield _format(event.pop('id'), event['type'], event)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            if not await subscription.wait(min(remaining, settings.RESERVATION_EVENT_HEARTBEAT)):
+                yield ': ping\n\n'
+    finally:
+        subscription.close()
+
+
+async def reservation_events(request):
+    """Événements de réservation de la pharmacie de l'utilisateur connecté"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentification requise'}, status=401)
+    if not (user.user_type == 'pharmacy' and user.pharmacy_id):
+        return JsonResponse({'error': 'Vous devez être connecté en tant que pharmacie'}, status=403)
+    pharmacy_id = user.pharmacy_id
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        last_id = request.headers.get('Last-Event-ID') or request.GET.get('since')
+        response = StreamingHttpResponse(_stream(pharmacy_id, last_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Pas de mise en tampon par nginx
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    try:
+        timeout = float(request.GET.get('timeout', settings.RESERVATION_EVENT_POLL_TIMEOUT))
+        if not timeout >= 0:
+            raise ValueError(timeout)
+    except ValueError:
+        return JsonResponse({'error': 'Paramètre timeout invalide'}, status=400)
+    timeout = min(timeout, settings.RESERVATION_EVENT_POLL_TIMEOUT)
+
+    since = request.GET.get('since')
+    loop = asyncio.get_running_loop()
+    subscription = broker.subscribe(pharmacy_id)
+    try:
+        while True:
+            events, last_id, reset = broker.since(pharmacy_id, since)
+            if events or reset or not since or timeout <= 0:
+                break
+            started = loop.time()
+            if not await subscription.wait(timeout):
+                break
+            timeout -= loop.time() - started
+    finally:
+        subscription.close()
+    return JsonResponse({'events': events, 'last_id': last_id or broker.head(), 'reset': reset})
@@ -1,3 +1,591 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from medicines.models import Medicine
+from pharmacies.models import Pharmacy
+from stocks.models import Stock, StockMovement
+from stocks.quantities import InsufficientStock
+from users.models import User
+
+from .events import LocalBroker, broker
+from .expiry import expire_due
+from .models import Reservation, ReservationCounter, ReservationItem
+
+
+class ReservationStockTestCase(APITestCase):
+    """Tests pour la décrémentation groupée des stocks d'une réservation"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie du Lac', address='Yaoundé', phone='600000020',
+            latitude=3.86, longitude=11.51
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.paracetamol = Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        self.quinine = Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        self.stock_a = Stock.objects.create(
+            pharmacy=self.pharmacy, medicine=self.paracetamol, quantity=5, price=Decimal(500)
+        )
+        self.stock_b = Stock.objects.create(
+            pharmacy=self.pharmacy, medicine=self.quinine, quantity=2, price=Decimal(900)
+        )
+        self.client.force_authenticate(self.customer)
+
+    def payload(self, quantity_b):
+        return {
+            'pharmacy_id': self.pharmacy.id,
+            'items': [
+                {'medicine_id': self.paracetamol.id, 'stock_id': self.stock_a.id,
+                 'pharmacy_id': self.pharmacy.id, 'quantity': 3},
+                {'medicine_id': self.quinine.id, 'stock_id': self.stock_b.id,
+                 'pharmacy_id': self.pharmacy.id, 'quantity': quantity_b},
+            ],
+            'contact_name': 'Client',
+            'contact_phone': '600000000',
+            'pickup_date': (timezone.now() + timedelta(days=1)).isoformat(),
+        }
+
+    def quantities(self):
+        return list(Stock.objects.order_by('id').values_list('quantity', flat=True))
+
+    def test_all_items_are_decremented_together(self):
+        response = self.client.post('/api/reservations/', self.payload(2), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantities(), [2, 0])
+        self.assertFalse(ReservationItem.objects.filter(stock_decremented=False).exists())
+
+        reservation = Reservation.objects.get()
+        reservation.cancel()
+        self.assertEqual(reservation.restore_stock(), [])
+        self.assertEqual(self.quantities(), [5, 2])
+        self.assertEqual(StockMovement.objects.filter(reservation=reservation).count(), 4)
+
+    def test_shortage_rolls_back_the_whole_reservation(self):
+        # Un autre client prend le dernier article entre validation et écriture
+        reservation = Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Autre', contact_phone='600000001',
+            pickup_date=timezone.now() + timedelta(days=1)
+        )
+        item = ReservationItem.objects.create(
+            reservation=reservation, medicine=self.quinine, stock=self.stock_b, quantity=2, unit_price=Decimal(900)
+        )
+        self.assertTrue(item.decrement_stock())
+        self.assertEqual(item.stock.quantity, 0)
+
+        other = Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Client', contact_phone='600000000',
+            pickup_date=timezone.now() + timedelta(days=1)
+        )
+        ReservationItem.objects.create(
+            reservation=other, medicine=self.quinine, stock=self.stock_b, quantity=1, unit_price=Decimal(900)
+        )
+        with self.assertRaises(InsufficientStock) as raised:
+            other.decrement_stock()
+        self.assertEqual(raised.exception.stock_ids, [self.stock_b.id])
+        self.assertEqual(self.quantities(), [5, 0])
+
+        response = self.client.post('/api/reservations/', self.payload(1), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(self.quantities(), [5, 0])
+
+
+
+    def test_query_count_does_not_depend_on_item_count(self):
+        medicines = Medicine.objects.bulk_create(
+            Medicine(name=f'Produit {i}', dosage='10mg', form='comprimé') for i in range(10)
+        )
+        stocks = Stock.objects.bulk_create(
+            Stock(pharmacy=self.pharmacy, medicine=medicine, quantity=6, price=Decimal(100))
+            for medicine in medicines
+        )
+
+        def post(count):
+            payload = self.payload(1)
+            payload['items'] = [
+                {'medicine_id': stock.medicine_id, 'stock_id': stock.id, 'pharmacy_id': self.pharmacy.id,
+                 'quantity': 2}
+                for stock in stocks[:count]
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/reservations/', payload, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), count)
+            return len(queries)
+
+        # La première réservation crée la ligne des compteurs de la pharmacie
+        post(1)
+        self.assertEqual(post(1), post(10))
+        self.assertEqual(
+            list(Stock.objects.filter(pk__in=[stock.pk for stock in stocks]).order_by('id').values_list(
+                'quantity', flat=True
+            )),
+            [0] + [4] * 9,
+        )
+
+    def test_repeated_stock_is_checked_as_a_whole(self):
+        payload = self.payload(2)
+        payload['items'][0]['quantity'] = 3
+        payload['items'].append(dict(payload['items'][0]))
+        response = self.client.post('/api/reservations/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), [5, 2])
+
+class ReservationExpiryTestCase(APITestCase):
+    """Tests pour le balayeur d'expiration des réservations"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie du Marché', address='Yaoundé', phone='600000021',
+            latitude=3.87, longitude=11.52
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.medicine = Medicine.objects.create(name='Amoxicilline', dosage='500mg', form='gélule')
+        self.other = Medicine.objects.create(name='Ibuprofène', dosage='400mg', form='comprimé')
+        self.stock = Stock.objects.create(
+            pharmacy=self.pharmacy, medicine=self.medicine, quantity=10, price=Decimal(1500)
+        )
+        self.other_stock = Stock.objects.create(
+            pharmacy=self.pharmacy, medicine=self.other, quantity=10, price=Decimal(800)
+        )
+        now = timezone.now()
+        self.due = [self.reserve(now - timedelta(hours=i + 1), [(self.stock, 2), (self.other_stock, 1)])
+                    for i in range(3)]
+        self.collected = self.reserve(now - timedelta(hours=1), [(self.stock, 1)], status='collected')
+        self.future = self.reserve(now + timedelta(hours=1), [(self.stock, 1)])
+        self.client.force_authenticate(self.customer)
+
+    def reserve(self, expires_at, lines, status='pending'):
+        reservation = Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Client', contact_phone='600000000',
+            pickup_date=expires_at - timedelta(hours=24), expires_at=expires_at, status=status
+        )
+        for stock, quantity in lines:
+            ReservationItem.objects.create(
+                reservation=reservation, medicine=stock.medicine, stock=stock, quantity=quantity,
+                unit_price=stock.price
+            )
+        reservation.decrement_stock()
+        return reservation
+
+    def statuses(self):
+        return dict(Reservation.objects.values_list('id', 'status'))
+
+    def test_reads_do_not_expire(self):
+        before = self.statuses()
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/reservations/{self.due[0].id}/').status_code, 200)
+        self.assertEqual(self.statuses(), before)
+
+    def test_sweeper_expires_in_batches_and_restores_stock(self):
+        out = StringIO()
+        call_command('expire_reservations', batch_size=2, stdout=out)
+        self.assertIn('3 reservations expired', out.getvalue())
+
+        statuses = self.statuses()
+        self.assertEqual([statuses[reservation.id] for reservation in self.due], ['expired'] * 3)
+        self.assertEqual(statuses[self.collected.id], 'collected')
+        self.assertEqual(statuses[self.future.id], 'pending')
+
+        # Seuls les articles de la réservation future et de la réservation
+        # récupérée restent décomptés
+        self.stock.refresh_from_db()
+        self.other_stock.refresh_from_db()
+        self.assertEqual((self.stock.quantity, self.other_stock.quantity), (8, 10))
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(reason='restore').values_list('reservation_id', 'delta')),
+            sorted((reservation.id, delta) for reservation in self.due for delta in (2, 1)),
+        )
+        self.assertFalse(ReservationItem.objects.filter(
+            reservation__status='expired', stock_decremented=True
+        ).exists())
+
+        # Un second passage ne trouve plus rien
+        out = StringIO()
+        call_command('expire_reservations', stdout=out)
+        self.assertIn('0 reservations expired', out.getvalue())
+
+
+
+class ReservationListingTestCase(APITestCase):
+    """Tests pour les totaux calculés par la base et la liste paginée d'une pharmacie"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Bastos', address='Yaoundé', phone='600000022',
+            latitude=3.89, longitude=11.51
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.medicines = [
+            Medicine.objects.create(name=f'Produit {i}', dosage='10mg', form='comprimé') for i in range(3)
+        ]
+
+    def reserve(self, count):
+        for _ in range(count):
+            reservation = Reservation.objects.create(
+                user=self.customer, pharmacy=self.pharmacy, contact_name='Client', contact_phone='600000000',
+                pickup_date=timezone.now() + timedelta(days=1)
+            )
+            ReservationItem.objects.bulk_create(
+                ReservationItem(reservation=reservation, medicine=medicine, quantity=i + 1,
+                                unit_price=Decimal('250.50'))
+                for i, medicine in enumerate(self.medicines)
+            )
+
+    def test_totals_are_annotated(self):
+        self.reserve(1)
+        Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Vide', contact_phone='600000000',
+            pickup_date=timezone.now() + timedelta(days=1)
+        )
+        self.client.force_authenticate(self.customer)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/reservations/')
+            return len(queries), response.data
+
+        few, data = count_queries()
+        self.assertEqual(sorted((row['total_items'], row['total_price']) for row in data), [
+            (0, '0.00'), (6, '1503.00'),
+        ])
+        self.reserve(5)
+        many, data = count_queries()
+        self.assertEqual(len(data), 7)
+        self.assertEqual(few, many)
+
+    def test_pharmacy_listing_is_keyset_paginated(self):
+        self.reserve(7)
+        self.client.force_authenticate(self.owner)
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            # Une seule requête par page (réservations et totaux)
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/reservations/pharmacy/', params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            self.assertTrue(all(row['total_items'] == 6 for row in response.data['results']))
+            cursor = response.data['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, list(Reservation.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+        self.assertEqual(self.client.get('/api/reservations/pharmacy/', {'cursor': 'x'}).status_code, 400)
+
+class ReservationCounterTestCase(APITestCase):
+    """Tests pour les compteurs de réservations et l'endpoint de statistiques"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Mvog-Mbi', address='Yaoundé', phone='600000023',
+            latitude=3.85, longitude=11.50
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+
+    def reserve(self, hours=24):
+        return Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Client', contact_phone='600000000',
+            pickup_date=timezone.now() + timedelta(hours=hours)
+        )
+
+    def counts(self):
+        return ReservationCounter.for_pharmacy(self.pharmacy.id).as_dict()
+
+    def expected(self):
+        counts = Reservation.objects.filter(pharmacy=self.pharmacy).status_counts()
+        del counts['today']
+        return counts
+
+    def test_transitions_keep_counters_exact(self):
+        reservations = [self.reserve() for _ in range(6)]
+        reservations[0].confirm()
+        reservations[1].mark_ready()
+        reservations[1].mark_collected()
+        reservations[2].cancel(reason='Test')
+        reservations[3].expires_at = timezone.now() - timedelta(hours=1)
+        reservations[3].save()
+        expire_due()
+        reservations[4].delete()
+        self.assertEqual(self.counts(), self.expected())
+        self.assertEqual(self.counts()['expired'], 1)
+        self.assertEqual(self.counts()['total'], 5)
+
+        # Un enregistrement sans changement de statut ne compte rien
+        reservations[0].notes = 'Sans changement'
+        reservations[0].save()
+        self.assertEqual(self.counts(), self.expected())
+
+        # Le recalcul retrouve les mêmes valeurs
+        call_command('rebuild_reservation_counters', stdout=StringIO())
+        self.assertEqual(self.counts(), self.expected())
+
+    def test_stale_instance_after_sweep(self):
+        """Une instance lue avant l'expiration par le balayeur ne fausse pas les compteurs"""
+        reservation = self.reserve()
+        stale = Reservation.objects.get(pk=reservation.pk)
+        Reservation.objects.filter(pk=reservation.pk).update(expires_at=timezone.now() - timedelta(hours=1))
+        expire_due()
+        self.assertEqual(self.counts()['expired'], 1)
+
+        stale.cancel(reason='Annulation tardive')
+        self.assertEqual(self.counts(), self.expected())
+        self.assertEqual((self.counts()['pending'], self.counts()['expired']), (0, 0))
+
+    def test_missing_counter_is_rebuilt(self):
+        self.reserve()
+        self.reserve().confirm()
+        ReservationCounter.objects.all().delete()
+        self.reserve()
+        self.assertEqual(self.counts(), self.expected())
+        self.assertEqual(self.counts()['pending'], 2)
+
+    def test_counter_row_created_concurrently(self):
+        """La variation n'est pas perdue si une transition concurrente crée la ligne la première"""
+        self.reserve()
+        reservation = self.reserve()
+        ReservationCounter.objects.all().delete()
+        Reservation.objects.filter(pk=reservation.pk).update(status='confirmed')
+
+        def concurrent_insert(**kwargs):
+            # Recomptage de l'autre transaction, qui ne voit pas la confirmation
+            ReservationCounter.objects.create(pharmacy=self.pharmacy, pending=2)
+            raise IntegrityError('duplicate key value violates unique constraint')
+
+        # Sans point de sauvegarde, la ligne de l'autre transaction reste visible
+        with mock.patch.object(ReservationCounter.objects, 'update_or_create', side_effect=concurrent_insert), \
+                mock.patch.object(transaction, 'atomic', lambda *args, **kwargs: nullcontext()):
+            ReservationCounter.adjust(self.pharmacy.id, {'pending': -1, 'confirmed': 1})
+        self.assertEqual(self.counts(), self.expected())
+        self.assertEqual((self.counts()['pending'], self.counts()['confirmed']), (1, 1))
+
+    def test_stats_endpoint(self):
+        for hours in (1, 48, 72):
+            self.reserve(hours)
+        self.reserve().cancel()
+        self.client.force_authenticate(self.owner)
+        # Ligne des compteurs et réservations du jour
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/reservations/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 4)
+        self.assertEqual(response.data['pending'], 3)
+        self.assertEqual(response.data['cancelled'], 1)
+        self.assertEqual(response.data['active'], 3)
+
+        self.client.force_authenticate(self.customer)
+        with self.assertNumQueries(1):
+            customer = self.client.get('/api/reservations/stats/').data
+        self.assertEqual({key: customer[key] for key in response.data if key != 'today'},
+                         {key: response.data[key] for key in response.data if key != 'today'})
+        self.assertEqual(customer['today'], response.data['today'])
+
+
+class ReservationEventTestCase(APITestCase):
+    """Tests pour le flux en direct des réservations d'une pharmacie"""
+
+    url = '/api/reservations/events/'
+
+    def setUp(self):
+        broker.clear()
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Essos', address='Yaoundé', phone='600000024',
+            latitude=3.87, longitude=11.54
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.owner).access_token}'}
+
+    def reserve(self):
+        return Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Client', contact_phone='600000000',
+            pickup_date=timezone.now() + timedelta(days=1)
+        )
+
+    def poll(self, headers=None, **params):
+        response = async_to_sync(self.async_client.get)(self.url, params, headers=headers or self.headers)
+        return response.status_code, response.json()
+
+    def test_broker_history_and_reset(self):
+        local = LocalBroker(history=2)
+        start = local.head()
+        for number in range(3):
+            local.deliver(1, {'type': 'created', 'reservation': number})
+        local.deliver(2, {'type': 'created', 'reservation': 9})
+
+        events, last_id, reset = local.since(1, start)
+        # Le premier événement est sorti de l'historique
+        self.assertEqual((events, reset), ([], True))
+        self.assertEqual(last_id, local.head())
+
+        events, _, reset = local.since(1, local.event_id(1))
+        self.assertEqual([event['reservation'] for event in events], [1, 2])
+        self.assertFalse(reset)
+        # Identifiant d'un autre processus
+        self.assertTrue(local.since(1, LocalBroker().head())[2])
+
+    def test_transitions_are_published_on_commit(self):
+        start = broker.head()
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = self.reserve()
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.confirm()
+            reservation.notes = 'Sans changement de statut'
+            reservation.save()
+        reservation.expires_at = timezone.now() - timedelta(hours=1)
+        reservation.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            expire_due()
+        # Annulé avant le commit : rien n'est publié
+        with self.captureOnCommitCallbacks(execute=False):
+            self.reserve()
+
+        events, _, _ = broker.since(self.pharmacy.id, start)
+        self.assertEqual(
+            [(event['type'], event['status'], event['previous_status']) for event in events],
+            [('created', 'pending', None), ('status', 'confirmed', 'pending'), ('status', 'expired', 'confirmed')],
+        )
+        self.assertTrue(all(event['reservation_number'] == reservation.reservation_number for event in events))
+
+    def test_long_poll(self):
+        status_code, data = self.poll()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data['events'], [])
+        start = data['last_id']
+
+        # Rien de nouveau : réponse vide à l'expiration du délai
+        status_code, data = self.poll(since=start, timeout=0)
+        self.assertEqual((data['events'], data['last_id'], data['reset']), ([], start, False))
+
+        # Un événement publié pendant l'attente réveille la requête
+        reservation = self.reserve()
+        timer = threading.Timer(
+            0.2, broker.deliver, args=(self.pharmacy.id, {'type': 'created', 'reservation': reservation.id})
+        )
+        timer.start()
+        started = time.monotonic()
+        status_code, data = self.poll(since=start, timeout=10)
+        timer.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([event['reservation'] for event in data['events']], [reservation.id])
+        self.assertEqual(data['last_id'], data['events'][0]['id'])
+
+        self.assertTrue(self.poll(since='inconnu:1')[1]['reset'])
+        self.assertEqual(self.poll(timeout='x')[0], 400)
+
+    def test_access(self):
+        customer = {'Authorization': f'Bearer {RefreshToken.for_user(self.customer).access_token}'}
+        self.assertEqual(self.poll(headers=customer)[0], 403)
+        self.assertEqual(self.poll(headers={'Authorization': 'Bearer invalide'})[0], 401)
+        response = async_to_sync(self.async_client.get)(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(RESERVATION_EVENT_STREAM_TIMEOUT=0.3, RESERVATION_EVENT_HEARTBEAT=0.1)
+    def test_server_sent_events(self):
+        start = broker.head()
+        broker.deliver(self.pharmacy.id, {'type': 'created', 'reservation': 1})
+        broker.deliver(self.pharmacy.id + 1, {'type': 'created', 'reservation': 2})
+
+        async def read():
+            response = await self.async_client.get(
+                self.url, headers=dict(self.headers, Accept='text/event-stream', **{'Last-Event-ID': start})
+            )
+            return response, b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        response, body = async_to_sync(read)()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = [block for block in body.split('\n\n') if block.startswith('id:')]
+        self.assertEqual(len(messages), 1)
+        self.assertIn('event: created', messages[0])
+        self.assertIn('"reservation": 1', messages[0])
+        self.assertIn(': ping', body)
+
+
+class ReservationContentionTestCase(TransactionTestCase):
+    """50 réservations concurrentes sur un même stock : aucune survente"""
+
+    THREADS = 50
+    INITIAL = 30
+
+    def setUp(self):
+        pharmacy = Pharmacy.objects.create(
+            name='Pharmacie de Garde', address='Douala', phone='600000030', latitude=4.05, longitude=9.7
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        medicine = Medicine.objects.create(name='Artésunate', dosage='60mg', form='injectable')
+        self.stock = Stock.objects.create(
+            pharmacy=pharmacy, medicine=medicine, quantity=self.INITIAL, price=Decimal(2500)
+        )
+        self.items = []
+        for i in range(self.THREADS):
+            reservation = Reservation.objects.create(
+                user=self.customer, pharmacy=pharmacy, contact_name=f'Client {i}', contact_phone='600000000',
+                pickup_date=timezone.now() + timedelta(days=1)
+            )
+            self.items.append(ReservationItem.objects.create(
+                reservation=reservation, medicine=medicine, stock=self.stock, quantity=1,
+                unit_price=Decimal(2500)
+            ))
+
+    def test_no_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Cache partagé SQLite en mémoire : les verrous de table ne sont
+            # jamais attendus, les écritures concurrentes échouent toutes
+            self.skipTest('Nécessite PostgreSQL ou une base SQLite sur fichier')
+        barrier = threading.Barrier(self.THREADS)
+        outcomes = []
+
+        def reserve(item):
+            try:
+                barrier.wait()
+                for _ in range(200):
+                    try:
+                        outcomes.append(item.reservation.decrement_stock([item]) != [])
+                        return
+                    except InsufficientStock:
+                        outcomes.append(False)
+                        return
+                    except OperationalError:
+                        # SQLite : base verrouillée par une autre écriture
+                        connection.close()
+                        time.sleep(random.uniform(0, 0.01))
+                outcomes.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve, args=(item,)) for item in self.items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(outcomes), self.THREADS)
+        self.stock.refresh_from_db()
+        self.assertEqual(outcomes.count(True), self.INITIAL)
+        self.assertEqual(self.stock.quantity, 0)
+        self.assertEqual(ReservationItem.objects.filter(stock_decremented=True).count(), self.INITIAL)
+        self.assertEqual(StockMovement.objects.filter(reason='reservation').count(), self.INITIAL)
@@ -4,6 +4,7 @@ URLs pour le système de réservation de médicaments (User Story 6)
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .streams import reservation_events
 from .views import ReservationViewSet
 
 app_name = 'reservations'
@@ -11,4 +12,7 @@ app_name = 'reservations'
 router = DefaultRouter()
 router.register(r'reservations', ReservationViewSet, basename='reservation')
 
-urlpatterns = router.urls
+urlpatterns = [
+    # Avant le routeur : "events" serait lu comme un identifiant de réservation
+    path('reservations/events/', reservation_events, name='reservation-events'),
+] + router.urls
@@ -6,10 +6,14 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db.models import Q
 
-from .models import Reservation, ReservationItem
+from core.cursors import decode_cursor, encode_cursor
+
+from .models import Reservation, ReservationCounter, ReservationItem
 from .serializers import (
     ReservationSerializer,
     ReservationListSerializer,
@@ -42,14 +46,16 @@ class ReservationViewSet(viewsets.ModelViewSet):
         - Admin: toutes les réservations
         """
         user = self.request.user
+        # pharmacy_name / user_username sans requête par réservation
+        reservations = Reservation.objects.select_related('pharmacy', 'user')
         
         if user.is_superuser or user.user_type == 'admin':
-            return Reservation.objects.all()
+            return reservations.all()
         
         if user.user_type == 'pharmacy' and user.pharmacy:
-            return Reservation.objects.filter(pharmacy=user.pharmacy)
+            return reservations.filter(pharmacy=user.pharmacy)
         
-        return Reservation.objects.filter(user=user)
+        return reservations.filter(user=user)
     
     def get_serializer_class(self):
         """Retourne le serializer approprié selon l'action"""
@@ -83,18 +89,13 @@ class ReservationViewSet(viewsets.ModelViewSet):
         if pharmacy_id and (request.user.is_superuser or request.user.user_type == 'admin'):
             queryset = queryset.filter(pharmacy_id=pharmacy_id)
         
-        # Vérifier les expirations
-        for reservation in queryset.filter(status__in=['pending', 'confirmed', 'ready']):
-            reservation.check_and_update_expiration()
-        
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer(queryset.with_totals(), many=True)
         return Response(serializer.data)
     
     def retrieve(self, request, pk=None):
         """Récupère les détails d'une réservation"""
         try:
-            reservation = self.get_queryset().get(pk=pk)
-            reservation.check_and_update_expiration()
+            reservation = self.get_queryset().prefetch_related('items__medicine').get(pk=pk)
             serializer = ReservationSerializer(reservation)
             return Response(serializer.data)
         except Reservation.DoesNotExist:
@@ -127,6 +128,10 @@ class ReservationViewSet(viewsets.ModelViewSet):
         
         if serializer.is_valid():
             reservation = serializer.save()
+            # Articles et médicaments chargés en deux requêtes pour la réponse
+            reservation = Reservation.objects.select_related('user', 'pharmacy').prefetch_related(
+                'items__medicine'
+            ).get(pk=reservation.pk)
             return Response(
                 ReservationSerializer(reservation).data,
                 status=status.HTTP_201_CREATED
@@ -238,12 +243,17 @@ class ReservationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def pharmacy(self, request):
         """
-        Liste toutes les réservations pour la pharmacie de l'utilisateur connecté.
+        Liste les réservations de la pharmacie de l'utilisateur connecté,
+        des plus récentes aux plus anciennes, par pages.
         Utilisé par les pharmaciens pour voir les réservations de leur pharmacie.
         
         Query params:
         - status: Filtrer par statut
         - date: Filtrer par date de récupération (YYYY-MM-DD)
+        - limit: Réservations par page (défaut: RESERVATION_PAGE_SIZE)
+        - cursor: Curseur "next" de la page précédente
+        
+        Réponse: {"count", "results", "next"}
         """
         user = request.user
         
@@ -253,7 +263,7 @@ class ReservationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        queryset = Reservation.objects.filter(pharmacy=user.pharmacy)
+        queryset = Reservation.objects.filter(pharmacy=user.pharmacy).select_related('pharmacy')
         
         # Filtrer par statut
         status_filter = request.query_params.get('status')
@@ -265,39 +275,62 @@ class ReservationViewSet(viewsets.ModelViewSet):
         if date_filter:
             queryset = queryset.filter(pickup_date__date=date_filter)
         
-        # Vérifier les expirations
-        for reservation in queryset.filter(status__in=['pending', 'confirmed', 'ready']):
-            reservation.check_and_update_expiration()
+        try:
+            limit = int(request.query_params.get('limit', settings.RESERVATION_PAGE_SIZE))
+            if limit < 1:
+                raise ValueError(limit)
+            limit = min(limit, settings.RESERVATION_MAX_PAGE_SIZE)
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                # Reprise juste après la dernière réservation de la page précédente
+                created_at, reservation_id = decode_cursor(cursor)
+                created_at = parse_datetime(created_at)
+                if created_at is None:
+                    raise ValueError(cursor)
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=int(reservation_id))
+                )
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Paramètres de pagination invalides'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        rows = list(queryset.with_totals().order_by('-created_at', '-id')[:limit + 1])
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor([last.created_at.isoformat(), last.id])
         
-        serializer = ReservationListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response({
+            'count': len(page),
+            'results': ReservationListSerializer(page, many=True).data,
+            'next': next_cursor
+        })
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """
         Retourne des statistiques sur les réservations.
-        Pour les pharmacies: stats de leur pharmacie
-        Pour les admins: stats globales
+        Pour les pharmacies: compteurs de leur pharmacie (une ligne lue)
+        Pour les admins: stats globales, en une requête
         """
         user = request.user
+        today = timezone.now().date()
         
-        if user.user_type == 'pharmacy' and user.pharmacy:
-            queryset = Reservation.objects.filter(pharmacy=user.pharmacy)
+        if user.user_type == 'pharmacy' and user.pharmacy_id:
+            counts = ReservationCounter.for_pharmacy(user.pharmacy_id).as_dict()
+            # Intervalle sur l'index (pharmacy, pickup_date)
+            counts['today'] = Reservation.objects.filter(pharmacy_id=user.pharmacy_id).picked_up_on(today).count()
         elif user.is_superuser or user.user_type == 'admin':
-            queryset = Reservation.objects.all()
+            counts = Reservation.objects.all().status_counts(today)
         else:
-            queryset = Reservation.objects.filter(user=user)
-        
-        today = timezone.now().date()
+            counts = Reservation.objects.filter(user=user).status_counts(today)
         
         return Response({
-            'total': queryset.count(),
-            'pending': queryset.filter(status='pending').count(),
-            'confirmed': queryset.filter(status='confirmed').count(),
-            'ready': queryset.filter(status='ready').count(),
-            'collected': queryset.filter(status='collected').count(),
-            'cancelled': queryset.filter(status='cancelled').count(),
-            'expired': queryset.filter(status='expired').count(),
-            'today': queryset.filter(pickup_date__date=today).count(),
-            'active': queryset.filter(status__in=['pending', 'confirmed', 'ready']).count()
+            key: counts[key] for key in (
+                'total', 'pending', 'confirmed', 'ready', 'collected',
+                'cancelled', 'expired', 'today', 'active'
+            )
         })
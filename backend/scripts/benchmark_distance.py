@@ -0,0 +1,70 @@
+"""
+Micro-benchmark du noyau de distances vectorisé.
+
+Compare, pour 1k, 10k et 100k pharmacies réparties autour de Yaoundé,
+l'ancienne boucle Python (haversine scalaire par pharmacie + tri) avec un
+appel unique à ``CoordinateSet.within``.
+
+Usage:
+    python scripts/benchmark_distance.py
+"""
+import os
+import sys
+import timeit
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pharmacies.distance import CoordinateSet
+
+
+CENTER = (3.8480, 11.5021)  # Yaoundé
+RADIUS_KM = 10
+SIZES = [1_000, 10_000, 100_000]
+
+
+def scalar_haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * asin(sqrt(a))
+
+
+def scalar_search(rows):
+    results = []
+    for pharmacy_id, lat, lon in rows:
+        distance = scalar_haversine(CENTER[1], CENTER[0], lon, lat)
+        if distance <= RADIUS_KM:
+            results.append((distance, pharmacy_id))
+    results.sort()
+    return results
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'pharmacies':>10} | {'boucle (ms)':>12} | {'numpy (ms)':>11} | {'gain':>6}")
+    print('-' * 50)
+
+    for size in SIZES:
+        # Pharmacies réparties sur ~ ±1° autour du centre (≈ 110 km)
+        lats = CENTER[0] + rng.uniform(-1, 1, size)
+        lons = CENTER[1] + rng.uniform(-1, 1, size)
+        ids = np.arange(1, size + 1)
+        rows = list(zip(ids.tolist(), lats.tolist(), lons.tolist()))
+        points = CoordinateSet(ids, lats, lons)
+
+        expected = [pharmacy_id for _, pharmacy_id in scalar_search(rows)]
+        got, _ = points.within(CENTER[0], CENTER[1], RADIUS_KM)
+        assert sorted(expected) == sorted(got.tolist())
+
+        repeat = max(1, 100_000 // size)
+        scalar = timeit.timeit(lambda: scalar_search(rows), number=repeat) / repeat
+        vector = timeit.timeit(
+            lambda: points.within(CENTER[0], CENTER[1], RADIUS_KM), number=repeat * 10
+        ) / (repeat * 10)
+        print(f"{size:>10} | {scalar * 1000:>12.3f} | {vector * 1000:>11.3f} | {scalar / vector:>5.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark de la recherche approchée (BK-tree) des noms de médicaments.
+
+Charge le catalogue de ``populate_large_medicines.py`` puis, pour ce
+catalogue et des catalogues synthétiques plus grands (noms dérivés avec
+suffixes), mesure la latence de ``BKTree.search`` sur des saisies avec
+fautes, comparée au parcours linéaire de tous les noms.
+
+Usage:
+    python scripts/benchmark_fuzzy.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from populate_large_medicines import MEDICINES_DATA
+
+from medicines.fuzzy import BKTree, distance_budget, levenshtein, query_terms
+from medicines.text_index import normalize
+
+
+SIZES = [1, 10, 50]  # Multiplicateurs du catalogue
+QUERIES = 100
+# Latence maximale acceptable par recherche sur le catalogue réel (ms)
+MAX_LATENCY_MS = 2
+
+
+def typo(word, rng):
+    """Une faute de frappe : suppression, doublement ou substitution"""
+    i = rng.randrange(len(word))
+    kind = rng.randrange(3)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    if kind == 1:
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + word[i + 1:]
+
+
+def linear_search(names, term, budget):
+    return sorted((d, name) for name in names if (d := levenshtein(term, name)) <= budget)
+
+
+def main():
+    rng = random.Random(42)
+    catalog = sorted({normalize(m['name']) for m in MEDICINES_DATA})
+    print(f"Catalogue populate_large_medicines : {len(catalog)} noms distincts\n")
+    print(f"{'noms':>7} | {'BK-tree (ms)':>12} | {'linéaire (ms)':>13} | {'gain':>5}")
+    print('-' * 48)
+
+    for factor in SIZES:
+        names = list(catalog)
+        for i in range(1, factor):
+            names.extend(f'{name} {chr(97 + i % 26)}{i}' for name in catalog)
+        tree = BKTree(names)
+
+        queries = [typo(rng.choice(catalog), rng) for _ in range(QUERIES)]
+        terms = [(term, distance_budget(term)) for query in queries for term in query_terms(query)[:1]]
+        for term, budget in terms[:20]:
+            assert tree.search(term, budget) == linear_search(names, term, budget)
+
+        tree_time = timeit.timeit(lambda: [tree.search(t, b) for t, b in terms], number=1) / len(terms)
+        linear_time = timeit.timeit(lambda: [linear_search(names, t, b) for t, b in terms], number=1) / len(terms)
+        print(f"{len(names):>7} | {tree_time * 1000:>12.3f} | {linear_time * 1000:>13.3f} | {linear_time / tree_time:>4.1f}x")
+
+        if factor == 1 and tree_time * 1000 > MAX_LATENCY_MS:
+            print(f"\n❌ Latence supérieure à {MAX_LATENCY_MS} ms sur le catalogue réel")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark de la création d'une réservation de 1, 10 et 50 articles.
+
+Compare l'ancien chemin article par article (lecture du médicament et du
+stock, ``ReservationItem.objects.create`` puis décrémentation et deux
+sauvegardes par article) avec ``ReservationCreateSerializer`` (lectures
+``in_bulk``, décrémentation conditionnelle groupée, ``bulk_create``) :
+nombre de requêtes et durée médiane.
+
+Les données du benchmark sont créées puis supprimées. Nécessite une base
+migrée :
+
+Usage:
+    USE_SQLITE=True python scripts/benchmark_reservation_create.py
+"""
+import os
+import statistics
+import sys
+import time
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'FindPharma.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from medicines.models import Medicine
+from pharmacies.models import Pharmacy
+from reservations.models import Reservation, ReservationItem
+from reservations.serializers import ReservationCreateSerializer
+from stocks.models import Stock, StockMovement
+from users.models import User
+
+
+SIZES = [1, 10, 50]
+ROUNDS = 20
+
+
+def per_item(user, pharmacy, items):
+    """Ancien chemin : requêtes et sauvegardes article par article"""
+    with transaction.atomic():
+        for item in items:
+            Medicine.objects.get(pk=item['medicine_id'])
+            Stock.objects.get(pk=item['stock_id'])
+        reservation = Reservation.objects.create(
+            user=user, pharmacy=pharmacy, contact_name='Benchmark', contact_phone='000000000',
+            pickup_date=timezone.now() + timedelta(days=1)
+        )
+        for item in items:
+            medicine = Medicine.objects.get(pk=item['medicine_id'])
+            stock = Stock.objects.get(pk=item['stock_id'])
+            reservation_item = ReservationItem.objects.create(
+                reservation=reservation, medicine=medicine, stock=stock,
+                quantity=item['quantity'], unit_price=stock.price
+            )
+            stock.quantity -= item['quantity']
+            stock.save()
+            reservation_item.stock_decremented = True
+            reservation_item.save()
+            StockMovement.record([StockMovement.for_stock(stock, -item['quantity'], 'reservation', reservation)])
+
+
+def set_based(user, pharmacy, items):
+    serializer = ReservationCreateSerializer(
+        data={
+            'pharmacy_id': pharmacy.id, 'items': items, 'contact_name': 'Benchmark',
+            'contact_phone': '000000000', 'pickup_date': timezone.now() + timedelta(days=1),
+        },
+        context={'request': SimpleNamespace(user=user)},
+    )
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+
+
+def measure(create, user, pharmacy, items):
+    durations = []
+    for _ in range(ROUNDS):
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            create(user, pharmacy, items)
+            durations.append(time.perf_counter() - start)
+    return len(queries), statistics.median(durations) * 1000
+
+
+def main():
+    pharmacy = Pharmacy.objects.create(
+        name='Benchmark réservation', address='-', phone='000000000', latitude=0, longitude=0
+    )
+    user = User.objects.create_user(username='benchmark-reservation', password='-', user_type='customer')
+    medicines = [
+        Medicine.objects.create(name=f'Benchmark réservation {i}', dosage='-', form='-')
+        for i in range(max(SIZES))
+    ]
+    stocks = [
+        Stock.objects.create(pharmacy=pharmacy, medicine=medicine, quantity=10 ** 6, price=Decimal(100))
+        for medicine in medicines
+    ]
+
+    print(f"Création d'une réservation, médiane de {ROUNDS} créations ({connection.vendor})\n")
+    print(f"{'articles':>8} | {'requêtes avant':>14} | {'ms avant':>8} | {'requêtes après':>14} | {'ms après':>8}")
+    print('-' * 66)
+    try:
+        for size in SIZES:
+            items = [
+                {'medicine_id': stock.medicine_id, 'stock_id': stock.id, 'pharmacy_id': pharmacy.id, 'quantity': 1}
+                for stock in stocks[:size]
+            ]
+            before = measure(per_item, user, pharmacy, items)
+            after = measure(set_based, user, pharmacy, items)
+            print(f"{size:>8} | {before[0]:>14} | {before[1]:>8.2f} | {after[0]:>14} | {after[1]:>8.2f}")
+    finally:
+        pharmacy.delete()
+        user.delete()
+        for medicine in medicines:
+            medicine.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark de contention des réservations sur un même stock.
+
+``THREADS`` threads réservent simultanément une unité d'un stock qui n'en
+contient que ``INITIAL``. Compare l'ancienne lecture-vérification-écriture
+en Python (``stock.quantity >= n`` puis ``save()``) avec la décrémentation
+conditionnelle de ``stocks.quantities.take_stock`` : durée, réservations
+acceptées et survente (unités vendues au-delà du stock initial).
+
+Sur PostgreSQL (READ COMMITTED), l'ancien chemin survend ; SQLite
+sérialise les écritures et le fait échouer puis recommencer à chaque
+conflit, d'où sa lenteur.
+
+Les données du benchmark (pharmacie, médicament, stock) sont créées puis
+supprimées. Nécessite une base migrée, PostgreSQL ou SQLite sur fichier :
+
+Usage:
+    USE_SQLITE=True python scripts/benchmark_stock_contention.py
+"""
+import os
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'FindPharma.settings')
+
+import django
+
+django.setup()
+
+from django.db import OperationalError, connection, transaction
+
+from medicines.models import Medicine
+from pharmacies.models import Pharmacy
+from stocks.models import Stock
+from stocks.quantities import InsufficientStock, take_stock
+
+
+THREADS = 50
+INITIAL = 30
+ROUNDS = 5
+
+
+def read_modify_write(stock_id):
+    """Ancien chemin : vérification en Python puis sauvegarde"""
+    with transaction.atomic():
+        stock = Stock.objects.get(pk=stock_id)
+        if stock.quantity < 1:
+            return False
+        # Fenêtre entre lecture et écriture (traitement de la requête)
+        time.sleep(0.001)
+        stock.quantity -= 1
+        stock.save()
+        return True
+
+
+def conditional_update(stock_id):
+    try:
+        take_stock([(stock_id, 1)])
+        return True
+    except InsufficientStock:
+        return False
+
+
+def contend(reserve, stock_id):
+    """Lance ``THREADS`` réservations simultanées ; retourne (acceptées, secondes)"""
+    barrier = threading.Barrier(THREADS + 1)
+    accepted = []
+
+    def worker():
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    accepted.append(reserve(stock_id))
+                    return
+                except OperationalError:
+                    # SQLite : base verrouillée par une autre écriture
+                    connection.close()
+                    time.sleep(random.uniform(0, 0.005))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return accepted.count(True), time.perf_counter() - start
+
+
+def main():
+    pharmacy = Pharmacy.objects.create(
+        name='Benchmark contention', address='-', phone='000000000', latitude=0, longitude=0
+    )
+    medicine = Medicine.objects.create(name='Benchmark contention', dosage='-', form='-')
+    stock = Stock.objects.create(pharmacy=pharmacy, medicine=medicine, quantity=INITIAL, price=Decimal(1))
+
+    print(f"{THREADS} réservations concurrentes d'une unité, stock initial {INITIAL}, "
+          f"{ROUNDS} tours ({connection.vendor})\n")
+    print(f"{'méthode':>22} | {'durée (ms)':>10} | {'acceptées':>9} | {'survente':>8} | {'stock final':>11}")
+    print('-' * 74)
+    try:
+        for label, reserve in [('lecture puis save()', read_modify_write),
+                               ('UPDATE conditionnel', conditional_update)]:
+            for _ in range(ROUNDS):
+                Stock.objects.filter(pk=stock.pk).update(quantity=INITIAL)
+                accepted, seconds = contend(reserve, stock.pk)
+                stock.refresh_from_db()
+                print(f"{label:>22} | {seconds * 1000:>10.1f} | {accepted:>9} | "
+                      f"{max(0, accepted - INITIAL):>8} | {stock.quantity:>11}")
+    finally:
+        pharmacy.delete()
+        medicine.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StocksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stocks'
+
+    def ready(self):
+        # Maintenir la matrice de disponibilité à jour lors des écritures
+        from . import signals  # noqa: F401
@@ -0,0 +1,260 @@
+"""
+Matrice de disponibilité pharmacie × médicament en mémoire.
+
+Chaque pharmacie reçoit un ordinal (0, 1, 2, ...) ; pour chaque médicament,
+un entier Python sert de bitmap : le bit ``n`` est à 1 si la pharmacie
+d'ordinal ``n`` a ce médicament disponible (``is_available`` et
+``quantity > 0``).
+
+« Quelles pharmacies ont M ? » (``pharmacies_with``), « lesquelles ont
+M1 et M2 » (``all_of``) ou « M1 ou M2 » (``any_of``) sont des ET / OU
+d'entiers, sans requête SQL, éventuellement restreints à un ensemble de
+pharmacies (celles d'un rayon). La recherche, le panier et les pages de
+pharmacies d'un médicament s'en servent pour ne lire que les stocks des
+pharmacies concernées. La matrice ne tient pas compte de l'activité des
+pharmacies ni de leurs suppressions dans les autres processus : elle peut
+désigner trop de pharmacies, jamais trop peu. Les requêtes qui lisent
+ensuite les stocks (``pharmacy__is_active``) restent la source de vérité.
+
+La matrice est construite en un seul parcours de ``Stock``, hors verrou,
+puis substituée à l'ancienne. Elle est propre à chaque processus et reste
+à jour sans reconstruction :
+
+- les écritures du processus l'ajustent au commit (voir ``signals.py``) ;
+- avant chaque lecture, les lignes du flux ``StockChange`` postérieures à
+  la position atteinte (écritures des autres workers, des commandes et du
+  balayeur) sont lues, et la disponibilité des stocks concernés relue en
+  une requête. Au-delà de ``AVAILABILITY_MATRIX_CATCH_UP`` lignes, la
+  matrice est reconstruite.
+
+Une reconstruction complète a lieu en outre toutes les
+``AVAILABILITY_MATRIX_TTL`` secondes.
+"""
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+
+class AvailabilityMatrix:
+    """
+    Bitmaps de pharmacies par médicament.
+
+    Toutes les méthodes publiques sont thread-safe.
+    """
+
+    def __init__(self, ttl=None, catch_up=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'AVAILABILITY_MATRIX_TTL', 300)
+        self.catch_up = catch_up if catch_up is not None else getattr(settings, 'AVAILABILITY_MATRIX_CATCH_UP', 1000)
+        # Protège l'état ; jamais tenu pendant une requête SQL
+        self._lock = threading.RLock()
+        # Une seule reconstruction ou mise à jour depuis le flux à la fois
+        self._refresh_lock = threading.Lock()
+        self._ordinals = {}        # pharmacy_id -> ordinal
+        self._pharmacy_ids = []    # ordinal -> pharmacy_id
+        self._bitmaps = {}         # medicine_id -> bitmap des pharmacies
+        self._position = (0, 0)    # position atteinte dans le flux StockChange
+        self._built_at = None
+
+    def _ordinal(self, pharmacy_id):
+        ordinal = self._ordinals.get(pharmacy_id)
+        if ordinal is None:
+            ordinal = self._ordinals[pharmacy_id] = len(self._pharmacy_ids)
+            self._pharmacy_ids.append(pharmacy_id)
+        return ordinal
+
+    def rebuild(self):
+        """Reconstruit la matrice en un parcours des stocks"""
+        with self._refresh_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        from .models import Stock
+        from .sync import committed_changes
+
+        # Position lue avant le parcours : les modifications validées
+        # pendant le parcours seront relues depuis le flux
+        head = committed_changes().values_list('transaction_id', 'id').last()
+
+        ordinals, pharmacy_ids, bitmaps = {}, [], {}
+        available = Stock.objects.filter(is_available=True, quantity__gt=0).order_by('pharmacy_id')
+        for medicine_id, pharmacy_id in available.values_list('medicine_id', 'pharmacy_id').iterator():
+            ordinal = ordinals.get(pharmacy_id)
+            if ordinal is None:
+                ordinal = ordinals[pharmacy_id] = len(pharmacy_ids)
+                pharmacy_ids.append(pharmacy_id)
+            bitmaps[medicine_id] = bitmaps.get(medicine_id, 0) | (1 << ordinal)
+
+        with self._lock:
+            self._ordinals, self._pharmacy_ids, self._bitmaps = ordinals, pharmacy_ids, bitmaps
+            self._position = tuple(head) if head else (0, 0)
+            self._built_at = time.monotonic()
+
+    def _apply_changes(self):
+        """Rattrape les modifications du flux ; ``False`` s'il y en a trop"""
+        from .models import Stock
+        from .sync import committed_changes
+
+        rows = list(
+            committed_changes(self._position).values_list(
+                'transaction_id', 'id', 'stock_id', 'pharmacy_id', 'medicine_id'
+            )[:self.catch_up + 1]
+        )
+        if not rows:
+            return True
+        if len(rows) > self.catch_up:
+            return False
+
+        available = set(
+            Stock.objects.filter(
+                pk__in={row[2] for row in rows}, is_available=True, quantity__gt=0
+            ).values_list('pharmacy_id', 'medicine_id')
+        )
+        with self._lock:
+            for _, _, _, pharmacy_id, medicine_id in rows:
+                self._set(pharmacy_id, medicine_id, (pharmacy_id, medicine_id) in available)
+            self._position = tuple(rows[-1][:2])
+        return True
+
+    def invalidate(self):
+        """Force une reconstruction à la prochaine lecture"""
+        with self._lock:
+            self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _ensure_built(self):
+        """Reconstruit la matrice si besoin, sinon rattrape le flux des modifications"""
+        # Matrice déjà construite : une lecture concurrente d'une mise à jour
+        # en cours utilise l'état courant plutôt que d'attendre
+        if not self._refresh_lock.acquire(blocking=not self.is_built):
+            return
+        try:
+            built_at = self._built_at
+            if built_at is None or time.monotonic() - built_at > self.ttl or not self._apply_changes():
+                self._rebuild()
+        finally:
+            self._refresh_lock.release()
+
+    # Mises à jour incrémentales
+
+    def _set(self, pharmacy_id, medicine_id, available):
+        bit = 1 << self._ordinal(pharmacy_id)
+        bitmap = self._bitmaps.get(medicine_id, 0)
+        bitmap = bitmap | bit if available else bitmap & ~bit
+        if bitmap:
+            self._bitmaps[medicine_id] = bitmap
+        else:
+            self._bitmaps.pop(medicine_id, None)
+
+    def set_stock(self, pharmacy_id, medicine_id, available):
+        """Met à jour la disponibilité d'un médicament dans une pharmacie"""
+        with self._lock:
+            if self.is_built:
+                self._set(pharmacy_id, medicine_id, available)
+
+    def remove_pharmacy(self, pharmacy_id):
+        """Retire une pharmacie supprimée (son ordinal n'est pas réutilisé)"""
+        with self._lock:
+            if not self.is_built or pharmacy_id not in self._ordinals:
+                return
+            mask = ~(1 << self._ordinals[pharmacy_id])
+            self._bitmaps = {m: b & mask for m, b in self._bitmaps.items() if b & mask}
+
+    # Requêtes
+
+    def _scope(self, pharmacy_ids):
+        """Bitmap de ``pharmacy_ids``, ou de toutes les pharmacies si ``None``"""
+        if pharmacy_ids is None:
+            return (1 << len(self._pharmacy_ids)) - 1
+        return self._mask_of(pharmacy_ids)
+
+    def _mask_of(self, pharmacy_ids):
+        """Bitmap d'un ensemble d'identifiants de pharmacies"""
+        result = 0
+        for pharmacy_id in pharmacy_ids:
+            ordinal = self._ordinals.get(pharmacy_id)
+            if ordinal is not None:
+                result |= 1 << ordinal
+        return result
+
+    def _ids_of(self, mask):
+        """Identifiants des pharmacies d'un bitmap, par ordinal croissant"""
+        ids = []
+        while mask:
+            low = mask & -mask
+            ids.append(self._pharmacy_ids[low.bit_length() - 1])
+            mask ^= low
+        return ids
+
+    def available_medicines(self, medicine_ids, pharmacy_ids=None):
+        """
+        Médicaments de ``medicine_ids`` (ordre conservé) qui peuvent être
+        disponibles dans au moins une pharmacie, parmi ``pharmacy_ids`` si
+        fourni.
+        """
+        self._ensure_built()
+        with self._lock:
+            if pharmacy_ids is None:
+                return [m for m in medicine_ids if m in self._bitmaps]
+            scope = self._mask_of(pharmacy_ids)
+            return [m for m in medicine_ids if self._bitmaps.get(m, 0) & scope]
+
+    def pharmacies_with(self, medicine_id, pharmacy_ids=None):
+        """Pharmacies (parmi ``pharmacy_ids`` si fourni) pouvant avoir le médicament"""
+        self._ensure_built()
+        with self._lock:
+            return self._ids_of(self._bitmaps.get(medicine_id, 0) & self._scope(pharmacy_ids))
+
+    def count(self, medicine_id):
+        """Nombre de pharmacies pouvant avoir le médicament"""
+        self._ensure_built()
+        with self._lock:
+            return self._bitmaps.get(medicine_id, 0).bit_count()
+
+    def all_of(self, medicine_ids, pharmacy_ids=None):
+        """Pharmacies (parmi ``pharmacy_ids`` si fourni) pouvant avoir tous ces médicaments (ET)"""
+        self._ensure_built()
+        with self._lock:
+            result = self._scope(pharmacy_ids)
+            for medicine_id in medicine_ids:
+                result &= self._bitmaps.get(medicine_id, 0)
+                if not result:
+                    break
+            return self._ids_of(result)
+
+    def any_of(self, medicine_ids, pharmacy_ids=None):
+        """Pharmacies (parmi ``pharmacy_ids`` si fourni) pouvant avoir au moins un de ces médicaments (OU)"""
+        self._ensure_built()
+        with self._lock:
+            result = 0
+            for medicine_id in medicine_ids:
+                result |= self._bitmaps.get(medicine_id, 0)
+            return self._ids_of(result & self._scope(pharmacy_ids))
+
+    def memory_report(self):
+        """Empreinte mémoire approximative de la matrice, en octets"""
+        self._ensure_built()
+        with self._lock:
+            bitmaps = sum(sys.getsizeof(b) for b in self._bitmaps.values())
+            keys = sum(sys.getsizeof(m) for m in self._bitmaps)
+            ordinals = sys.getsizeof(self._ordinals) + sys.getsizeof(self._pharmacy_ids) + sum(
+                sys.getsizeof(p) for p in self._pharmacy_ids
+            )
+            pairs = sum(b.bit_count() for b in self._bitmaps.values())
+            total = bitmaps + keys + sys.getsizeof(self._bitmaps) + ordinals
+            return {
+                'pharmacies': len(self._pharmacy_ids),
+                'medicines': len(self._bitmaps),
+                'available_pairs': pairs,
+                'bitmaps_bytes': bitmaps,
+                'ordinals_bytes': ordinals,
+                'total_bytes': total,
+                'bytes_per_pair': round(total / pairs, 2) if pairs else None,
+            }
+
+
+availability = AvailabilityMatrix()
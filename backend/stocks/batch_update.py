@@ -0,0 +1,114 @@
+"""
+Mise à jour groupée des stocks d'une pharmacie (inventaire de fin de
+journée).
+
+Les éléments, déjà validés par ``StockBatchItemSerializer``, désignent un
+stock par ``stock_id`` ou ``medicine_id``. Tous les stocks visés sont lus
+et verrouillés en une requête, les modifications sont appliquées en
+mémoire et seules les lignes réellement modifiées sont écrites, en une
+requête : ``UPDATE ... FROM (VALUES ...)`` sur PostgreSQL, ``bulk_update``
+ailleurs. Les variations de quantité sont ajoutées au journal
+``StockMovement`` en une requête de plus. L'ensemble est atomique : un
+élément qui ne désigne aucun stock de la pharmacie annule tout le lot.
+"""
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Stock, StockMovement
+from .signals import bulk_saved
+
+
+UPDATED_FIELDS = ('quantity', 'price', 'is_available')
+
+
+class BatchUpdateError(Exception):
+    """Éléments ne désignant aucun stock de la pharmacie : ``errors`` par position"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _update_values(stocks, now):
+    """Écrit les stocks en une requête ``UPDATE ... FROM (VALUES ...)`` (PostgreSQL)"""
+    quote = connection.ops.quote_name
+    column = {name: quote(Stock._meta.get_field(name).column) for name in UPDATED_FIELDS + ('last_updated',)}
+    rows = ', '.join(['(%s::bigint, %s::integer, %s::numeric, %s::boolean)'] * len(stocks))
+    params = [now]
+    for stock in stocks:
+        params.extend([stock.pk, stock.quantity, stock.price, stock.is_available])
+
+    sql = (
+        f'UPDATE {quote(Stock._meta.db_table)} AS s SET '
+        f'{column["quantity"]} = v.quantity, {column["price"]} = v.price, '
+        f'{column["is_available"]} = v.is_available, {column["last_updated"]} = %s '
+        f'FROM (VALUES {rows}) AS v(id, quantity, price, is_available) '
+        f'WHERE s.{quote(Stock._meta.pk.column)} = v.id'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _write(stocks, now):
+    if connection.vendor == 'postgresql':
+        _update_values(stocks, now)
+    else:
+        Stock.objects.bulk_update(stocks, list(UPDATED_FIELDS) + ['last_updated'])
+
+
+def batch_update_stocks(pharmacy, items):
+    """
+    Applique les éléments ``items`` (dictionnaires validés) aux stocks de
+    ``pharmacy`` et retourne la liste des stocks modifiés, avec leur
+    médicament chargé. Lève ``BatchUpdateError`` si un élément ne désigne
+    aucun stock de la pharmacie.
+    """
+    stock_ids = {item['stock_id'] for item in items if 'stock_id' in item}
+    medicine_ids = {item['medicine_id'] for item in items if 'medicine_id' in item}
+
+    with transaction.atomic():
+        stocks = list(
+            Stock.objects.select_for_update(of=('self',)).filter(pharmacy=pharmacy).filter(
+                Q(id__in=stock_ids) | Q(medicine_id__in=medicine_ids)
+            ).select_related('medicine')
+        )
+        by_id = {stock.pk: stock for stock in stocks}
+        by_medicine = {stock.medicine_id: stock for stock in stocks}
+
+        errors = {}
+        targets = []
+        for position, item in enumerate(items):
+            stock = by_id.get(item['stock_id']) if 'stock_id' in item else by_medicine.get(item['medicine_id'])
+            if stock is None:
+                errors[position] = 'Stock introuvable dans cette pharmacie'
+            else:
+                targets.append((stock, item))
+        if errors:
+            raise BatchUpdateError(errors)
+
+        original = {stock.pk: tuple(getattr(stock, name) for name in UPDATED_FIELDS) for stock in stocks}
+        # Plusieurs éléments pour un même stock : appliqués dans l'ordre
+        for stock, item in targets:
+            for name in UPDATED_FIELDS:
+                if name in item:
+                    setattr(stock, name, item[name])
+            # Comme StockCreateUpdateSerializer : un stock vide est indisponible
+            if stock.quantity == 0:
+                stock.is_available = False
+
+        now = timezone.now()
+        changed = []
+        for stock in {stock.pk: stock for stock, _ in targets}.values():
+            if tuple(getattr(stock, name) for name in UPDATED_FIELDS) != original[stock.pk]:
+                stock.last_updated = now
+                changed.append(stock)
+
+        if changed:
+            _write(changed, now)
+            StockMovement.record(
+                StockMovement.for_stock(stock, stock.quantity - original[stock.pk][0], 'inventory')
+                for stock in changed
+            )
+            bulk_saved(changed)
+    return changed
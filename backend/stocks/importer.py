@@ -0,0 +1,334 @@
+"""
+Import en masse des stocks d'une pharmacie depuis un fichier CSV ou JSON.
+
+Le fichier est lu en flux (``iter_csv_records`` / ``iter_json_records``) et
+traité par lots de ``STOCK_IMPORT_BATCH_SIZE`` lignes. Pour chaque lot :
+
+1. chaque ligne est validée (quantité, prix, disponibilité) ;
+2. les médicaments sont résolus en une requête, par identifiant
+   (colonne ``medicine``) ou par le triplet (``name``, ``dosage``,
+   ``form``) : nom, dosage et forme comparés sans casse ni accents (les
+   noms sont cherchés dans l'index des médicaments, ``medicine_index``) ;
+3. les stocks existants du lot sont lus en une requête (pour distinguer
+   créations et mises à jour et calculer les variations de quantité) ;
+4. les stocks sont écrits en une requête ``INSERT ... ON CONFLICT DO
+   UPDATE`` (``bulk_create(update_conflicts=True)``) ;
+5. les variations sont ajoutées au journal ``StockMovement`` en une
+   requête.
+
+Un import de N lignes fait donc environ ``4 * N / STOCK_IMPORT_BATCH_SIZE``
+requêtes. Les lignes invalides sont ignorées et décrites dans le rapport ;
+les autres sont importées dans une seule transaction. ``bulk_create``
+n'envoyant pas ``post_save``, le signal ``stocks_bulk_saved`` est émis
+au commit de l'import pour les index en mémoire.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from medicines.models import Medicine
+from medicines.text_index import medicine_index, normalize
+from pharmacies.models import Pharmacy
+
+from .models import Stock, StockMovement
+from .signals import bulk_saved
+
+
+# Nombre maximal d'erreurs détaillées dans le rapport
+MAX_REPORTED_ERRORS = 1000
+
+_TRUE = {'1', 'true', 'vrai', 'oui', 'yes', 'y', 'o'}
+_FALSE = {'0', 'false', 'faux', 'non', 'no', 'n'}
+
+
+class ImportFormatError(ValueError):
+    """Fichier illisible (format inconnu, JSON invalide, ...)"""
+
+
+def iter_csv_records(stream):
+    """
+    Lignes d'un CSV (séparateur ``,`` ou ``;``, en-tête obligatoire) sous
+    forme de dictionnaires aux clés en minuscules.
+    """
+    first = stream.readline()
+    if not first.strip():
+        return
+    delimiter = ';' if first.count(';') > first.count(',') else ','
+    reader = csv.reader(chain([first], stream), delimiter=delimiter)
+    header = [column.strip().lower() for column in next(reader)]
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        yield dict(zip(header, values))
+
+
+def iter_json_records(stream, chunk_size=65536):
+    """
+    Objets d'un tableau JSON (``[{...}, {...}]``) ou d'un fichier JSON
+    Lines, décodés au fur et à mesure de la lecture.
+    """
+    decoder = json.JSONDecoder()
+    buffer, eof, in_array = '', False, None
+    while True:
+        buffer = buffer.lstrip()
+        if buffer:
+            if in_array is None:
+                in_array = buffer[0] == '['
+                if in_array:
+                    buffer = buffer[1:]
+                    continue
+            if in_array and buffer[0] == ',':
+                buffer = buffer[1:]
+                continue
+            if in_array and buffer[0] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as error:
+                # Objet coupé en fin de morceau : lire la suite
+                if eof:
+                    raise ImportFormatError(f'JSON invalide : {error}')
+            else:
+                buffer = buffer[end:]
+                yield record
+                continue
+        if eof:
+            if in_array:
+                raise ImportFormatError('JSON invalide : tableau non terminé')
+            return
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def iter_records(uploaded_file, file_format=None):
+    """
+    Enregistrements d'un fichier envoyé, selon ``file_format`` (``csv`` ou
+    ``json``) ou, à défaut, l'extension du nom du fichier.
+    """
+    if file_format is None:
+        name = (getattr(uploaded_file, 'name', '') or '').lower()
+        file_format = 'json' if name.endswith(('.json', '.jsonl', '.ndjson')) else 'csv'
+    if file_format not in ('csv', 'json'):
+        raise ImportFormatError(f'Format inconnu : {file_format}')
+
+    stream = io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
+    if file_format == 'json':
+        return iter_json_records(stream)
+    return iter_csv_records(stream)
+
+
+def _medicine_key(name, dosage, form):
+    return (normalize(name), normalize(dosage), normalize(form))
+
+
+def _clean(record):
+    """
+    Valeurs validées d'un enregistrement : ``(référence, nom, champs)``,
+    la référence étant un identifiant ou le triplet normalisé et le nom
+    celui écrit dans le fichier (``None`` pour un identifiant). Lève
+    ``ValueError`` avec les erreurs par champ.
+    """
+    if not isinstance(record, dict):
+        raise ValueError({'non_field_errors': 'La ligne doit être un objet'})
+    record = {str(key).strip().lower(): value for key, value in record.items()}
+    errors = {}
+
+    reference = name = None
+    medicine = record.get('medicine', record.get('medicine_id'))
+    if medicine not in (None, ''):
+        try:
+            reference = int(medicine)
+        except (TypeError, ValueError):
+            errors['medicine'] = 'Identifiant de médicament invalide'
+    elif str(record.get('name') or '').strip():
+        name = str(record['name']).strip()
+        reference = _medicine_key(name, str(record.get('dosage') or ''), str(record.get('form') or ''))
+    else:
+        errors['medicine'] = 'Le médicament (identifiant ou nom) est obligatoire'
+
+    quantity = None
+    try:
+        quantity = int(str(record.get('quantity', '')).strip())
+        if quantity < 0:
+            errors['quantity'] = 'La quantité ne peut pas être négative'
+    except ValueError:
+        errors['quantity'] = 'Quantité invalide'
+
+    price = None
+    try:
+        price = Decimal(str(record.get('price', '')).strip().replace(',', '.'))
+        if not price.is_finite() or price <= 0:
+            errors['price'] = 'Le prix doit être supérieur à 0'
+        elif price.as_tuple().exponent < -2 or price >= Decimal('1e8'):
+            errors['price'] = 'Prix invalide (2 décimales, moins de 10^8)'
+    except InvalidOperation:
+        errors['price'] = 'Prix invalide'
+
+    is_available = True
+    available = record.get('is_available')
+    if isinstance(available, bool):
+        is_available = available
+    elif available not in (None, ''):
+        value = str(available).strip().lower()
+        if value in _TRUE:
+            is_available = True
+        elif value in _FALSE:
+            is_available = False
+        else:
+            errors['is_available'] = 'Valeur booléenne invalide'
+
+    if errors:
+        raise ValueError(errors)
+    # Comme StockCreateUpdateSerializer : un stock vide est indisponible
+    if quantity == 0:
+        is_available = False
+    return reference, name, {'quantity': quantity, 'price': price, 'is_available': is_available}
+
+
+def _resolve_medicines(ids, names):
+    """
+    Médicaments référencés par identifiant ou par nom, en une requête :
+    ``({id: id}, {triplet normalisé: id})``. Les noms sont cherchés sans
+    casse ni accents dans l'index des médicaments, et tels quels en base
+    pour ceux que l'index n'a pas encore vus (écrits par un autre worker).
+    """
+    if not ids and not names:
+        return {}, {}
+    by_id, by_key = {}, {}
+    named = medicine_index.named(names) if names else set()
+    rows = Medicine.objects.filter(
+        Q(id__in=ids | named) | Q(name__in=names)
+    ).values_list('id', 'name', 'dosage', 'form')
+    for medicine_id, name, dosage, form in rows:
+        by_id[medicine_id] = medicine_id
+        by_key.setdefault(_medicine_key(name, dosage, form), medicine_id)
+    return by_id, by_key
+
+
+def _import_batch(pharmacy, batch, report, reason):
+    """Importe un lot de ``(numéro de ligne, enregistrement)``"""
+    rows = []
+    for number, record in batch:
+        try:
+            rows.append((number,) + _clean(record))
+        except ValueError as error:
+            report.error(number, error.args[0])
+
+    by_id, by_key = _resolve_medicines(
+        {reference for _, reference, _, _ in rows if isinstance(reference, int)},
+        {name for _, _, name, _ in rows if name},
+    )
+
+    stocks = {}
+    for number, reference, _, values in rows:
+        medicine_id = (by_id if isinstance(reference, int) else by_key).get(reference)
+        if medicine_id is None:
+            report.error(number, {'medicine': 'Médicament introuvable'})
+            continue
+        # Un même médicament répété : la dernière ligne l'emporte
+        stocks[medicine_id] = Stock(pharmacy=pharmacy, medicine_id=medicine_id, **values)
+
+    if not stocks:
+        return []
+
+    # Stocks existants verrouillés : leur quantité ne change pas avant le
+    # calcul des mouvements
+    existing = dict(
+        Stock.objects.select_for_update().filter(pharmacy=pharmacy, medicine_id__in=list(stocks)).values_list(
+            'medicine_id', 'quantity'
+        )
+    )
+    Stock.objects.bulk_create(
+        list(stocks.values()),
+        update_conflicts=True,
+        unique_fields=['pharmacy', 'medicine'],
+        update_fields=['quantity', 'price', 'is_available', 'last_updated'],
+    )
+    if any(stock.pk is None for stock in stocks.values()):
+        # Base ne retournant pas les identifiants d'un INSERT ... ON CONFLICT
+        ids = dict(
+            Stock.objects.filter(pharmacy=pharmacy, medicine_id__in=list(stocks)).values_list('medicine_id', 'id')
+        )
+        for medicine_id, stock in stocks.items():
+            stock.pk = ids[medicine_id]
+    StockMovement.record(
+        StockMovement.for_stock(stock, stock.quantity - existing.get(medicine_id, 0), reason)
+        for medicine_id, stock in stocks.items()
+    )
+    for medicine_id in stocks:
+        report.count(medicine_id, medicine_id in existing)
+    return list(stocks.values())
+
+
+class ImportReport:
+    """Compteurs et erreurs par ligne d'un import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        # Médicaments déjà comptés : un stock repris dans un lot suivant
+        # n'est compté qu'une fois
+        self._counted = set()
+
+    def count(self, medicine_id, existed):
+        """Compte un stock écrit, créé ou mis à jour selon son état avant l'import"""
+        if medicine_id in self._counted:
+            return
+        self._counted.add(medicine_id)
+        if existed:
+            self.updated += 1
+        else:
+            self.created += 1
+
+    def error(self, row, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'errors_truncated': self.error_count > len(self.errors),
+        }
+
+
+def import_stocks(pharmacy, records, batch_size=None, reason='import'):
+    """
+    Importe des enregistrements (itérable de dictionnaires) dans les stocks
+    de ``pharmacy`` et retourne le rapport d'import. ``reason`` est le motif
+    des mouvements de stock enregistrés.
+
+    Les numéros de ligne du rapport commencent à 1 (première ligne de
+    données).
+    """
+    batch_size = batch_size or getattr(settings, 'STOCK_IMPORT_BATCH_SIZE', 1000)
+    report = ImportReport()
+    saved = []
+    numbered = enumerate(records, start=1)
+
+    with transaction.atomic():
+        # Imports d'une même pharmacie sérialisés : un stock créé par un
+        # import concurrent ne peut pas être compté comme nouveau
+        list(Pharmacy.objects.select_for_update().filter(pk=pharmacy.pk).values_list('pk', flat=True))
+        while True:
+            batch = list(islice(numbered, batch_size))
+            if not batch:
+                break
+            report.rows += len(batch)
+            saved.extend(_import_batch(pharmacy, batch, report, reason))
+        bulk_saved(saved)
+    return report
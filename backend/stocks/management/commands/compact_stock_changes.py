@@ -0,0 +1,30 @@
+"""
+Management command to compact the POS synchronisation feed (StockChange).
+
+Only the latest change of each stock matters to a client, whatever its
+token: changes followed, in feed order (transaction_id, id), by a later
+change of the same stock are deleted, so the feed stays proportional to
+the catalogue plus deletions.
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+
+from stocks.models import StockChange
+
+
+class Command(BaseCommand):
+    help = 'Delete stock changes superseded by a later change of the same stock'
+
+    def handle(self, *args, **options):
+        superseded = StockChange.objects.filter(
+            Exists(StockChange.objects.filter(
+                Q(transaction_id__gt=OuterRef('transaction_id'))
+                | Q(transaction_id=OuterRef('transaction_id'), id__gt=OuterRef('id')),
+                stock_id=OuterRef('stock_id'),
+            ))
+        )
+        deleted, _ = superseded.delete()
+        remaining = StockChange.objects.count()
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} superseded stock changes deleted, {remaining} remaining'
+        ))
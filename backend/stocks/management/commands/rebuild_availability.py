@@ -0,0 +1,28 @@
+"""
+Management command to rebuild the pharmacy × medicine availability matrix
+and report its memory footprint.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from stocks.availability import availability
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the in-memory availability matrix from Stock and report its memory footprint'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        availability.rebuild()
+        elapsed = (time.perf_counter() - started) * 1000
+
+        report = availability.memory_report()
+        self.stdout.write(self.style.SUCCESS(f'Availability matrix rebuilt in {elapsed:.1f} ms'))
+        for key, value in report.items():
+            self.stdout.write(f'  {key}: {value}')
+        self.stdout.write(
+            'Note: this rebuilds the matrix of this process only. Each web worker '
+            'keeps its own matrix, catches up with the StockChange feed before '
+            'every read and rebuilds it after AVAILABILITY_MATRIX_TTL seconds.'
+        )
@@ -0,0 +1,70 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_changes(apps, schema_editor):
+    """Une modification par stock existant : un jeton vide couvre tout le catalogue"""
+    Stock = apps.get_model('stocks', 'Stock')
+    StockChange = apps.get_model('stocks', 'StockChange')
+    batch = []
+    for stock_id, pharmacy_id, medicine_id in Stock.objects.order_by('id').values_list(
+        'id', 'pharmacy_id', 'medicine_id'
+    ).iterator():
+        batch.append(StockChange(pharmacy_id=pharmacy_id, stock_id=stock_id, medicine_id=medicine_id))
+        if len(batch) >= 1000:
+            StockChange.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        StockChange.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pharmacies", "0004_backfill_pharmacy_location"),
+        ("stocks", "0002_stockmovement"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="stockmovement",
+            name="reason",
+            field=models.CharField(
+                choices=[
+                    ("manual", "Modification manuelle"),
+                    ("import", "Import en masse"),
+                    ("inventory", "Inventaire groupé"),
+                    ("reservation", "Réservation"),
+                    ("restore", "Restauration (annulation ou expiration)"),
+                    ("sync", "Synchronisation caisse"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.CreateModel(
+            name="StockChange",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("stock_id", models.BigIntegerField()),
+                ("medicine_id", models.BigIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "pharmacy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stock_changes",
+                        to="pharmacies.pharmacy",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(fields=["pharmacy", "id"], name="stock_change_feed"),
+                    models.Index(fields=["stock_id", "id"], name="stock_change_stock"),
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
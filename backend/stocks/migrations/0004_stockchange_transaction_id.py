@@ -0,0 +1,62 @@
+from django.db import migrations, models
+
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION stocks_stockchange_transaction_id() RETURNS trigger AS $$
+BEGIN
+    NEW.transaction_id := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stocks_stockchange_transaction_id
+BEFORE INSERT ON stocks_stockchange
+FOR EACH ROW EXECUTE PROCEDURE stocks_stockchange_transaction_id();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS stocks_stockchange_transaction_id ON stocks_stockchange;
+DROP FUNCTION IF EXISTS stocks_stockchange_transaction_id();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    """Identifiant de la transaction d'écriture de chaque modification (PostgreSQL seulement)"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(TRIGGER_SQL)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER_SQL)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("stocks", "0003_stockchange"),
+    ]
+
+    operations = [
+        # Les lignes existantes (transaction_id = 0) précèdent toutes les nouvelles
+        migrations.AddField(
+            model_name="stockchange",
+            name="transaction_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterModelOptions(
+            name="stockchange",
+            options={"ordering": ["transaction_id", "id"]},
+        ),
+        migrations.RemoveIndex(
+            model_name="stockchange",
+            name="stock_change_feed",
+        ),
+        migrations.AddIndex(
+            model_name="stockchange",
+            index=models.Index(fields=["pharmacy", "transaction_id", "id"], name="stock_change_feed"),
+        ),
+        migrations.AddIndex(
+            model_name="stockchange",
+            index=models.Index(fields=["transaction_id", "id"], name="stock_change_order"),
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from pharmacies.models import Pharmacy
 from medicines.models import Medicine
 
@@ -19,4 +20,121 @@ class Stock(models.Model):
 
     def __str__(self):
         return f"{self.medicine.name} @ {self.pharmacy.name} ({self.quantity})"
-    
\ No newline at end of file
+
+
+class StockMovement(models.Model):
+    """
+    Journal en ajout seul des variations de quantité d'un stock.
+
+    Chaque ligne enregistre une variation (``delta``) et la quantité qui en
+    résulte. La pharmacie et le médicament sont recopiés pour lire
+    l'historique d'une pharmacie sur une période sans joindre ``Stock``
+    (index ``pharmacy, -created_at, -id``), et pour le conserver après la
+    suppression du stock.
+    """
+
+    REASON_CHOICES = [
+        ('manual', 'Modification manuelle'),
+        ('import', 'Import en masse'),
+        ('inventory', 'Inventaire groupé'),
+        ('reservation', 'Réservation'),
+        ('restore', 'Restauration (annulation ou expiration)'),
+        ('sync', 'Synchronisation caisse'),
+    ]
+
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='stock_movements')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='stock_movements')
+    stock = models.ForeignKey(
+        Stock, on_delete=models.SET_NULL, null=True, blank=True, related_name='movements'
+    )
+    delta = models.IntegerField()
+    quantity_after = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reservation = models.ForeignKey(
+        'reservations.Reservation', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='stock_movements'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['pharmacy', '-created_at', '-id'], name='stock_movement_history'),
+        ]
+
+    def __str__(self):
+        return f"{self.delta:+d} {self.medicine_id} @ {self.pharmacy_id} ({self.reason})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Le journal des mouvements de stock est en ajout seul")
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def for_stock(cls, stock, delta, reason, reservation=None):
+        """Mouvement (non enregistré) d'un stock dont la quantité est déjà à jour"""
+        return cls(
+            pharmacy_id=stock.pharmacy_id,
+            medicine_id=stock.medicine_id,
+            stock=stock,
+            delta=delta,
+            quantity_after=stock.quantity,
+            reason=reason,
+            reservation=reservation,
+        )
+
+    @classmethod
+    def record(cls, movements):
+        """Enregistre en une requête les mouvements de variation non nulle"""
+        movements = [movement for movement in movements if movement.delta]
+        if movements:
+            cls.objects.bulk_create(movements)
+        return movements
+
+
+class StockChange(models.Model):
+    """
+    Flux des modifications de stocks pour la synchronisation incrémentale
+    des caisses (voir ``stocks/sync.py``).
+
+    Chaque écriture d'un stock (création, modification, suppression)
+    ajoute une ligne. Sa position dans le flux est ``(transaction_id,
+    id)`` : sous PostgreSQL, un déclencheur renseigne ``transaction_id``
+    avec l'identifiant de la transaction d'écriture (``txid_current()``),
+    ce qui permet de ne lire que les transactions terminées ; ailleurs il
+    reste à 0 et l'identifiant seul fait foi (écritures sérialisées).
+    L'index ``pharmacy, transaction_id, id`` permet de lire les
+    modifications d'une pharmacie postérieures à une position donnée. Le
+    stock et le médicament ne sont pas des clés étrangères : une
+    suppression reste visible (``deleted``) après la disparition du stock.
+    """
+
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='stock_changes')
+    stock_id = models.BigIntegerField()
+    medicine_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    transaction_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['transaction_id', 'id']
+        indexes = [
+            models.Index(fields=['pharmacy', 'transaction_id', 'id'], name='stock_change_feed'),
+            models.Index(fields=['transaction_id', 'id'], name='stock_change_order'),
+            models.Index(fields=['stock_id', 'id'], name='stock_change_stock'),
+        ]
+
+    def __str__(self):
+        action = 'suppression' if self.deleted else 'modification'
+        return f"#{self.pk} {action} du stock {self.stock_id} @ {self.pharmacy_id}"
+
+    @classmethod
+    def for_stocks(cls, stocks, deleted=False):
+        """Enregistre en une requête une modification pour chaque stock"""
+        changes = [
+            cls(pharmacy_id=stock.pharmacy_id, stock_id=stock.pk, medicine_id=stock.medicine_id, deleted=deleted)
+            for stock in stocks
+        ]
+        if changes:
+            cls.objects.bulk_create(changes)
+        return changes
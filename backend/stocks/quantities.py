@@ -0,0 +1,135 @@
+"""
+Variations atomiques des quantités de stock (réservations).
+
+Lire ``stock.quantity``, la comparer en Python puis sauvegarder laisse
+deux réservations concurrentes passer la vérification et survendre. Ici,
+toutes les variations d'une opération sont appliquées par une seule
+requête conditionnelle :
+
+    UPDATE stocks_stock
+    SET quantity = quantity - CASE id WHEN 1 THEN 2 WHEN 7 THEN 1 END
+    WHERE id IN (1, 7) AND quantity >= CASE id WHEN 1 THEN 2 WHEN 7 THEN 1 END
+
+La base évalue la condition sur la ligne verrouillée par l'UPDATE : si le
+nombre de lignes modifiées est inférieur au nombre de stocks visés, l'un
+d'eux est insuffisant et la transaction de l'appelant est annulée. Les
+quantités résultantes sont relues en une requête pour le journal
+``StockMovement`` (un mouvement par ligne, avec sa réservation) et le
+signal ``stocks_bulk_saved``, émis au commit de la transaction de
+l'appelant (``signals.bulk_saved``).
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Stock, StockMovement
+from .signals import bulk_saved
+
+
+class InsufficientStock(ValueError):
+    """Quantité disponible insuffisante pour au moins un stock"""
+
+    def __init__(self, message, stock_ids):
+        super().__init__(message)
+        self.stock_ids = stock_ids
+
+
+def _amounts(amounts):
+    """``{stock_id: quantité}`` sans quantités nulles, en additionnant les doublons"""
+    totals = Counter()
+    for stock_id, quantity in amounts:
+        totals[stock_id] += quantity
+    return {stock_id: quantity for stock_id, quantity in totals.items() if quantity}
+
+
+def _case(totals):
+    return Case(
+        *[When(pk=stock_id, then=Value(quantity)) for stock_id, quantity in totals.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _shortage_message(totals):
+    rows = Stock.objects.filter(pk__in=totals).select_related('medicine').only(
+        'id', 'quantity', 'medicine__name'
+    )
+    short = [stock for stock in rows if stock.quantity < totals[stock.pk]]
+    missing = set(totals) - {stock.pk for stock in rows}
+    parts = [
+        f"{stock.medicine.name} (disponible: {stock.quantity}, demandé: {totals[stock.pk]})"
+        for stock in short
+    ] + [f"stock {stock_id} introuvable" for stock_id in sorted(missing)]
+    return "Stock insuffisant pour " + ', '.join(parts), sorted([stock.pk for stock in short] + list(missing))
+
+
+def _adjust(lines, sign, reason):
+    """
+    Applique ``sign * quantité`` pour chaque ligne ``(stock_id, quantité,
+    identifiant de réservation)`` et journalise un mouvement par ligne.
+    """
+    totals = _amounts((stock_id, quantity) for stock_id, quantity, _ in lines)
+    if not totals:
+        return []
+    now = timezone.now()
+    amount = _case(totals)
+    stocks = Stock.objects.filter(pk__in=list(totals))
+    if sign < 0:
+        updated = stocks.filter(quantity__gte=amount).update(quantity=F('quantity') - amount, last_updated=now)
+    else:
+        updated = stocks.update(quantity=F('quantity') + amount, last_updated=now)
+    if sign < 0 and updated != len(totals):
+        raise InsufficientStock(*_shortage_message(totals))
+
+    changed = list(Stock.objects.filter(pk__in=list(totals)))
+    by_id = {stock.pk: stock for stock in changed}
+    # Quantité après chaque ligne, en repartant de la quantité initiale
+    running = {stock.pk: stock.quantity - sign * totals[stock.pk] for stock in changed}
+    movements = []
+    for stock_id, quantity, reservation_id in lines:
+        if stock_id not in by_id or not quantity:
+            continue
+        running[stock_id] += sign * quantity
+        movement = StockMovement.for_stock(by_id[stock_id], sign * quantity, reason)
+        movement.quantity_after = running[stock_id]
+        movement.reservation_id = reservation_id
+        movements.append(movement)
+    StockMovement.record(movements)
+    return changed
+
+
+def _lines(amounts, reservation):
+    reservation_id = reservation.pk if reservation is not None else None
+    return [(stock_id, quantity, reservation_id) for stock_id, quantity in amounts]
+
+
+def take_stock(amounts, reason='reservation', reservation=None):
+    """
+    Retire les quantités ``amounts`` (couples ``(stock_id, quantité)``) en
+    une requête conditionnelle. Lève ``InsufficientStock`` (rien n'est
+    retiré) si un stock n'a pas la quantité demandée.
+
+    Retourne les stocks modifiés, relus après la mise à jour.
+    """
+    with transaction.atomic():
+        changed = _adjust(_lines(amounts, reservation), -1, reason)
+        bulk_saved(changed)
+    return changed
+
+
+def return_stock(amounts, reason='restore', reservation=None):
+    """Remet les quantités ``amounts`` en stock en une requête (voir ``take_stock``)"""
+    return return_reserved_stock(_lines(amounts, reservation), reason)
+
+
+def return_reserved_stock(lines, reason='restore'):
+    """
+    Remet en stock, en une requête, les lignes ``(stock_id, quantité,
+    identifiant de réservation)`` de plusieurs réservations ; chaque ligne
+    a son mouvement dans le journal.
+    """
+    with transaction.atomic():
+        changed = _adjust(list(lines), 1, reason)
+        bulk_saved(changed)
+    return changed
@@ -1,5 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Stock
+from .models import Stock, StockMovement
 from medicines.models import Medicine
 from pharmacies.models import Pharmacy
 
@@ -63,3 +64,62 @@ class StockListSerializer(serializers.ModelSerializer):
             'form': obj.medicine.form,
             'requires_prescription': obj.medicine.requires_prescription,
         }
+
+
+class StockBatchItemSerializer(serializers.Serializer):
+    """Élément d'une mise à jour groupée : stock désigné par id ou par médicament"""
+    stock_id = serializers.IntegerField(required=False)
+    medicine_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=0)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    is_available = serializers.BooleanField(required=False)
+    
+    def validate_price(self, value):
+        """Validation du prix"""
+        if value <= 0:
+            raise serializers.ValidationError("Le prix doit être supérieur à 0")
+        return value
+    
+    def validate(self, data):
+        """Un identifiant de stock ou de médicament, et au moins un champ à modifier"""
+        if ('stock_id' in data) == ('medicine_id' in data):
+            raise serializers.ValidationError("Indiquer stock_id ou medicine_id (un seul des deux)")
+        if not {'quantity', 'price', 'is_available'} & set(data):
+            raise serializers.ValidationError("Aucun champ à modifier (quantity, price, is_available)")
+        return data
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    """Ligne du journal des mouvements de stock"""
+    medicine = serializers.SerializerMethodField()
+    reason_display = serializers.CharField(source='get_reason_display', read_only=True)
+    
+    class Meta:
+        model = StockMovement
+        fields = [
+            'id', 'stock', 'medicine', 'delta', 'quantity_after',
+            'reason', 'reason_display', 'reservation', 'created_at'
+        ]
+    
+    def get_medicine(self, obj):
+        """Retourne le médicament concerné"""
+        return {
+            'id': obj.medicine.id,
+            'name': obj.medicine.name,
+            'dosage': obj.medicine.dosage,
+            'form': obj.medicine.form,
+        }
+
+
+class StockSyncPushSerializer(serializers.Serializer):
+    """Diff envoyé par une caisse : stocks modifiés et médicaments retirés"""
+    upserts = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    deletes = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    
+    def validate(self, data):
+        """Taille maximale du diff"""
+        if len(data['upserts']) + len(data['deletes']) > settings.STOCK_BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Au plus {settings.STOCK_BATCH_MAX_ITEMS} modifications par requête'
+            )
+        return data
@@ -0,0 +1,78 @@
+"""
+Signaux maintenant à jour la matrice de disponibilité et le flux de
+synchronisation des caisses (``StockChange``).
+
+Le flux est une table : il est écrit dans la transaction de l'écriture et
+annulé avec elle. Les structures en mémoire (matrice, cache de recherche)
+ne sont mises à jour qu'au commit, pour ne jamais refléter une écriture
+annulée.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from pharmacies.models import Pharmacy
+
+from .availability import availability
+from .models import Stock, StockChange
+
+
+# Émis au commit d'une écriture en masse de stocks (``bulk_create`` /
+# ``bulk_update`` n'envoient pas ``post_save``) ; argument : ``stocks``,
+# la liste des instances écrites. Voir ``bulk_saved``.
+stocks_bulk_saved = Signal()
+
+
+def bulk_saved(stocks):
+    """
+    À appeler dans la transaction d'une écriture en masse de stocks :
+    enregistre les modifications dans le flux de synchronisation et émet
+    ``stocks_bulk_saved`` au commit (jamais si la transaction est annulée).
+    """
+    if not stocks:
+        return
+    StockChange.for_stocks(stocks)
+    transaction.on_commit(lambda: stocks_bulk_saved.send(sender=Stock, stocks=stocks))
+
+
+def _set_availability(stock):
+    availability.set_stock(stock.pharmacy_id, stock.medicine_id, stock.is_available and stock.quantity > 0)
+
+
+@receiver(post_save, sender=Stock)
+def update_availability(sender, instance, **kwargs):
+    """Disponible si le stock est marqué disponible et non vide (au commit)"""
+    pharmacy_id, medicine_id = instance.pharmacy_id, instance.medicine_id
+    available = instance.is_available and instance.quantity > 0
+    transaction.on_commit(lambda: availability.set_stock(pharmacy_id, medicine_id, available))
+
+
+@receiver(post_delete, sender=Stock)
+def remove_availability(sender, instance, **kwargs):
+    pharmacy_id, medicine_id = instance.pharmacy_id, instance.medicine_id
+    transaction.on_commit(lambda: availability.set_stock(pharmacy_id, medicine_id, False))
+
+
+@receiver(post_save, sender=Stock)
+def record_stock_change(sender, instance, **kwargs):
+    StockChange.for_stocks([instance])
+
+
+@receiver(post_delete, sender=Stock)
+def record_stock_deletion(sender, instance, origin=None, **kwargs):
+    # Pharmacie supprimée : son flux disparaît avec elle
+    if isinstance(origin, Pharmacy) or getattr(origin, 'model', None) is Pharmacy:
+        return
+    StockChange.for_stocks([instance], deleted=True)
+
+
+@receiver(post_delete, sender=Pharmacy)
+def remove_pharmacy_availability(sender, instance, **kwargs):
+    pharmacy_id = instance.pk
+    transaction.on_commit(lambda: availability.remove_pharmacy(pharmacy_id))
+
+
+@receiver(stocks_bulk_saved)
+def update_bulk_availability(sender, stocks, **kwargs):
+    for stock in stocks:
+        _set_availability(stock)
@@ -0,0 +1,135 @@
+"""
+Synchronisation incrémentale des stocks avec les caisses (POS) des
+pharmacies.
+
+Lecture : ``changes_since`` lit, dans l'ordre de l'index
+``pharmacy, transaction_id, id``, les lignes de ``StockChange`` de la
+pharmacie postérieures à la position du jeton, ne garde que la dernière
+par stock et relit en une requête l'état actuel des stocks encore
+présents ; les autres sont renvoyés comme suppressions. Le coût d'une
+synchronisation est proportionnel au nombre de modifications, pas à la
+taille du catalogue. Sans jeton, la lecture part du début du flux (la
+migration a créé une ligne par stock existant) : c'est la synchronisation
+initiale.
+
+Un identifiant est attribué à l'insertion mais n'est visible qu'au
+commit : une transaction plus longue peut valider un identifiant
+inférieur à un identifiant déjà lu. La position suit donc l'ordre des
+transactions : sous PostgreSQL, ``committed_changes`` ne retient que les
+lignes des transactions antérieures à la plus ancienne transaction
+encore en cours (``txid_snapshot_xmin``) ; toute transaction qui
+validera plus tard aura un identifiant supérieur à la position lue. Une
+transaction ouverte longtemps retarde la synchronisation, sans perte.
+Ailleurs (SQLite), les écritures sont sérialisées : l'ordre des
+identifiants est celui des commits. Seule la dernière ligne de chaque
+stock compte : la commande ``compact_stock_changes`` supprime les autres.
+
+Écriture : ``push_changes`` applique le diff envoyé par la caisse en une
+transaction : les stocks modifiés passent par l'import en masse, les
+médicaments retirés sont supprimés. Les mouvements de stock ont le motif
+``sync``.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from core.cursors import decode_cursor, encode_cursor
+
+from .importer import import_stocks
+from .models import Stock, StockChange, StockMovement
+
+
+def encode_token(position):
+    """Jeton opaque de synchronisation pour une position ``(transaction, identifiant)``"""
+    return encode_cursor(list(position))
+
+
+def decode_token(token):
+    """
+    Position d'un jeton (début du flux sans jeton) ; lève ``ValueError``
+    s'il est invalide. Un ancien jeton (numéro de séquence seul) précède
+    toutes les modifications écrites depuis la migration.
+    """
+    if not token:
+        return (0, 0)
+    position = decode_cursor(token)
+    if not (isinstance(position, list) and len(position) in (1, 2)
+            and all(isinstance(value, int) and value >= 0 for value in position)):
+        raise ValueError('Jeton de synchronisation invalide')
+    return (0, position[0]) if len(position) == 1 else tuple(position)
+
+
+def committed_changes(position=(0, 0), queryset=None):
+    """
+    Lignes de ``StockChange`` après ``position``, dans l'ordre du flux,
+    limitées aux transactions terminées : aucune ligne validée plus tard
+    ne pourra précéder la dernière ligne lue.
+    """
+    transaction_id, sequence = position
+    queryset = StockChange.objects.all() if queryset is None else queryset
+    queryset = queryset.filter(
+        Q(transaction_id__gt=transaction_id) | Q(transaction_id=transaction_id, id__gt=sequence)
+    )
+    if connection.vendor == 'postgresql':
+        queryset = queryset.filter(
+            transaction_id__lt=RawSQL('txid_snapshot_xmin(txid_current_snapshot())', [])
+        )
+    return queryset.order_by('transaction_id', 'id')
+
+
+def changes_since(pharmacy, position=(0, 0), limit=None):
+    """
+    Modifications des stocks de ``pharmacy`` après ``position``, au plus
+    ``limit`` lignes du flux : ``(stocks, suppressions, position atteinte,
+    reste)``. Les stocks sont dans leur état actuel, médicament chargé ;
+    une suppression est un dictionnaire ``{'id', 'medicine'}``. ``reste``
+    indique que d'autres modifications peuvent être lues immédiatement.
+    """
+    limit = limit or settings.STOCK_SYNC_PAGE_SIZE
+    rows = list(
+        committed_changes(position, StockChange.objects.filter(pharmacy=pharmacy)).values_list(
+            'transaction_id', 'id', 'stock_id', 'medicine_id', 'deleted'
+        )[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Dernière modification de chaque stock, dans l'ordre du flux
+    latest = {}
+    for _, _, stock_id, medicine_id, deleted in rows:
+        latest.pop(stock_id, None)
+        latest[stock_id] = (medicine_id, deleted)
+    current = Stock.objects.filter(pharmacy=pharmacy).select_related('medicine').in_bulk(
+        [stock_id for stock_id, (_, deleted) in latest.items() if not deleted]
+    )
+
+    stocks, deletions = [], []
+    for stock_id, (medicine_id, _) in latest.items():
+        if stock_id in current:
+            stocks.append(current[stock_id])
+        else:
+            # Supprimé (éventuellement après la dernière ligne lue)
+            deletions.append({'id': stock_id, 'medicine': medicine_id})
+    return stocks, deletions, tuple(rows[-1][:2]) if rows else tuple(position), has_more
+
+
+def push_changes(pharmacy, upserts=(), deletes=()):
+    """
+    Applique le diff d'une caisse : ``upserts`` (enregistrements au format
+    de l'import en masse) et ``deletes`` (identifiants des médicaments
+    retirés). Retourne ``(rapport d'import, nombre de stocks supprimés)``.
+    """
+    with transaction.atomic():
+        report = import_stocks(pharmacy, upserts, reason='sync')
+        removed = []
+        if deletes:
+            removed = list(Stock.objects.select_for_update().filter(pharmacy=pharmacy, medicine_id__in=deletes))
+        if removed:
+            movements = [StockMovement.for_stock(stock, -stock.quantity, 'sync') for stock in removed]
+            for movement in movements:
+                movement.quantity_after = 0
+            # Les mouvements sont conservés (stock mis à NULL) après la suppression
+            StockMovement.record(movements)
+            Stock.objects.filter(pk__in=[stock.pk for stock in removed]).delete()
+    return report, len(removed)
@@ -1,3 +1,579 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from core.cursors import encode_cursor
+from medicines.models import Medicine
+from medicines.text_index import medicine_index
+from pharmacies.models import Pharmacy
+from users.models import User
+
+from .availability import AvailabilityMatrix, availability
+from .importer import import_stocks, iter_json_records
+from .models import Stock, StockChange, StockMovement
+from .sync import decode_token
+
+
+class AvailabilityMatrixTestCase(TestCase):
+    """Tests pour la matrice de disponibilité pharmacie × médicament"""
+
+    def setUp(self):
+        self.pharmacies = [
+            Pharmacy.objects.create(
+                name=f'Pharmacie {i}', address='Yaoundé', phone=f'60000000{i}',
+                latitude=3.84 + i / 100, longitude=11.50
+            )
+            for i in range(3)
+        ]
+        self.paracetamol = Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        self.quinine = Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        a, b, c = self.pharmacies
+        for pharmacy, medicine in [(a, self.paracetamol), (b, self.paracetamol), (b, self.quinine)]:
+            Stock.objects.create(pharmacy=pharmacy, medicine=medicine, quantity=5, price=Decimal(500))
+        Stock.objects.create(pharmacy=c, medicine=self.quinine, quantity=0, price=Decimal(800))
+        self.matrix = AvailabilityMatrix()
+
+    def test_who_has_it(self):
+        a, b, _ = self.pharmacies
+        self.assertEqual(sorted(self.matrix.pharmacies_with(self.paracetamol.id)), [a.id, b.id])
+        self.assertEqual(sorted(self.matrix.pharmacies_with(self.quinine.id)), [b.id])
+        self.assertEqual(
+            self.matrix.available_medicines([self.quinine.id, self.paracetamol.id], pharmacy_ids=[a.id]),
+            [self.paracetamol.id]
+        )
+
+    def test_and_or_across_medicines(self):
+        a, b, c = self.pharmacies
+        both = [self.paracetamol.id, self.quinine.id]
+        self.assertEqual(self.matrix.count(self.paracetamol.id), 2)
+        self.assertEqual(self.matrix.count(self.quinine.id), 1)
+        self.assertEqual(self.matrix.all_of(both), [b.id])
+        self.assertEqual(sorted(self.matrix.any_of(both)), [a.id, b.id])
+        # Restreint à un ensemble de pharmacies (celles d'un rayon)
+        self.assertEqual(self.matrix.all_of(both, pharmacy_ids=[a.id, c.id]), [])
+        self.assertEqual(self.matrix.any_of(both, pharmacy_ids=[a.id, c.id]), [a.id])
+        self.assertEqual(self.matrix.pharmacies_with(self.quinine.id, pharmacy_ids=[a.id, c.id]), [])
+        self.assertEqual(self.matrix.all_of([]), [a.id, b.id])
+
+    def test_one_feed_query_once_built(self):
+        self.matrix.rebuild()
+        with self.assertNumQueries(1):
+            self.matrix.available_medicines([self.quinine.id, self.paracetamol.id])
+
+    def test_incremental_updates(self):
+        self.matrix.rebuild()
+        a, b, c = self.pharmacies
+        self.matrix.set_stock(c.id, self.quinine.id, True)
+        self.assertEqual(sorted(self.matrix.pharmacies_with(self.quinine.id)), [b.id, c.id])
+        self.matrix.set_stock(b.id, self.quinine.id, False)
+        self.matrix.remove_pharmacy(a.id)
+        self.assertEqual(sorted(self.matrix.pharmacies_with(self.paracetamol.id)), [b.id])
+        self.assertEqual(
+            self.matrix.available_medicines([self.quinine.id, self.paracetamol.id], pharmacy_ids=[c.id]),
+            [self.quinine.id]
+        )
+
+    def test_catches_up_with_writes_of_other_processes(self):
+        # Les signaux ne mettent à jour que la matrice partagée : celle-ci
+        # ne voit les écritures qu'à travers le flux StockChange
+        self.matrix.rebuild()
+        a, b, c = self.pharmacies
+        Stock.objects.filter(pharmacy=c, medicine=self.quinine).update(quantity=4)
+        StockChange.for_stocks(Stock.objects.filter(pharmacy=c, medicine=self.quinine))
+        Stock.objects.get(pharmacy=a, medicine=self.paracetamol).delete()
+        self.assertEqual(sorted(self.matrix.pharmacies_with(self.quinine.id)), [b.id, c.id])
+        self.assertEqual(sorted(self.matrix.pharmacies_with(self.paracetamol.id)), [b.id])
+
+        # Trop de modifications à rattraper : reconstruction complète
+        matrix = AvailabilityMatrix(catch_up=1)
+        matrix.rebuild()
+        for stock in Stock.objects.filter(medicine=self.quinine):
+            stock.quantity = 0
+            stock.save()
+        self.assertEqual(matrix.pharmacies_with(self.quinine.id), [])
+
+    def test_signals_update_shared_matrix(self):
+        availability.rebuild()
+        stock = Stock.objects.get(pharmacy=self.pharmacies[2], medicine=self.quinine)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.quantity = 3
+            stock.save()
+        self.assertEqual(availability.count(self.quinine.id), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.delete()
+        self.assertEqual(availability.count(self.quinine.id), 1)
+
+    def test_rolled_back_writes_leave_memory_untouched(self):
+        from .quantities import take_stock
+
+        availability.rebuild()
+        stock = Stock.objects.get(pharmacy=self.pharmacies[1], medicine=self.quinine)
+        changes = StockChange.objects.count()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    take_stock([(stock.id, 5)])
+                    raise ValueError('annulation')
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(availability.count(self.quinine.id), 1)
+        self.assertEqual(StockChange.objects.count(), changes)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            take_stock([(stock.id, 5)])
+        self.assertEqual(availability.pharmacies_with(self.quinine.id), [])
+        self.assertEqual(StockChange.objects.count(), changes + 1)
+
+    def test_rebuild_command_reports_memory(self):
+        out = StringIO()
+        call_command('rebuild_availability', stdout=out)
+        self.assertIn('available_pairs: 3', out.getvalue())
+        self.assertIn('total_bytes', out.getvalue())
+
+
+class StockImportTestCase(APITestCase):
+    """Tests pour l'import en masse des stocks"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Centrale', address='Yaoundé', phone='600000010',
+            latitude=3.848, longitude=11.502
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.paracetamol = Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        self.quinine = Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        Stock.objects.create(pharmacy=self.pharmacy, medicine=self.quinine, quantity=1, price=Decimal(900))
+        self.url = f'/api/pharmacies/{self.pharmacy.id}/stocks/import/'
+
+    def upload(self, name, content, **params):
+        self.client.force_authenticate(self.owner)
+        return self.client.post(
+            self.url + ('?format=' + params['format'] if 'format' in params else ''),
+            {'file': SimpleUploadedFile(name, content.encode('utf-8'))},
+            format='multipart'
+        )
+
+    def test_csv_import_creates_and_updates(self):
+        availability.rebuild()
+        content = (
+            'name;dosage;form;quantity;price;is_available\n'
+            'Paracétamol;500MG;Comprimé;40;250,50;oui\n'
+            f'Quinine;300mg;comprimé;12;950;1\n'
+            'Inconnu;1g;comprimé;3;100;\n'
+            'Quinine;300mg;comprimé;-2;abc;\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload('stocks.csv', content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rows'], 4)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'quantity', 'price'})
+
+        stock = Stock.objects.get(pharmacy=self.pharmacy, medicine=self.paracetamol)
+        self.assertEqual((stock.quantity, stock.price), (40, Decimal('250.50')))
+        self.assertEqual(Stock.objects.get(pharmacy=self.pharmacy, medicine=self.quinine).quantity, 12)
+        # Le signal d'écriture en masse met la matrice à jour
+        self.assertEqual(availability.pharmacies_with(self.paracetamol.id), [self.pharmacy.id])
+
+    def test_names_match_without_case_or_accents(self):
+        medicine_index.invalidate()
+        records = [
+            {'name': 'paracetamol', 'dosage': '500mg', 'form': 'comprime', 'quantity': '4', 'price': '250'},
+            {'name': 'QUININE', 'dosage': '300MG', 'form': 'Comprimé', 'quantity': '6', 'price': '950'},
+        ]
+        report = import_stocks(self.pharmacy, records)
+        self.assertEqual((report.created, report.updated, report.error_count), (1, 1, 0))
+        self.assertEqual(Stock.objects.get(pharmacy=self.pharmacy, medicine=self.paracetamol).quantity, 4)
+
+    def test_rows_repeated_across_batches_are_counted_once(self):
+        records = [
+            {'medicine': medicine.id, 'quantity': str(quantity), 'price': '500'}
+            for quantity in (1, 2) for medicine in (self.quinine, self.paracetamol)
+        ]
+        report = import_stocks(self.pharmacy, records, batch_size=1)
+        self.assertEqual((report.rows, report.created, report.updated), (4, 1, 1))
+        self.assertEqual(Stock.objects.get(pharmacy=self.pharmacy, medicine=self.paracetamol).quantity, 2)
+
+    def test_json_import_by_id(self):
+        content = (
+            f'[{{"medicine": {self.paracetamol.id}, "quantity": 0, "price": 300}},'
+            f' {{"medicine": "x", "quantity": 1, "price": 1}}]'
+        )
+        response = self.upload('stocks.json', content)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+        # Stock vide : indisponible
+        self.assertFalse(Stock.objects.get(pharmacy=self.pharmacy, medicine=self.paracetamol).is_available)
+
+    def test_json_records_are_streamed(self):
+        from io import StringIO as Stream
+
+        records = [{'medicine': i, 'price': '1.50', 'note': 'a, [b] "c"'} for i in range(50)]
+        import json
+        text = json.dumps(records)
+        self.assertEqual(list(iter_json_records(Stream(text), chunk_size=7)), records)
+        lines = '\n'.join(json.dumps(record) for record in records)
+        self.assertEqual(list(iter_json_records(Stream(lines), chunk_size=5)), records)
+
+    def test_invalid_file_and_permissions(self):
+        response = self.upload('stocks.json', '[{"medicine": 1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Stock.objects.filter(pharmacy=self.pharmacy).count(), 1)
+
+        other = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.client.force_authenticate(other)
+        response = self.client.post(
+            self.url, {'file': SimpleUploadedFile('s.csv', b'name\n')}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_batches_use_constant_queries(self):
+        medicines = Medicine.objects.bulk_create(
+            Medicine(name=f'Produit {i}', dosage='10mg', form='comprimé') for i in range(300)
+        )
+        records = [
+            {'name': medicine.name, 'dosage': '10mg', 'form': 'comprimé', 'quantity': '5', 'price': '100'}
+            for medicine in medicines
+        ]
+        medicine_index.rebuild()
+        # 4 requêtes par lot de 100 (médicaments, stocks existants, upsert,
+        # journal), plus le point de sauvegarde de la transaction, le verrou
+        # de la pharmacie et le flux de synchronisation (découpé selon le
+        # nombre de paramètres permis)
+        fields = [field for field in StockChange._meta.concrete_fields if not field.primary_key]
+        change_batches = -(-len(records) // connection.ops.bulk_batch_size(fields, records))
+        with self.assertNumQueries(4 * 3 + 3 + change_batches):
+            report = import_stocks(self.pharmacy, records, batch_size=100)
+        self.assertEqual(report.created, 300)
+
+
+class StockBatchUpdateTestCase(APITestCase):
+    """Tests pour la modification groupée des stocks"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Centrale', address='Yaoundé', phone='600000010',
+            latitude=3.848, longitude=11.502
+        )
+        self.other_pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Voisine', address='Yaoundé', phone='600000011',
+            latitude=3.850, longitude=11.505
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.medicines = [
+            Medicine.objects.create(name=f'Produit {i}', dosage='10mg', form='comprimé') for i in range(3)
+        ]
+        self.stocks = [
+            Stock.objects.create(pharmacy=self.pharmacy, medicine=medicine, quantity=10, price=Decimal(100))
+            for medicine in self.medicines
+        ]
+        self.foreign = Stock.objects.create(
+            pharmacy=self.other_pharmacy, medicine=self.medicines[0], quantity=4, price=Decimal(100)
+        )
+        self.url = f'/api/pharmacies/{self.pharmacy.id}/stocks/batch/'
+        self.client.force_authenticate(self.owner)
+
+    def test_returns_only_changed_rows(self):
+        availability.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, [
+                {'stock_id': self.stocks[0].id, 'quantity': 0},
+                {'medicine_id': self.medicines[1].id, 'price': '120.50'},
+                {'stock_id': self.stocks[2].id, 'quantity': 10, 'price': '100'},
+            ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data], [self.stocks[0].id, self.stocks[1].id])
+
+        first, second, third = (Stock.objects.get(pk=stock.pk) for stock in self.stocks)
+        self.assertEqual((first.quantity, first.is_available), (0, False))
+        self.assertEqual(second.price, Decimal('120.50'))
+        self.assertEqual(third.last_updated, self.stocks[2].last_updated)
+        self.assertNotIn(self.pharmacy.id, availability.pharmacies_with(self.medicines[0].id))
+
+    def test_all_or_nothing(self):
+        response = self.client.patch(self.url, [
+            {'stock_id': self.stocks[0].id, 'quantity': 3},
+            {'stock_id': self.foreign.id, 'quantity': 1},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], {1: 'Stock introuvable dans cette pharmacie'})
+        self.assertEqual(Stock.objects.get(pk=self.stocks[0].pk).quantity, 10)
+        self.assertEqual(Stock.objects.get(pk=self.foreign.pk).quantity, 4)
+
+        response = self.client.patch(self.url, [{'quantity': 3}, {'stock_id': 1, 'price': '-1'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_is_constant(self):
+        items = [{'stock_id': stock.id, 'quantity': 20} for stock in self.stocks]
+        # Pharmacie, point de sauvegarde, lecture verrouillée des stocks,
+        # écriture groupée, journal des mouvements, fin du point de
+        # sauvegarde, flux de synchronisation
+        with self.assertNumQueries(7):
+            response = self.client.patch(self.url, items, format='json')
+        self.assertEqual(len(response.data), 3)
+
+    def test_permission_checked(self):
+        other = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.client.force_authenticate(other)
+        response = self.client.patch(self.url, [{'stock_id': self.stocks[0].id, 'quantity': 1}], format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class StockMovementTestCase(APITestCase):
+    """Tests pour le journal des mouvements de stock et l'historique"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie Centrale', address='Yaoundé', phone='600000010',
+            latitude=3.848, longitude=11.502
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.paracetamol = Medicine.objects.create(name='Paracétamol', dosage='500mg', form='comprimé')
+        self.quinine = Medicine.objects.create(name='Quinine', dosage='300mg', form='comprimé')
+        self.client.force_authenticate(self.owner)
+        self.stocks_url = f'/api/pharmacies/{self.pharmacy.id}/stocks/'
+
+    def ledger(self):
+        return list(StockMovement.objects.order_by('id').values_list('medicine_id', 'delta', 'quantity_after', 'reason'))
+
+    def test_manual_edits_are_recorded(self):
+        response = self.client.post(self.stocks_url, {
+            'medicine': self.paracetamol.id, 'quantity': 10, 'price': '500'
+        }, format='json')
+        stock_id = response.data['id']
+        self.client.patch(f'{self.stocks_url}{stock_id}/', {'quantity': 7}, format='json')
+        self.client.patch(f'{self.stocks_url}{stock_id}/', {'price': '550'}, format='json')
+        self.client.delete(f'{self.stocks_url}{stock_id}/')
+
+        self.assertEqual(self.ledger(), [
+            (self.paracetamol.id, 10, 10, 'manual'),
+            (self.paracetamol.id, -3, 7, 'manual'),
+            (self.paracetamol.id, -7, 0, 'manual'),
+        ])
+        # Le journal survit à la suppression du stock
+        self.assertFalse(StockMovement.objects.filter(stock__isnull=False).exists())
+
+    def test_bulk_paths_are_recorded(self):
+        stock = Stock.objects.create(pharmacy=self.pharmacy, medicine=self.quinine, quantity=5, price=Decimal(900))
+        import_stocks(self.pharmacy, [
+            {'medicine': self.paracetamol.id, 'quantity': '20', 'price': '500'},
+            {'medicine': self.quinine.id, 'quantity': '8', 'price': '900'},
+        ])
+        self.client.patch(f'{self.stocks_url}batch/', [
+            {'stock_id': stock.id, 'quantity': 6},
+            {'medicine_id': self.paracetamol.id, 'price': '450'},
+        ], format='json')
+
+        self.assertEqual(self.ledger(), [
+            (self.paracetamol.id, 20, 20, 'import'),
+            (self.quinine.id, 3, 8, 'import'),
+            (self.quinine.id, -2, 6, 'inventory'),
+        ])
+        self.assertEqual(StockMovement.objects.filter(stock=stock).count(), 2)
+
+    def test_reservation_decrement_and_restore(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from reservations.models import Reservation, ReservationItem
+
+        stock = Stock.objects.create(pharmacy=self.pharmacy, medicine=self.quinine, quantity=5, price=Decimal(900))
+        reservation = Reservation.objects.create(
+            user=self.customer, pharmacy=self.pharmacy, contact_name='Client', contact_phone='600000000',
+            pickup_date=timezone.now() + timedelta(days=1)
+        )
+        item = ReservationItem.objects.create(
+            reservation=reservation, medicine=self.quinine, stock=stock, quantity=2, unit_price=Decimal(900)
+        )
+        item.decrement_stock()
+        reservation.cancel()
+
+        self.assertEqual(self.ledger(), [
+            (self.quinine.id, -2, 3, 'reservation'),
+            (self.quinine.id, 2, 5, 'restore'),
+        ])
+        self.assertEqual(StockMovement.objects.filter(reservation=reservation).count(), 2)
+
+    def test_ledger_is_append_only(self):
+        stock = Stock.objects.create(pharmacy=self.pharmacy, medicine=self.quinine, quantity=5, price=Decimal(900))
+        movement, = StockMovement.record([StockMovement.for_stock(stock, 5, 'manual')])
+        movement.delta = 1
+        with self.assertRaises(ValueError):
+            movement.save()
+
+    def test_history_is_keyset_paginated(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        stock = Stock.objects.create(pharmacy=self.pharmacy, medicine=self.quinine, quantity=5, price=Decimal(900))
+        start = timezone.now() - timedelta(days=10)
+        StockMovement.record(
+            StockMovement(
+                pharmacy=self.pharmacy, medicine=self.quinine, stock=stock, delta=1,
+                quantity_after=i, reason='manual', created_at=start + timedelta(days=i // 2)
+            )
+            for i in range(1, 11)
+        )
+
+        url = '/api/my-pharmacy/stock-history/'
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['quantity_after'] for row in response.data['results'])
+            cursor = response.data['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, list(range(10, 0, -1)))
+
+        since = timezone.localdate(start + timedelta(days=3)).isoformat()
+        response = self.client.get(url, {'since': since, 'until': since})
+        self.assertEqual([row['quantity_after'] for row in response.data['results']], [7, 6])
+
+        self.assertEqual(self.client.get(url, {'cursor': 'invalide'}).status_code, 400)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class StockSyncTestCase(APITestCase):
+    """Tests pour la synchronisation incrémentale des caisses"""
+
+    def setUp(self):
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacie de la Gare', address='Douala', phone='600000011',
+            latitude=4.05, longitude=9.70
+        )
+        self.owner = User.objects.create_user(
+            username='pharmacien', password='Pass123!', user_type='pharmacy', pharmacy=self.pharmacy
+        )
+        self.medicines = [
+            Medicine.objects.create(name=f'Produit {i}', dosage='10mg', form='comprimé') for i in range(4)
+        ]
+        self.stocks = [
+            Stock.objects.create(pharmacy=self.pharmacy, medicine=medicine, quantity=10, price=Decimal(100))
+            for medicine in self.medicines[:3]
+        ]
+        self.client.force_authenticate(self.owner)
+        self.url = f'/api/pharmacies/{self.pharmacy.id}/stocks/'
+
+    def pull(self, token=None, **params):
+        if token:
+            params['token'] = token
+        response = self.client.get(f'{self.url}changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_initial_then_incremental_sync(self):
+        initial = self.pull()
+        self.assertEqual([row['id'] for row in initial['updated']], [stock.id for stock in self.stocks])
+        self.assertEqual(self.pull(initial['token'])['updated'], [])
+
+        first, second, third = self.stocks
+        self.client.patch(f'{self.url}{first.id}/', {'quantity': 4}, format='json')
+        self.client.patch(f'{self.url}{first.id}/', {'quantity': 3}, format='json')
+        self.client.delete(f'{self.url}{second.id}/')
+        import_stocks(self.pharmacy, [{'medicine': self.medicines[3].id, 'quantity': '2', 'price': '50'}])
+
+        # Le stock modifié deux fois n'apparaît qu'une fois, dans son état actuel
+        delta = self.pull(initial['token'])
+        self.assertEqual([(row['medicine']['id'], row['quantity']) for row in delta['updated']], [
+            (self.medicines[0].id, 3), (self.medicines[3].id, 2),
+        ])
+        self.assertEqual(delta['deleted'], [{'id': second.id, 'medicine': self.medicines[1].id}])
+        self.assertFalse(delta['has_more'])
+
+        # Pagination : toutes les modifications sont lues, page par page
+        token, seen = initial['token'], []
+        while True:
+            page = self.pull(token, limit=2)
+            seen.extend(row['id'] for row in page['updated'])
+            token = page['token']
+            if not page['has_more']:
+                break
+        self.assertIn(first.id, seen)
+        self.assertNotIn(third.id, seen)
+        self.assertEqual(self.pull(token)['updated'], [])
+
+    def test_feed_follows_transaction_order(self):
+        token = self.pull()['token']
+        self.assertEqual(decode_token(token), (0, StockChange.objects.order_by('id').last().id))
+        # Identifiant inférieur validé par une transaction ultérieure (PostgreSQL)
+        late = StockChange.objects.create(
+            pharmacy=self.pharmacy, stock_id=self.stocks[1].id, medicine_id=self.medicines[1].id, transaction_id=9
+        )
+        early = StockChange.objects.create(
+            pharmacy=self.pharmacy, stock_id=self.stocks[2].id, medicine_id=self.medicines[2].id, transaction_id=7
+        )
+        page = self.pull(token, limit=1)
+        self.assertEqual([row['id'] for row in page['updated']], [self.stocks[2].id])
+        self.assertEqual(decode_token(page['token']), (7, early.id))
+        page = self.pull(page['token'])
+        self.assertEqual([row['id'] for row in page['updated']], [self.stocks[1].id])
+        self.assertEqual(decode_token(page['token']), (9, late.id))
+
+        # Ancien jeton (numéro de séquence seul) : toutes les lignes suivantes
+        legacy = encode_cursor([late.id - 1])
+        self.assertEqual(len(self.pull(legacy)['updated']), 2)
+
+    def test_push_diff(self):
+        token = self.pull()['token']
+        response = self.client.post(f'{self.url}sync/', {
+            'upserts': [
+                {'medicine': self.medicines[0].id, 'quantity': 7, 'price': '120'},
+                {'medicine': self.medicines[3].id, 'quantity': 5, 'price': '80'},
+                {'medicine': 999999, 'quantity': 1, 'price': '10'},
+            ],
+            'deletes': [self.medicines[2].id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['deleted'], 1)
+
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(reason='sync').values_list('medicine_id', 'delta')),
+            sorted([(self.medicines[0].id, -3), (self.medicines[3].id, 5), (self.medicines[2].id, -10)]),
+        )
+        delta = self.pull(token)
+        self.assertEqual(len(delta['updated']), 2)
+        self.assertEqual([row['medicine'] for row in delta['deleted']], [self.medicines[2].id])
+
+        response = self.client.post(f'{self.url}sync/', {'deletes': ['x']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_permissions_and_invalid_token(self):
+        self.assertEqual(self.client.get(f'{self.url}changes/', {'token': 'invalide'}).status_code, 400)
+        customer = User.objects.create_user(username='client', password='Pass123!', user_type='customer')
+        self.client.force_authenticate(customer)
+        self.assertEqual(self.client.get(f'{self.url}changes/').status_code, 403)
+        self.assertEqual(self.client.post(f'{self.url}sync/', {}, format='json').status_code, 403)
+
+    def test_compaction_and_pharmacy_deletion(self):
+        token = self.pull()['token']
+        for quantity in (5, 6, 7):
+            self.client.patch(f'{self.url}{self.stocks[0].id}/', {'quantity': quantity}, format='json')
+        call_command('compact_stock_changes', stdout=StringIO())
+        self.assertEqual(StockChange.objects.filter(stock_id=self.stocks[0].id).count(), 1)
+        self.assertEqual([row['quantity'] for row in self.pull(token)['updated']], [7])
 
-# Create your tests here.
+        # Pas de suppression enregistrée pour les stocks d'une pharmacie supprimée
+        self.pharmacy.delete()
+        self.assertFalse(StockChange.objects.exists())
@@ -10,6 +10,25 @@ urlpatterns = [
          PharmacyStockViewSet.as_view({'get': 'list', 'post': 'create'}), 
          name='pharmacy-stocks-list'),
     
+    # Import en masse depuis un fichier CSV ou JSON
+    path('pharmacies/<int:pharmacy_pk>/stocks/import/', 
+         PharmacyStockViewSet.as_view({'post': 'bulk_import'}), 
+         name='pharmacy-stocks-import'),
+    
+    # Modification groupée (inventaire)
+    path('pharmacies/<int:pharmacy_pk>/stocks/batch/', 
+         PharmacyStockViewSet.as_view({'patch': 'batch_update'}), 
+         name='pharmacy-stocks-batch'),
+    
+    # Synchronisation incrémentale des caisses : flux des modifications et envoi d'un diff
+    path('pharmacies/<int:pharmacy_pk>/stocks/changes/', 
+         PharmacyStockViewSet.as_view({'get': 'changes'}), 
+         name='pharmacy-stocks-changes'),
+    
+    path('pharmacies/<int:pharmacy_pk>/stocks/sync/', 
+         PharmacyStockViewSet.as_view({'post': 'sync'}), 
+         name='pharmacy-stocks-sync'),
+    
     # Détail/Modification/Suppression d'un stock
     path('pharmacies/<int:pharmacy_pk>/stocks/<int:pk>/', 
          PharmacyStockViewSet.as_view({
@@ -1,11 +1,20 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 
-from .models import Stock
-from .serializers import StockSerializer, StockCreateUpdateSerializer, StockListSerializer
+from .batch_update import BatchUpdateError, batch_update_stocks
+from .importer import ImportFormatError, import_stocks, iter_records
+from .models import Stock, StockMovement
+from .serializers import (
+    StockSerializer, StockCreateUpdateSerializer, StockListSerializer, StockBatchItemSerializer,
+    StockSyncPushSerializer,
+)
+from .sync import changes_since, decode_token, encode_token, push_changes
 from .permissions import IsPharmacyOwner, IsPharmacyOwnerOrReadOnly
 from pharmacies.models import Pharmacy
 
@@ -30,6 +39,30 @@ class PharmacyStockViewSet(viewsets.ModelViewSet):
         pharmacy_id = self.kwargs.get('pharmacy_pk')
         return Stock.objects.filter(pharmacy_id=pharmacy_id).select_related('medicine', 'pharmacy')
     
+    def _get_locked_object(self):
+        """
+        Stock de l'URL verrouillé jusqu'à la fin de la transaction : la
+        quantité lue reste celle sur laquelle le mouvement est calculé.
+        """
+        queryset = self.get_queryset().select_for_update(of=('self',))
+        instance = get_object_or_404(queryset, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, instance)
+        return instance
+    
+    def _save_with_movement(self, request, partial):
+        """Enregistre la modification et le mouvement de la quantité, stock verrouillé"""
+        with transaction.atomic():
+            instance = self._get_locked_object()
+            previous_quantity = instance.quantity
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            StockMovement.record([
+                StockMovement.for_stock(instance, instance.quantity - previous_quantity, 'manual')
+            ])
+        
+        return Response(StockListSerializer(instance).data)
+    
     def get_serializer_class(self):
         """Utilise différents serializers selon l'action"""
         if self.action in ['create', 'update', 'partial_update']:
@@ -92,8 +125,10 @@ class PharmacyStockViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Créer le stock
-        stock = serializer.save(pharmacy=pharmacy)
+        # Créer le stock et journaliser sa quantité initiale
+        with transaction.atomic():
+            stock = serializer.save(pharmacy=pharmacy)
+            StockMovement.record([StockMovement.for_stock(stock, stock.quantity, 'manual')])
         
         # Retourner avec le serializer de liste
         return Response(
@@ -119,12 +154,7 @@ class PharmacyStockViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
         
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=False)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        
-        return Response(StockListSerializer(instance).data)
+        return self._save_with_movement(request, partial=False)
     
     @extend_schema(
         summary="Modifier partiellement un stock",
@@ -144,12 +174,7 @@ class PharmacyStockViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
         
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=True)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        
-        return Response(StockListSerializer(instance).data)
+        return self._save_with_movement(request, partial=True)
     
     @extend_schema(
         summary="Supprimer un stock",
@@ -168,7 +193,14 @@ class PharmacyStockViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
         
-        return super().destroy(request, *args, **kwargs)
+        with transaction.atomic():
+            instance = self._get_locked_object()
+            movement = StockMovement.for_stock(instance, -instance.quantity, 'manual')
+            movement.quantity_after = 0
+            # Le mouvement est conservé (stock mis à NULL) après la suppression
+            StockMovement.record([movement])
+            instance.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
     
     @extend_schema(
         summary="Marquer un stock comme indisponible",
@@ -215,3 +247,166 @@ class PharmacyStockViewSet(viewsets.ModelViewSet):
         stock.save()
         
         return Response(StockListSerializer(stock).data)
+    
+    @extend_schema(
+        summary="Importer des stocks en masse",
+        description="Importe un fichier CSV ou JSON (champ multipart \"file\") de stocks : chaque ligne "
+                    "désigne un médicament par \"medicine\" (identifiant) ou par \"name\", \"dosage\" "
+                    "et \"form\", avec \"quantity\", \"price\" et \"is_available\" (optionnel). "
+                    "Les stocks existants sont mis à jour. Retourne un rapport avec les erreurs par ligne.",
+        parameters=[
+            OpenApiParameter(
+                name='format',
+                type=str,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                description='csv ou json (défaut : selon l\'extension du fichier)'
+            ),
+        ],
+        responses={200: None}
+    )
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FormParser])
+    def bulk_import(self, request, pharmacy_pk=None):
+        """Importe un fichier de stocks pour la pharmacie"""
+        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_pk)
+        
+        # Vérifier les permissions
+        if not request.user.is_superuser:
+            if not hasattr(request.user, 'pharmacy') or request.user.pharmacy_id != int(pharmacy_pk):
+                return Response(
+                    {'detail': 'Vous n\'avez pas la permission de modifier cette pharmacie'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        
+        uploaded_file = request.FILES.get('file')
+        if uploaded_file is None:
+            return Response(
+                {'detail': 'Le fichier à importer (champ "file") est obligatoire'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            records = iter_records(uploaded_file, request.query_params.get('format'))
+            report = import_stocks(pharmacy, records)
+        except (ImportFormatError, UnicodeDecodeError) as error:
+            return Response(
+                {'detail': f'Fichier illisible : {error}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(report.as_dict())
+    
+    @extend_schema(
+        summary="Modifier plusieurs stocks",
+        description="Applique une liste de modifications {stock_id | medicine_id, quantity, price, "
+                    "is_available} aux stocks de la pharmacie, en une seule transaction. "
+                    "Retourne uniquement les stocks effectivement modifiés.",
+        request=StockBatchItemSerializer(many=True),
+        responses={200: StockListSerializer(many=True)}
+    )
+    @action(detail=False, methods=['patch'], url_path='batch')
+    def batch_update(self, request, pharmacy_pk=None):
+        """Met à jour plusieurs stocks de la pharmacie en une fois"""
+        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_pk)
+        
+        # Vérifier les permissions (une seule fois pour tout le lot)
+        if not request.user.is_superuser:
+            if not hasattr(request.user, 'pharmacy') or request.user.pharmacy_id != int(pharmacy_pk):
+                return Response(
+                    {'detail': 'Vous n\'avez pas la permission de modifier cette pharmacie'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        
+        if not isinstance(request.data, list):
+            return Response(
+                {'detail': 'Le corps de la requête doit être une liste de modifications'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(request.data) > settings.STOCK_BATCH_MAX_ITEMS:
+            return Response(
+                {'detail': f'Au plus {settings.STOCK_BATCH_MAX_ITEMS} modifications par requête'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = StockBatchItemSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            changed = batch_update_stocks(pharmacy, serializer.validated_data)
+        except BatchUpdateError as error:
+            return Response(
+                {'detail': 'Certains stocks sont introuvables', 'errors': error.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(StockListSerializer(changed, many=True).data)
+    
+    @extend_schema(
+        summary="Flux des modifications de stocks (synchronisation caisse)",
+        description="Retourne les stocks modifiés et supprimés depuis le jeton \"token\" (tous les "
+                    "stocks sans jeton), avec le jeton à renvoyer à la synchronisation suivante. "
+                    "Si \"has_more\" est vrai, la page suivante peut être lue immédiatement.",
+        parameters=[
+            OpenApiParameter(name='token', type=str, location=OpenApiParameter.QUERY, required=False,
+                             description='Jeton retourné par la synchronisation précédente'),
+            OpenApiParameter(name='limit', type=int, location=OpenApiParameter.QUERY, required=False,
+                             description='Nombre maximal de modifications lues'),
+        ],
+        responses={200: None}
+    )
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request, pharmacy_pk=None):
+        """Modifications des stocks de la pharmacie depuis un jeton"""
+        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_pk)
+        
+        # Vérifier les permissions
+        if not request.user.is_superuser:
+            if not hasattr(request.user, 'pharmacy') or request.user.pharmacy_id != int(pharmacy_pk):
+                return Response(
+                    {'detail': 'Vous n\'avez pas la permission de synchroniser cette pharmacie'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        
+        try:
+            position = decode_token(request.query_params.get('token'))
+            limit = int(request.query_params.get('limit', settings.STOCK_SYNC_PAGE_SIZE))
+        except ValueError:
+            return Response({'detail': 'Jeton ou limite invalide'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.STOCK_SYNC_MAX_PAGE_SIZE))
+        
+        stocks, deleted, position, has_more = changes_since(pharmacy, position, limit)
+        return Response({
+            'updated': StockListSerializer(stocks, many=True).data,
+            'deleted': deleted,
+            'token': encode_token(position),
+            'has_more': has_more,
+        })
+    
+    @extend_schema(
+        summary="Envoyer les modifications d'une caisse",
+        description="Applique en une transaction un diff de caisse : \"upserts\" (lignes au format de "
+                    "l'import en masse) et \"deletes\" (identifiants des médicaments retirés du stock). "
+                    "Retourne le rapport d'import et le nombre de stocks supprimés.",
+        request=StockSyncPushSerializer,
+        responses={200: None}
+    )
+    @action(detail=False, methods=['post'], url_path='sync')
+    def sync(self, request, pharmacy_pk=None):
+        """Applique le diff envoyé par la caisse de la pharmacie"""
+        pharmacy = get_object_or_404(Pharmacy, id=pharmacy_pk)
+        
+        # Vérifier les permissions
+        if not request.user.is_superuser:
+            if not hasattr(request.user, 'pharmacy') or request.user.pharmacy_id != int(pharmacy_pk):
+                return Response(
+                    {'detail': 'Vous n\'avez pas la permission de modifier cette pharmacie'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        
+        serializer = StockSyncPushSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        report, deleted = push_changes(
+            pharmacy, serializer.validated_data['upserts'], serializer.validated_data['deletes']
+        )
+        return Response({**report.as_dict(), 'deleted': deleted})
@@ -0,0 +1,32 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0004_user_approval_status_user_approved_at_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="searchhistory",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Utilisateur ayant effectué la recherche (vide pour une recherche anonyme)",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="search_history",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="searchhistory",
+            name="weight",
+            field=models.PositiveIntegerField(
+                default=1,
+                help_text="Nombre de recherches représentées par cette ligne (échantillonnage des recherches anonymes)",
+            ),
+        ),
+    ]
@@ -151,7 +151,9 @@ class SearchHistory(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='search_history',
-        help_text="Utilisateur ayant effectué la recherche"
+        null=True,
+        blank=True,
+        help_text="Utilisateur ayant effectué la recherche (vide pour une recherche anonyme)"
     )
     
     query = models.CharField(
@@ -171,6 +173,11 @@ class SearchHistory(models.Model):
         help_text="Nombre de résultats trouvés"
     )
     
+    weight = models.PositiveIntegerField(
+        default=1,
+        help_text="Nombre de recherches représentées par cette ligne (échantillonnage des recherches anonymes)"
+    )
+    
     created_at = models.DateTimeField(
         auto_now_add=True,
         help_text="Date et heure de la recherche"
@@ -186,7 +193,8 @@ class SearchHistory(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.user.username} - {self.query} ({self.get_search_type_display()})"
+        username = self.user.username if self.user_id else 'anonyme'
+        return f"{username} - {self.query} ({self.get_search_type_display()})"
 
 
 class EmailVerification(models.Model):
@@ -0,0 +1,206 @@
+"""
+Enregistrement asynchrone de l'historique des recherches.
+
+Les vues de recherche n'écrivent pas ``SearchHistory`` elles-mêmes : elles
+déposent un événement dans un tampon en mémoire (``record``) et un thread
+de fond l'écrit en base par lots avec ``bulk_create``, dès que
+``SEARCH_HISTORY_BATCH_SIZE`` événements sont en attente ou au plus tard
+toutes les ``SEARCH_HISTORY_FLUSH_INTERVAL`` secondes. Le chemin de la
+requête ne fait donc aucune écriture synchrone.
+
+Les recherches anonymes sont échantillonnées au taux
+``SEARCH_HISTORY_ANONYMOUS_SAMPLE_RATE`` ; chaque ligne conservée porte un
+``weight`` égal à l'inverse du taux pour que les statistiques restent
+justes. Le tampon est borné (``SEARCH_HISTORY_MAX_BUFFER``) : au-delà, les
+nouveaux événements sont comptés comme perdus plutôt que de faire grossir
+la mémoire du worker.
+
+À l'arrêt du processus (``atexit``), le thread est arrêté et le tampon
+vidé en base. Le recorder est propre à chaque processus ; après un
+``fork`` le tampon hérité est abandonné et un nouveau thread est démarré.
+"""
+import atexit
+import logging
+import os
+import random
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class SearchHistoryRecorder:
+    """
+    Tampon d'événements de recherche et thread d'écriture par lots.
+
+    ``record`` et ``flush`` sont thread-safe.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, sample_rate=None,
+                 max_buffer=None, background=None):
+        self.batch_size = batch_size or getattr(settings, 'SEARCH_HISTORY_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'SEARCH_HISTORY_FLUSH_INTERVAL', 5)
+        self.sample_rate = sample_rate if sample_rate is not None else getattr(
+            settings, 'SEARCH_HISTORY_ANONYMOUS_SAMPLE_RATE', 0.1
+        )
+        self.max_buffer = max_buffer or getattr(settings, 'SEARCH_HISTORY_MAX_BUFFER', 10000)
+        self.background = background if background is not None else getattr(
+            settings, 'SEARCH_HISTORY_BACKGROUND', True
+        )
+        self._lock = threading.Lock()
+        # Une seule écriture à la fois (thread de fond, atexit, flush explicite)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        # Un seul gestionnaire atexit (hérité par les processus enfants)
+        self._exit_registered = False
+        self._pid = os.getpid()
+        self._buffer = []
+        self.recorded = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def anonymous_weight(self):
+        """Nombre de recherches anonymes représentées par une ligne conservée"""
+        return max(1, round(1 / self.sample_rate)) if self.sample_rate > 0 else 0
+
+    def record(self, user, query, search_type, results_count=0):
+        """
+        Dépose une recherche dans le tampon, sans accès à la base.
+
+        ``user`` est l'utilisateur de la requête ; les anonymes sont
+        échantillonnés.
+        """
+        query = (query or '').strip()[:255]
+        if not query:
+            return
+
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        weight = 1
+        if user_id is None:
+            if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+                with self._lock:
+                    self.sampled_out += 1
+                return
+            weight = self.anonymous_weight
+
+        with self._lock:
+            self._check_fork()
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append((user_id, query, search_type, results_count, weight))
+            self.recorded += 1
+            full = len(self._buffer) >= self.batch_size
+            if self.background and self._thread is None and not self._stopping:
+                self._start()
+
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        """Nombre d'événements en attente d'écriture"""
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        """
+        Écrit en base tous les événements en attente, par lots de
+        ``batch_size``. Retourne le nombre de lignes écrites.
+        """
+        from .models import SearchHistory
+
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+
+            rows = [
+                SearchHistory(
+                    user_id=user_id,
+                    query=query,
+                    search_type=search_type,
+                    results_count=results_count,
+                    weight=weight,
+                )
+                for user_id, query, search_type, results_count, weight in events
+            ]
+            try:
+                SearchHistory.objects.bulk_create(rows, batch_size=self.batch_size)
+            except Exception:
+                # L'historique est secondaire : on journalise et on perd le lot
+                logger.exception("Écriture de %d recherches dans l'historique impossible", len(rows))
+                with self._lock:
+                    self.dropped += len(rows)
+                return 0
+
+            with self._lock:
+                self.written += len(rows)
+            return len(rows)
+
+    def discard(self):
+        """Vide le tampon sans rien écrire (tests)"""
+        with self._lock:
+            self._buffer = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._buffer),
+                'recorded': self.recorded,
+                'sampled_out': self.sampled_out,
+                'dropped': self.dropped,
+                'written': self.written,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'sample_rate': self.sample_rate,
+            }
+
+    # Thread de fond
+
+    def _check_fork(self):
+        # Le thread du processus parent n'existe pas dans l'enfant
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._buffer = []
+            self._thread = None
+            self._wakeup = threading.Event()
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='search-history-flusher', daemon=True
+        )
+        self._thread.start()
+        if not self._exit_registered:
+            atexit.register(self.stop)
+            self._exit_registered = True
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=10):
+        """Arrête le thread de fond et vide le tampon (appelé à l'arrêt)"""
+        self._stopping = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+
+search_recorder = SearchHistoryRecorder()
@@ -4,6 +4,7 @@ from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User, SearchHistory
+from .search_recorder import SearchHistoryRecorder, search_recorder
 
 
 class UserRegistrationTestCase(APITestCase):
@@ -366,3 +367,96 @@ class SearchHistoryTestCase(TestCase):
         
         # Les recherches de l'utilisateur devraient être supprimées
         self.assertEqual(SearchHistory.objects.filter(user_id=user_id).count(), 0)
+
+
+class SearchHistoryRecorderTestCase(APITestCase):
+    """Tests de l'enregistrement asynchrone de l'historique des recherches"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='searcher',
+            email='searcher@example.com',
+            password='TestPass123!',
+            user_type='customer'
+        )
+        search_recorder.discard()
+    
+    def test_record_does_not_write(self):
+        """Enregistrer une recherche ne touche pas la base"""
+        recorder = SearchHistoryRecorder(background=False)
+        with self.assertNumQueries(0):
+            recorder.record(self.user, 'Doliprane', 'medicine', 3)
+        self.assertEqual(recorder.pending(), 1)
+        self.assertEqual(SearchHistory.objects.count(), 0)
+    
+    def test_flush_writes_in_batches(self):
+        """Le flush écrit le tampon par lots de batch_size"""
+        recorder = SearchHistoryRecorder(batch_size=2, background=False)
+        for query in ('Doliprane', 'Efferalgan', 'Amoxicilline'):
+            recorder.record(self.user, query, 'medicine', 1)
+        
+        with self.assertNumQueries(2):
+            written = recorder.flush()
+        self.assertEqual(written, 3)
+        self.assertEqual(recorder.pending(), 0)
+        self.assertEqual(self.user.search_history.count(), 3)
+        self.assertEqual(recorder.flush(), 0)
+    
+    def test_anonymous_searches_are_sampled(self):
+        """Les recherches anonymes conservées portent le poids de l'échantillon"""
+        from django.contrib.auth.models import AnonymousUser
+        
+        recorder = SearchHistoryRecorder(sample_rate=0.25, background=False)
+        for _ in range(400):
+            recorder.record(AnonymousUser(), 'Doliprane', 'medicine')
+        recorder.flush()
+        
+        kept = SearchHistory.objects.filter(user__isnull=True)
+        self.assertEqual(kept.count() + recorder.sampled_out, 400)
+        self.assertGreater(kept.count(), 40)
+        self.assertLess(kept.count(), 200)
+        self.assertEqual(set(kept.values_list('weight', flat=True)), {4})
+        
+        none = SearchHistoryRecorder(sample_rate=0, background=False)
+        none.record(AnonymousUser(), 'Doliprane', 'medicine')
+        self.assertEqual(none.pending(), 0)
+    
+    def test_buffer_is_bounded(self):
+        """Au-delà de max_buffer, les événements sont perdus et comptés"""
+        recorder = SearchHistoryRecorder(max_buffer=2, background=False)
+        for _ in range(3):
+            recorder.record(self.user, 'Doliprane', 'medicine')
+        self.assertEqual(recorder.pending(), 2)
+        self.assertEqual(recorder.dropped, 1)
+    
+    def test_stop_drains_buffer(self):
+        """L'arrêt vide le tampon en base"""
+        recorder = SearchHistoryRecorder(background=False)
+        recorder.record(self.user, 'Doliprane', 'medicine')
+        recorder.stop()
+        self.assertEqual(self.user.search_history.count(), 1)
+    
+    def test_exit_handler_registered_once(self):
+        """Redémarrer le thread (après un fork) n'empile pas les gestionnaires atexit"""
+        from unittest import mock
+        
+        recorder = SearchHistoryRecorder(background=True, flush_interval=60)
+        with mock.patch('users.search_recorder.atexit.register') as register:
+            recorder.record(self.user, 'Doliprane', 'medicine')
+            # Processus enfant simulé : le thread est relancé
+            recorder._pid = -1
+            recorder.record(self.user, 'Efferalgan', 'medicine')
+        self.assertEqual(register.call_count, 1)
+        recorder.discard()
+        recorder.stop()
+    
+    def test_search_endpoints_record_history(self):
+        """La recherche et les pharmacies proches alimentent le tampon"""
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/search/', {'q': 'introuvable'})
+        self.client.get('/api/nearby/', {'latitude': 3.848, 'longitude': 11.502})
+        self.assertEqual(SearchHistory.objects.count(), 0)
+        
+        search_recorder.flush()
+        history = {(h.search_type, h.query, h.results_count) for h in self.user.search_history.all()}
+        self.assertEqual(history, {('medicine', 'introuvable', 0), ('nearby', '3.8480,11.5020', 0)})